@@ -0,0 +1,181 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from time import time
+import numpy as np
+from activityfunctions.getnfslist import Nfsbloblist
+from services.auth_service import AuthService
+from services.collector_service import CollectorService, EXPOSITION_NAME, STATUS_NAME
+from services.monitor_service import MonitorService
+from services.promethus_service import Promethus
+from shared_code.records import AccountTable, resource_key
+from shared_code.result_store import get_result_store
+from shared_code.telemetry import Telemetry
+
+class Collector:
+    # state of the last tick run by this worker, reused while no other worker ran one since
+    _state=None
+
+    def __init__(self) -> None:
+        pass
+
+    async def tickfunction(now: float = None):
+        """One tick of the continuous collector: refreshes the accounts due and rewrites the cache
+
+        The inventory is refreshed every 'CollectorInventorySeconds' (default 3600). The
+        accounts of each credential key that CollectorService.select picks are fetched with
+        MonitorService, merged into the cached records of the key and rescheduled. The
+        records, schedules and exposition (collector/metrics.txt) go to the result store,
+        then collector/status.json, which the scrape endpoint reads first.
+        """
+        now=now if now is not None else time()
+        store=get_result_store()
+        telemetry=Telemetry.default()
+        with telemetry.stage("collector_tick"):
+            state=await Collector._load(store)
+            if not state['keys'] or now-state['inventory_at']>=float(os.getenv('CollectorInventorySeconds','3600')):
+                await Collector._refresh_inventory(state,now)
+            elapsed=now-state['tick_at'] if state['tick_at'] else 0.0
+            # a long pause (e.g. a restart) must not turn into a burst
+            elapsed=min(max(elapsed,0.0),float(os.getenv('CollectorMaxElapsedSeconds','600')))
+
+            refreshed=0
+            overdue=0
+            for key,entry in state['keys'].items():
+                due=CollectorService.select(entry['schedule'],now,elapsed)
+                if len(due):
+                    refreshed+=await Collector._refresh(key,entry,due,now)
+                overdue+=int(np.sum(entry['schedule']['next_due']<=now))
+            telemetry.inc("blobnfs_self_collector_refreshed",refreshed)
+            telemetry.set("blobnfs_self_collector_overdue",overdue)
+            state['tick_at']=now
+            summary=await Collector._save(store,state,now)
+        logging.info(f"Collector refreshed {refreshed} of {summary['accounts']} accounts, {overdue} still due")
+        return {**summary,"refreshed":refreshed,"overdue":overdue}
+
+    async def _refresh(key: str, entry: dict, due: np.ndarray, now: float):
+        table=entry['table']
+        schedule=entry['schedule']
+        indices=due.tolist()
+        credential,cloud=AuthService.get_credential(key)
+        metric_set=MonitorService.parse_metric_set(os.getenv('MetricSet', 'UsedCapacity:average'))
+        times_before=np.array(table.times,dtype=float)[due]
+        before=Collector._values(table,due)
+        try:
+            async with credential:
+                fetched=await MonitorService.get_metrics_for_data(
+                    credential=credential,
+                    data=table.take(indices),
+                    metricnames=",".join(metric_set),
+                    metric_set=metric_set,
+                    num_threads=int(os.getenv('MetricConcurrency', '16')),
+                    timeout=float(os.getenv('MetricTimeoutSeconds', '120')),
+                    cloud=cloud,
+                    credential_key=key,
+                    # the window ends at the tick, as the schedule sees it
+                    timestamp=datetime.fromtimestamp(now,timezone.utc).replace(tzinfo=None).isoformat()
+                )
+        except Exception as e:
+            logging.error(f"Failed to refresh {len(indices)} accounts of {key} {e}")
+            CollectorService.reschedule(schedule,due,times_before,np.full(len(due),np.nan),np.zeros(len(due),dtype=bool),now)
+            return 0
+        table.assign(indices,fetched)
+        changed=Collector._changed(before,Collector._values(table,due),len(due))
+        CollectorService.reschedule(schedule,due,times_before,np.array(table.times,dtype=float)[due],changed,now)
+        return len(indices)
+
+    def _values(table: AccountTable, due: np.ndarray):
+        return {key:np.array(column,dtype=float)[due] for key,column in table.values.items()}
+
+    def _changed(before: dict, after: dict, n: int):
+        """Whether any metric value of each account differs, a value appearing or going included"""
+        changed=np.zeros(n,dtype=bool)
+        for key,values in after.items():
+            previous=before.get(key,np.full(n,np.nan))
+            changed|=~((values==previous)|(np.isnan(values)&np.isnan(previous)))
+        return changed
+
+    async def _refresh_inventory(state: dict, now: float):
+        inventories=await Nfsbloblist.getnfsbloblistfunction()
+        if inventories is None:
+            # keep serving the known accounts, the next tick tries again
+            return
+        keys={}
+        for inventory in inventories:
+            key=inventory['credential_key']
+            table=AccountTable.from_wire(inventory['data'])
+            account_keys=[resource_key(resource_id) for resource_id in table.columns['id']]
+            groups=[
+                f"{str(subscription or '').lower()}/{str(location or '').lower()}"
+                for subscription,location in zip(table.columns['subscriptionId'],table.columns['location'])
+            ]
+            previous=state['keys'].get(key)
+            schedule=CollectorService.align(previous['schedule'] if previous else None,account_keys,groups)
+            if previous:
+                # the values of the accounts still there carry over
+                rows={account:index for index,account in enumerate(previous['schedule']['keys'])}
+                kept=[(index,rows[account]) for index,account in enumerate(account_keys) if account in rows]
+                table.assign([index for index,_ in kept],previous['table'].take([row for _,row in kept]))
+            keys[key]={"table":table,"schedule":schedule}
+        state['keys']=keys
+        state['inventory_at']=now
+        logging.info(f"Collector inventory of {sum(len(entry['table']) for entry in keys.values())} accounts")
+
+    def _folder(key: str):
+        return "collector/"+hashlib.sha1(key.encode()).hexdigest()[:16]
+
+    async def _load(store):
+        """State of the collector, from memory unless another worker ticked since"""
+        body=await store.read(STATUS_NAME)
+        status=json.loads(body) if body is not None else None
+        state=Collector._state
+        if status is None:
+            if state is None:
+                state=Collector._state={"generation":0,"tick_at":0.0,"inventory_at":0.0,"keys":{}}
+            return state
+        if state is not None and state['generation']==status['generation']:
+            return state
+        keys={}
+        for key in status['keys']:
+            records=await store.read(f"{Collector._folder(key)}/records.json")
+            schedule=await store.read(f"{Collector._folder(key)}/schedule.json")
+            if records is None or schedule is None:
+                logging.warning(f"Collector state of {key} not found, its accounts start over")
+                continue
+            keys[key]={"table":AccountTable.from_json(records),"schedule":CollectorService.from_json(schedule)}
+        Collector._state={
+            "generation":status['generation'],
+            "tick_at":status['tick_at'],
+            # a key lost above comes back with the next inventory
+            "inventory_at":status['inventory_at'] if len(keys)==len(status['keys']) else 0.0,
+            "keys":keys
+        }
+        return Collector._state
+
+    async def _save(store, state: dict, now: float):
+        for key,entry in state['keys'].items():
+            await store.write(f"{Collector._folder(key)}/records.json",entry['table'].json_chunks())
+            await store.write(f"{Collector._folder(key)}/schedule.json",[CollectorService.to_json(entry['schedule'])])
+        table=AccountTable.concat([entry['table'] for entry in state['keys'].values()])
+        self_metrics=os.getenv('SelfMetrics','true').strip().lower()=='true'
+        # the ticks may run on any instance, the counters go on from the totals in the store
+        totals=await Telemetry.accumulate(store,Telemetry.default().drain()) if self_metrics else None
+        size=await store.write(EXPOSITION_NAME,Promethus.stream(table,totals))
+        state['generation']+=1
+        summary={
+            "generation":state['generation'],
+            "tick_at":state['tick_at'],
+            "inventory_at":state['inventory_at'],
+            "updated_at":now,
+            "keys":list(state['keys']),
+            "exposition":EXPOSITION_NAME,
+            "accounts":len(table),
+            "missing":table.missing(),
+            "stale":sum(table.stale),
+            "bytes":size
+        }
+        # written last, a reader never sees a generation before its objects
+        await store.write(STATUS_NAME,[json.dumps(summary)])
+        return summary
@@ -1,13 +1,68 @@
 import logging
+import math
+import os
+from typing import Optional
+from shared_code.records import AccountTable
 
 class Divide:
     def __init__(self) -> None:
         pass
 
-    def divide_list(List):
-        for i in range(0,len(List),1): 
-            yield List[i:i + 1] 
+    def divide_list(List, size: int = 1):
+        for i in range(0,len(List),size): 
+            yield List[i:i + size] 
 
-    def dividefunction(name):
-        dividedlist=list(Divide.divide_list(name))
-        return dividedlist
\ No newline at end of file
+    def group_key(account):
+        """Key used to keep accounts that share clients and API scopes in the same batch"""
+        return (
+            str(account.get('subscriptionId') or '').lower(),
+            str(account.get('location') or '').lower()
+        )
+
+    def get_batch_size(n_accounts: int, batch_size: Optional[int] = None) -> int:
+        """Returns the number of accounts handled by a single metric activity
+
+        A fixed size can be given as argument or through the 'MetricBatchSize' setting.
+        Otherwise ('auto') the size adapts to the fleet so that no more than
+        'MaxMetricActivities' activities are scheduled per credential key, bounded by
+        'MinMetricBatchSize' and 'MaxMetricBatchSize'.
+        """
+        if batch_size is None:
+            configured = os.getenv('MetricBatchSize', 'auto').strip().lower()
+            if configured and configured != 'auto':
+                batch_size = int(configured)
+
+        if batch_size is None:
+            max_activities = int(os.getenv('MaxMetricActivities', '50'))
+            min_size = int(os.getenv('MinMetricBatchSize', '20'))
+            max_size = int(os.getenv('MaxMetricBatchSize', '500'))
+            batch_size = math.ceil(n_accounts / max(max_activities, 1))
+            batch_size = min(max(batch_size, min_size), max_size)
+
+        return max(batch_size, 1)
+
+    def split_by_subscription(name):
+        """Splits the accounts of one credential key per subscription, in the wire schema"""
+        accounts = AccountTable.from_wire(name)
+        subscriptions = {}
+        for index, account in enumerate(accounts):
+            subscriptions.setdefault(Divide.group_key(account)[0], []).append(index)
+        logging.info(f"Split accounts into {len(subscriptions)} subscriptions")
+        return [accounts.take(indices).to_wire() for _, indices in sorted(subscriptions.items())]
+
+    def dividefunction(name, batch_size: Optional[int] = None):
+        """Splits the accounts of one credential key into batches for the metric activities
+
+        Accounts are ordered by subscription and region before slicing, so each batch
+        spans as few (subscription, region) groups as possible. Input and batches are in
+        the compact wire schema (plain lists of rows are accepted too).
+        """
+        accounts = AccountTable.from_wire(name)
+        if not len(accounts):
+            return []
+        size = Divide.get_batch_size(len(accounts), batch_size)
+        # the accounts stay in one table, only their indices are sorted and sliced
+        ordered = sorted(range(len(accounts)), key=lambda index: Divide.group_key(accounts[index]))
+        dividedlist=[accounts.take(batch).to_wire() for batch in Divide.divide_list(ordered, size)]
+        logging.info(f"Divided {len(accounts)} accounts into {len(dividedlist)} batches of up to {size}")
+        return dividedlist
@@ -0,0 +1,83 @@
+import json
+import logging
+import os
+from services.promethus_service import Promethus
+from services.push_service import PushService
+from shared_code.records import AccountTable
+from shared_code.result_store import get_result_store
+from shared_code.telemetry import Telemetry
+
+class Exposition:
+    def __init__(self) -> None:
+        pass
+
+    async def exposefunction(scrape):
+        """Writes the exposition text of a scrape from the metric records of its parts
+
+        Returns the summary kept as the orchestration output: the scrape ID, the name of the
+        exposition object and the number of accounts, accounts without metrics, stale accounts
+        and bytes.
+        Unless 'SelfMetrics' is false, the telemetry of the activities (the objects listed
+        in 'telemetry' and those of the parts) is added to the running totals exported as
+        the blobnfs_self_* families.
+        """
+        store=get_result_store()
+        self_metrics=os.getenv('SelfMetrics','true').strip().lower()=='true'
+        telemetry=Telemetry.default()
+        tables=[]
+        telemetry_names=list(scrape.get('telemetry') or [])
+        # the stage covers the reads, writing the exposition cannot be timed inside itself
+        with telemetry.stage("exposition"):
+            for part in scrape['parts']:
+                if part is None:
+                    # the metric activity failed, its accounts are missing from this scrape
+                    continue
+                records=await store.read(part['records'])
+                if records is None:
+                    logging.error(f"Metric records '{part['records']}' not found")
+                    continue
+                tables.append(AccountTable.from_json(records))
+                if part.get('telemetry'):
+                    telemetry_names.append(part['telemetry'])
+
+            merged=None
+            if self_metrics:
+                merged=Telemetry()
+                for telemetry_name in telemetry_names:
+                    snapshot=await store.read(telemetry_name)
+                    if snapshot is not None:
+                        merged.merge(json.loads(snapshot))
+        metriclist=AccountTable.concat(tables)
+        totals=None
+        if merged is not None:
+            merged.merge(telemetry.drain())
+            # the counts of this scrape only, the exported counters are the running totals
+            totals=await Telemetry.accumulate(store,merged.snapshot())
+
+        exposition_name=f"{scrape['scrape_id']}/metrics.txt"
+        size=await store.write(exposition_name,Promethus.stream(metriclist,totals))
+        logging.info(f"Wrote {size} bytes of exposition for {len(metriclist)} accounts")
+
+        pushed=[part['pushed'] for part in scrape['parts'] if part is not None and part.get('pushed')]
+        # a scrape without any part left must not empty the Pushgateway
+        if PushService.mode()=='pushgateway' and pushed:
+            try:
+                deleted=await PushService.prune(pushed)
+                if deleted:
+                    logging.info(f"Deleted {deleted} Pushgateway groups not pushed by this scrape")
+            except Exception as e:
+                logging.warning(f"Could not prune the Pushgateway groups {e}")
+
+        try:
+            await store.prune(float(os.getenv('ResultRetentionSeconds','3600')))
+        except Exception as e:
+            logging.warning(f"Could not prune old scrape results {e}")
+
+        return {
+            "scrape_id":scrape['scrape_id'],
+            "exposition":exposition_name,
+            "accounts":len(metriclist),
+            "missing":metriclist.missing(),
+            "stale":sum(metriclist.stale),
+            "bytes":size
+        }
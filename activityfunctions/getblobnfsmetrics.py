@@ -1,24 +1,84 @@
 import logging
 import json
-from services.auth_service import AuthService
+import os
 import asyncio
+from time import time
 import azure.functions as func
 from services.auth_service import AuthService
 from services.monitor_service import MonitorService
+from services.assignment_service import AssignmentService
+from services.push_service import PushService
+from shared_code.client_pool import ClientPool
+from shared_code.latency import LatencyTracker
+from shared_code.result_store import get_result_store
+from shared_code.telemetry import Telemetry
+from shared_code.records import AccountTable
 
 class Blobnfsmetrics:
     def __init__(self) -> None:
         pass
 
     async def nfsmetricfunction(name):
+        """Fetches the metrics of a whole batch of accounts over shared clients"""
         credential,cloud=AuthService.get_credential(name['credential_key'])
-        #print("Name Data")
-        #print(name['data'])
-        async with credential:
-            metric=await MonitorService.get_metrics_for_data(
-                credential=credential,
-                data=name['data'],
-                metricnames="UsedCapacity"
-            )
-        logging.info(metric)  
-        return metric
+        num_threads=int(os.getenv('MetricConcurrency', '16'))
+        # upper bound per request, the actual timeout adapts to the observed latency
+        timeout=float(os.getenv('MetricTimeoutSeconds', '120'))
+        # every metric and aggregation of the set comes back from the same request
+        metric_set=MonitorService.parse_metric_set(os.getenv('MetricSet', 'UsedCapacity:average'))
+        t0=time()
+        telemetry=Telemetry.default()
+        with telemetry.stage("metric_batch",credential_key=name['credential_key']):
+            async with credential:
+                metric=await MonitorService.get_metrics_for_data(
+                    credential=credential,
+                    data=AccountTable.from_wire(name['data']),
+                    metricnames=",".join(metric_set),
+                    metric_set=metric_set,
+                    num_threads=num_threads,
+                    timeout=timeout,
+                    cloud=cloud,
+                    credential_key=name['credential_key']
+                )
+        logging.info(f"Fetched metrics for a batch of {len(metric)} accounts")
+        if metric:
+            await AssignmentService.record_latency(name['credential_key'],(time()-t0)/len(metric))
+        logging.info(f"Client pool status: {ClientPool.stats()}")
+        logging.info(f"Token cache status: {AuthService.token_stats()}")
+        logging.info(f"Request latency status: {LatencyTracker.default().stats()}")
+        pushed=None
+        if PushService.mode()!='off':
+            # visible downstream now, rather than once the last activity of the scrape is done
+            pushed=await Blobnfsmetrics._push(metric,name.get('part',name['credential_key']))
+        if name.get('scrape_id') is None:
+            return metric.to_rows()
+        # keep the records out of the durable history, the orchestrator only gets a summary
+        records_name=f"{name['scrape_id']}/records/{name['part']}.json"
+        store=get_result_store()
+        await store.write(records_name,metric.json_chunks())
+        # what this worker recorded since the last activity, merged by the exposition
+        telemetry_name=f"{name['scrape_id']}/telemetry/{name['part']}.json"
+        try:
+            await store.write(telemetry_name,[json.dumps(telemetry.drain())])
+        except Exception as e:
+            logging.warning(f"Could not write the telemetry of part {name['part']} {e}")
+            telemetry_name=None
+        return {
+            "records":records_name,
+            "telemetry":telemetry_name,
+            "accounts":len(metric),
+            "missing":metric.missing(),
+            # the Pushgateway group of the part, the exposition deletes the others
+            "pushed":pushed
+        }
+
+    async def _push(metric: AccountTable, part: str):
+        """Pushes the records of a part, returns its grouping key, kept by the prune even if the push failed"""
+        group={"part":part}
+        try:
+            samples=await PushService.push(metric,group)
+            logging.info(f"Pushed {samples} samples of part {part}")
+        except Exception as e:
+            # the records still reach the exposition, only the push is lost
+            logging.error(f"Failed to push the metrics of part {part} {e}")
+        return group
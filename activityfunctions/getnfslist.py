@@ -2,47 +2,74 @@ from services.auth_service import AuthService
 from services.subscription_service import SubscriptionService
 import asyncio
 from services.graph_service import GraphService
+from services.inventory_service import InventoryService
+from services.assignment_service import AssignmentService
+from shared_code.result_store import get_result_store
+from shared_code.telemetry import Telemetry
+from shared_code.wire import encode_rows, encoded_size
+import json
 import logging
 class Nfsbloblist:
     def __init__(self) -> None:
         pass
     
-    async def _get_query_result(credential_key:str):
-        credential,cloud=AuthService.get_credential(credential_key)
-        query = f"""resourcecontainers 
+    def _build_query(resource_filter: str = "") -> str:
+        """Inventory query, with an optional extra filter on the storage accounts"""
+        return f"""resourcecontainers 
                 | where type == 'microsoft.resources/subscriptions'
                 | project subscriptionName=name,subscriptionId 
                 | join ( resources| where type=='microsoft.storage/storageaccounts' 
-                | where name contains 'blobnfs') on subscriptionId 
+                | where name contains 'blobnfs' {resource_filter}) on subscriptionId 
                 | extend Customerid=substring(resourceGroup,6,3) 
-                | project subscriptionId,resourceGroup,Customerid,id,Storageaccountname=name,subscriptionName
-                | top 10 by Storageaccountname"""
-         
+                | project subscriptionId,resourceGroup,Customerid,id,Storageaccountname=name,subscriptionName,location"""
+
+    async def _get_query_result(credential_key:str):
+        credential,cloud=AuthService.get_credential(credential_key)
         async with credential:
-            subscriptions=await SubscriptionService.subscription_list(credential,cloud)
-            sub_ids=SubscriptionService.filter_ids(subscriptions)
-            blobnfs_list=await GraphService.run_query(
-                query_str=query,
+            blobnfs_list=await InventoryService.get_accounts(
+                credential_key=credential_key,
                 credential=credential,
-                sub_ids=sub_ids,
-                cloud=cloud
+                cloud=cloud,
+                build_query=Nfsbloblist._build_query,
+                count_query=Nfsbloblist._build_query() + """
+                | summarize count_=count()""",
+                name_filter='blobnfs'
             )
         blobnfs_dict={
             "credential_key":credential_key,
             "data":blobnfs_list
         }
         return blobnfs_dict
+
+    def _encode(inventory: dict):
+        # trimmed and interned, the rows go through the durable history several times
+        encoded={**inventory,"data":encode_rows(inventory['data'])}
+        logging.info(f"Encoded {len(inventory['data'])} accounts of '{inventory['credential_key']}' in {encoded_size(encoded['data'])} bytes")
+        return encoded
     
-    async def getnfsbloblistfunction():
+    async def getnfsbloblistfunction(scrape_id: str = None):
+        """Inventory of every credential key; with a scrape ID, its telemetry goes to the result store"""
         credential_list=AuthService.get_credential_keys()
         result=[]
         try:
-            result=await asyncio.gather(
-                *(asyncio.create_task(
-                    Nfsbloblist._get_query_result(cred)
-                )for cred in credential_list) 
-            )
-            return result
+            with Telemetry.default().stage("inventory"):
+                result=await asyncio.gather(
+                    *(asyncio.create_task(
+                        Nfsbloblist._get_query_result(cred)
+                    )for cred in credential_list) 
+                )
+                # an account visible to several keys is fetched through only one of them
+                result=await AssignmentService.assign(result)
+            return [Nfsbloblist._encode(inventory) for inventory in result]
         except Exception as e:
             logging.error(f"Failed to fetch getnfsbloblistfunction {e}")
+        finally:
+            if scrape_id is not None:
+                await Nfsbloblist._write_telemetry(scrape_id)
+
+    async def _write_telemetry(scrape_id: str):
+        try:
+            await get_result_store().write(f"{scrape_id}/telemetry/inventory.json",[json.dumps(Telemetry.default().drain())])
+        except Exception as e:
+            logging.warning(f"Could not write the inventory telemetry {e}")
 
@@ -0,0 +1,160 @@
+"""Simulation of the continuous collector against the burst refresh, over a day of ticks
+
+Models a fleet whose accounts publish one point per hour, each visible after its own
+ingestion delay, with a share of active accounts whose value changes at most points and
+idle ones whose value rarely does. The continuous mode runs the real CollectorService
+(align, select, reschedule) every tick. The burst mode fetches the whole fleet every
+'ScrapeMaxAgeSeconds'. Both count the metrics:getBatch calls they would send (one per
+BATCH_MAX_RESOURCES accounts of a subscription and region) and how long a changed value
+takes to be served. The first hour is the warm-up of the continuous mode and is only
+counted in the totals.
+
+Usage: python -m benchmarks.bench_collector --accounts 50000 --hours 24
+"""
+import argparse
+import json
+from time import perf_counter
+
+import numpy as np
+
+from services.collector_service import CollectorService
+from services.monitor_service import BATCH_MAX_RESOURCES
+
+HOUR = 3600.0
+
+
+def calls(groups: np.ndarray, indices: np.ndarray, n_groups: int) -> int:
+    """metrics:getBatch calls to fetch the given accounts"""
+    counts = np.bincount(groups[indices], minlength=n_groups)
+    return int(np.sum(-(-counts // BATCH_MAX_RESOURCES)))
+
+
+class Fleet:
+    def __init__(self, args, start: float):
+        rng = np.random.default_rng(args.seed)
+        n = args.accounts
+        self.start = start
+        self.hours = int(args.hours) + 2
+        self.delay = rng.uniform(args.min_delay, args.max_delay, n)
+        active = rng.random(n) < args.active_share
+        probability = np.where(active, args.active_change, args.idle_change)
+        # version[i, h]: how many times the value of account i changed up to the point of hour h
+        self.version = np.cumsum(rng.random((n, self.hours)) < probability[:, None], axis=1)
+
+    def visible(self, now: float) -> np.ndarray:
+        """Hour index of the newest point of each account visible at now, -1 before the first"""
+        return np.minimum(np.floor((now - self.start - self.delay) / HOUR), self.hours - 1).astype(np.int64)
+
+    def lag(self, now: float, served: np.ndarray) -> np.ndarray:
+        """Seconds since a value newer than the one served became visible, for the accounts behind"""
+        visible = self.visible(now)
+        rows = np.arange(len(served))
+        served_version = np.where(served >= 0, self.version[rows, np.maximum(served, 0)], -1)
+        behind = self.version[rows, np.maximum(visible, 0)] != served_version
+        behind &= visible >= 0
+        # first hour whose version differs from the served one, the version only grows
+        first = np.argmax(self.version > served_version[:, None], axis=1)
+        return (now - (self.start + first * HOUR + self.delay))[behind]
+
+
+def simulate(args, fleet: Fleet, start: float, groups: np.ndarray, n_groups: int, keys: list[str], group_names: list[str], continuous: bool) -> dict:
+    n = len(groups)
+    served = np.full(n, -1, dtype=np.int64)
+    schedule = CollectorService.align(None, keys, group_names)
+    times = np.full(n, np.nan)
+    ticks = int(args.hours * HOUR // args.tick)
+    warmup = int(HOUR // args.tick)
+    per_tick = []
+    refreshed = 0
+    lags = []
+    select_seconds = 0.0
+    for tick in range(ticks):
+        now = start + tick * args.tick
+        if continuous:
+            t0 = perf_counter()
+            due = CollectorService.select(schedule, now, args.tick if tick else 0.0)
+            select_seconds += perf_counter() - t0
+        elif tick % round(args.burst_interval / args.tick) == 0:
+            due = np.arange(n)
+        else:
+            due = np.zeros(0, dtype=np.int64)
+        per_tick.append(calls(groups, due, n_groups))
+        refreshed += len(due)
+        if len(due):
+            visible = fleet.visible(now)[due]
+            before = served[due]
+            changed = fleet.version[due, np.maximum(visible, 0)] != np.where(
+                before >= 0, fleet.version[due, np.maximum(before, 0)], -1
+            )
+            times_before = times[due]
+            times_after = np.where(visible >= 0, fleet.start + visible * HOUR, np.nan)
+            if continuous:
+                t0 = perf_counter()
+                CollectorService.reschedule(schedule, due, times_before, times_after, changed & (visible > before), now)
+                select_seconds += perf_counter() - t0
+            served[due] = np.maximum(visible, before)
+            times[due] = np.fmax(times_before, times_after)
+        if tick >= warmup and tick % args.sample_every == 0:
+            lags.append(fleet.lag(now, served))
+
+    steady = np.array(per_tick[warmup:])
+    lag = np.concatenate(lags) if lags else np.zeros(0)
+    samples = len(lags) * n
+    return {
+        "calls_total": int(sum(per_tick)),
+        "calls_per_hour": round(float(steady.sum()) / (len(steady) * args.tick / HOUR), 1),
+        "calls_per_tick_max": int(steady.max()),
+        "calls_per_tick_mean": round(float(steady.mean()), 2),
+        "ticks_with_calls": round(float(np.mean(steady > 0)), 3),
+        "accounts_refreshed": refreshed,
+        "behind_share": round(len(lag) / samples, 4),
+        "lag_p50_s": round(float(np.percentile(lag, 50)), 1) if len(lag) else 0.0,
+        "lag_p99_s": round(float(np.percentile(lag, 99)), 1) if len(lag) else 0.0,
+        "scheduler_ms_per_tick": round(1000 * select_seconds / ticks, 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--accounts", type=int, default=50000)
+    parser.add_argument("--subscriptions", type=int, default=40)
+    parser.add_argument("--regions", type=int, default=4)
+    parser.add_argument("--hours", type=float, default=24.0)
+    parser.add_argument("--tick", type=float, default=60.0, help="seconds between collector ticks")
+    parser.add_argument("--burst-interval", type=float, default=300.0, help="ScrapeMaxAgeSeconds of the burst mode")
+    parser.add_argument("--active-share", type=float, default=0.2, help="share of accounts whose value changes often")
+    parser.add_argument("--active-change", type=float, default=0.9, help="chance an active account changes per point")
+    parser.add_argument("--idle-change", type=float, default=0.02, help="chance an idle account changes per point")
+    parser.add_argument("--min-delay", type=float, default=180.0, help="shortest ingestion delay of a point")
+    parser.add_argument("--max-delay", type=float, default=600.0, help="longest ingestion delay of a point")
+    # not a divisor of the burst interval, so the samples do not all fall on a burst
+    parser.add_argument("--sample-every", type=int, default=7, help="ticks between freshness samples")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    fleet = Fleet(args, 1.7e9 // HOUR * HOUR)
+    # ticks not aligned on the hour, as a collector started at any time would be
+    start = fleet.start + 1234.0
+    rng = np.random.default_rng(args.seed + 1)
+    subscriptions = np.arange(args.accounts) % args.subscriptions
+    regions = rng.integers(0, args.regions, args.accounts)
+    groups = subscriptions * args.regions + regions
+    group_names = [f"s{subscription}/r{region}" for subscription, region in zip(subscriptions, regions)]
+    keys = [f"/subscriptions/s{subscription}/storageaccounts/a{i}" for i, subscription in enumerate(subscriptions)]
+    n_groups = args.subscriptions * args.regions
+
+    burst = simulate(args, fleet, start, groups, n_groups, keys, group_names, continuous=False)
+    continuous = simulate(args, fleet, start, groups, n_groups, keys, group_names, continuous=True)
+    print(json.dumps({
+        "accounts": args.accounts,
+        "groups": n_groups,
+        "hours": args.hours,
+        "burst": burst,
+        "continuous": continuous,
+        "calls_ratio": round(burst["calls_total"] / max(continuous["calls_total"], 1), 1),
+        "peak_calls_ratio": round(burst["calls_per_tick_max"] / max(continuous["calls_per_tick_max"], 1), 1)
+    }, indent=1))
+
+
+if __name__ == "__main__":
+    main()
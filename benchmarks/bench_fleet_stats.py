@@ -0,0 +1,87 @@
+"""Micro-benchmark of the vectorized fleet statistics of AnalyticsService
+
+Builds a synthetic (accounts, points) fleet with gaps and compares AnalyticsService.fleet_stats
+with the per-account pure Python loop it replaces (mean, min, max, percentiles and a
+least-squares growth rate computed one account at a time).
+
+Usage: python -m benchmarks.bench_fleet_stats --accounts 50000 --points 60
+"""
+import argparse
+import json
+from statistics import mean, quantiles
+from time import perf_counter
+
+import numpy as np
+
+from services.analytics_service import AnalyticsService, SECONDS_PER_DAY
+
+
+def build_fleet(n_accounts: int, n_points: int, gaps: float, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    times = np.broadcast_to(1.7e9 + 60.0 * np.arange(n_points), (n_accounts, n_points)).copy()
+    base = rng.uniform(1e9, 1e14, (n_accounts, 1))
+    growth = rng.uniform(-1e3, 1e6, (n_accounts, 1))
+    values = base + growth * np.arange(n_points) + rng.normal(0, 1e3, (n_accounts, n_points))
+    values[rng.random((n_accounts, n_points)) < gaps] = np.nan
+    return times, values
+
+
+def python_stats(times: np.ndarray, values: np.ndarray) -> list:
+    output = []
+    for row_times, row_values in zip(times.tolist(), values.tolist()):
+        points = [(t, v) for t, v in zip(row_times, row_values) if v == v]
+        if len(points) < 2:
+            output.append(None)
+            continue
+        ys = [v for _, v in points]
+        ts = [t for t, _ in points]
+        t_mean, y_mean = mean(ts), mean(ys)
+        slope = sum((t - t_mean) * (y - y_mean) for t, y in points) / sum((t - t_mean) ** 2 for t in ts)
+        cuts = quantiles(ys, n=100, method="inclusive")
+        output.append({
+            "mean": y_mean,
+            "min": min(ys),
+            "max": max(ys),
+            "p50": cuts[49],
+            "p95": cuts[94],
+            "growth_per_day": slope * SECONDS_PER_DAY
+        })
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--accounts", type=int, default=50000)
+    parser.add_argument("--points", type=int, default=60)
+    parser.add_argument("--gaps", type=float, default=0.05, help="share of missing points")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    times, values = build_fleet(args.accounts, args.points, args.gaps)
+
+    vectorized = []
+    for _ in range(args.repeat):
+        t0 = perf_counter()
+        stats = AnalyticsService.fleet_stats(times, values)
+        vectorized.append(perf_counter() - t0)
+
+    t0 = perf_counter()
+    reference = python_stats(times, values)
+    python_seconds = perf_counter() - t0
+
+    # the two paths must agree
+    for key in ("mean", "p95", "growth_per_day"):
+        expected = np.array([row[key] if row else np.nan for row in reference])
+        assert np.allclose(stats[key], expected, rtol=1e-6, equal_nan=True), key
+
+    print(json.dumps({
+        "accounts": args.accounts,
+        "points": args.points,
+        "vectorized_ms": round(min(vectorized) * 1000, 1),
+        "python_ms": round(python_seconds * 1000, 1),
+        "speedup": round(python_seconds / min(vectorized), 1)
+    }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Benchmark of the memory-mapped MetricHistory
+
+Appends a synthetic fleet scrape by scrape, each scrape overlapping the previous one
+the way the incremental windows do, then times the vectorized range reads behind the
+analytics (matrix and fleet_stats over the last hours). The store is reopened from its
+files before the queries, as a restarted worker would.
+
+Usage: python -m benchmarks.bench_history --accounts 50000 --scrapes 24
+"""
+import argparse
+import json
+import shutil
+import tempfile
+from time import perf_counter
+
+import numpy as np
+
+from services.analytics_service import AnalyticsService
+from shared_code.history import MetricHistory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--accounts", type=int, default=50000)
+    parser.add_argument("--scrapes", type=int, default=24, help="scrapes appended, one per interval")
+    parser.add_argument("--points", type=int, default=2, help="points per account and scrape, overlap included")
+    parser.add_argument("--interval", type=float, default=3600.0, help="seconds between scrapes")
+    parser.add_argument("--capacity", type=int, default=2**22)
+    parser.add_argument("--hours", type=float, default=12.0, help="window of the trend queries")
+    args = parser.parse_args()
+
+    path = tempfile.mkdtemp(prefix="bench_history_")
+    try:
+        rng = np.random.default_rng(0)
+        keys = [f"/subscriptions/s{i % 40}/providers/microsoft.storage/storageaccounts/a{i}" for i in range(args.accounts)]
+        base = rng.uniform(1e9, 1e14, args.accounts)
+        growth = rng.uniform(0, 1e6, args.accounts)
+        start = 1.7e9
+
+        history = MetricHistory(path, args.capacity)
+        append_seconds = []
+        stored = 0
+        for scrape in range(args.scrapes):
+            # each scrape also returns the last point of the previous one
+            times = start + args.interval * (scrape + np.arange(args.points) - (args.points - 1))
+            t = np.repeat(times[None, :], args.accounts, axis=0)
+            values = base[:, None] + growth[:, None] * (t - start)
+            t0 = perf_counter()
+            stored += history.append(
+                "UsedCapacity", "average", [key for key in keys for _ in range(args.points)], t.ravel(), values.ravel()
+            )
+            append_seconds.append(perf_counter() - t0)
+
+        reopened = MetricHistory(path, args.capacity)
+        end = start + args.interval * (args.scrapes - 1)
+        window = (end - args.hours * 3600, end)
+
+        t0 = perf_counter()
+        times, values = reopened.matrix("UsedCapacity", "average", keys, *window)
+        matrix_seconds = perf_counter() - t0
+        t0 = perf_counter()
+        stats = AnalyticsService.fleet_stats(times, values)
+        stats_seconds = perf_counter() - t0
+
+        # the synthetic growth is linear, the statistics must find it back
+        assert np.allclose(stats["growth_per_day"], growth * 86400, rtol=1e-6)
+
+        print(json.dumps({
+            "accounts": args.accounts,
+            "points_stored": stored,
+            "points_per_account": times.shape[1],
+            "append_ms_per_scrape": round(1000 * float(np.median(append_seconds)), 1),
+            "append_ns_per_point": round(1e9 * sum(append_seconds) / (args.scrapes * args.points * args.accounts), 1),
+            "matrix_ms": round(1000 * matrix_seconds, 1),
+            "fleet_stats_ms": round(1000 * stats_seconds, 1),
+            "file_mib": round(args.capacity * 20 / 2**20, 1),
+            "history": reopened.stats()
+        }))
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
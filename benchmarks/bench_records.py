@@ -0,0 +1,144 @@
+"""Benchmark of the account records, row dictionaries against the AccountTable
+
+Runs a synthetic fleet through the stages every account goes through after the inventory:
+decoding the wire payload, dividing it into batches, attaching the fetched metric values,
+writing and reading back the records of each part and writing the exposition. The dict
+path is the one the activities used before the AccountTable (one dictionary per account,
+nested dictionaries of metric values, JSON arrays of records). Both must produce the same
+exposition. Reports CPU time, the tracemalloc peak and the memory held by the records of
+the scrape once read back by the exposition.
+
+Usage: python -m benchmarks.bench_records --accounts 50000
+"""
+import argparse
+import json
+import random
+import tracemalloc
+from time import perf_counter, process_time
+
+from prometheus_client.utils import floatToGoString
+
+from services.promethus_service import Promethus
+from shared_code.records import AccountTable
+from shared_code.wire import decode_rows, encode_rows
+
+METRIC_SET = {"UsedCapacity": ["average"], "Transactions": ["total", "maximum"]}
+
+
+def build_inventory(n_accounts: int, n_subscriptions: int, seed: int = 0) -> list[dict]:
+    rng = random.Random(seed)
+    regions = ["westeurope", "northeurope", "eastus", "westus2"]
+    rows = []
+    for i in range(n_accounts):
+        subscription = f"{i % n_subscriptions:08d}-0000-0000-0000-000000000000"
+        name = f"nfsaccount{i:07d}"
+        rows.append({
+            "id": f"/subscriptions/{subscription}/resourceGroups/rg-{i % 50}/providers/Microsoft.Storage/storageAccounts/{name}",
+            "location": rng.choice(regions),
+            "subscriptionId": subscription,
+            "Customerid": f"customer-{i % 20}",
+            "Storageaccountname": name
+        })
+    return rows
+
+
+def fetched_values(resource_id: str) -> dict:
+    """Stand-in for the values of MonitorService, the same for both paths"""
+    seed = hash(resource_id) & 0xFFFFFF
+    if seed % 50 == 0:
+        return None
+    return {
+        "UsedCapacity": {"average": float(seed * 1000)},
+        "Transactions": {"total": float(seed % 977), "maximum": float(seed % 31)}
+    }
+
+
+def dict_stream(metriclist: list[dict]):
+    """The exposition as written from row dictionaries, path by path"""
+    families = {}
+    for metric in metriclist:
+        for name, values in (metric["metrics"] or {}).items():
+            for aggregation in values:
+                families.setdefault((name, aggregation), None)
+    paths = [("Used_capacity", "Used Capacity for storage", ("UsedCapacity", "average"))]
+    for name, aggregation in families:
+        paths.append((Promethus._family_name(name, aggregation), f"{name} ({aggregation}) of the storage account from Azure Monitor", (name, aggregation)))
+    for family, description, (name, aggregation) in paths:
+        yield f"# HELP {family} {description}\n# TYPE {family} gauge\n"
+        lines = []
+        for metric in metriclist:
+            value = ((metric["metrics"] or {}).get(name) or {}).get(aggregation)
+            if value is None:
+                continue
+            lines.append(
+                f'{family}{{Customerid="{Promethus._escape(metric["Customerid"])}",'
+                f'Storageaccountname="{Promethus._escape(metric["Storageaccountname"])}",'
+                f'subscriptionId="{Promethus._escape(metric["subscriptionId"])}"}} {floatToGoString(value)}\n'
+            )
+        yield "".join(lines)
+
+
+def dict_path(payload: dict, batch_size: int):
+    accounts = decode_rows(payload)
+    ordered = sorted(accounts, key=lambda account: (account["subscriptionId"].lower(), account["location"].lower()))
+    batches = [encode_rows(ordered[i:i + batch_size]) for i in range(0, len(ordered), batch_size)]
+    parts = []
+    for batch in batches:
+        records = [{**elem, "metrics": fetched_values(elem["id"])} for elem in decode_rows(batch)]
+        parts.append("[" + ",".join(json.dumps(record) for record in records) + "]")
+    metriclist = []
+    for part in parts:
+        metriclist.extend(json.loads(part))
+    return metriclist, dict_stream
+
+
+def table_path(payload: dict, batch_size: int):
+    accounts = AccountTable.from_wire(payload)
+    subscriptions, locations = accounts.columns["subscriptionId"], accounts.columns["location"]
+    ordered = sorted(range(len(accounts)), key=lambda i: (subscriptions[i].lower(), locations[i].lower()))
+    batches = [accounts.take(ordered[i:i + batch_size]).to_wire() for i in range(0, len(ordered), batch_size)]
+    parts = []
+    for batch in batches:
+        table = AccountTable.from_wire(batch)
+        for index, resource_id in enumerate(table.columns["id"]):
+            table.set_metrics(index, fetched_values(resource_id))
+        parts.append("".join(table.json_chunks()))
+    return AccountTable.concat([AccountTable.from_json(part) for part in parts]), Promethus.stream
+
+
+def run(path, payload: dict, batch_size: int) -> dict:
+    tracemalloc.start()
+    t0, c0 = perf_counter(), process_time()
+    records, stream = path(payload, batch_size)
+    held = tracemalloc.get_traced_memory()[0]
+    text = "".join(stream(records))
+    cpu, wall = process_time() - c0, perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"cpu_s": round(cpu, 3), "wall_s": round(wall, 3), "peak_mib": round(peak / 2**20, 1), "held_mib": round(held / 2**20, 1), "text": text}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--accounts", type=int, default=50000)
+    parser.add_argument("--subscriptions", type=int, default=40)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    payload = encode_rows(build_inventory(args.accounts, args.subscriptions))
+    dicts = run(dict_path, payload, args.batch_size)
+    table = run(table_path, payload, args.batch_size)
+    # the two paths must agree
+    assert dicts.pop("text") == table.pop("text")
+
+    print(json.dumps({
+        "accounts": args.accounts,
+        "dicts": dicts,
+        "table": table,
+        "cpu_speedup": round(dicts["cpu_s"] / table["cpu_s"], 2),
+        "held_ratio": round(dicts["held_mib"] / max(table["held_mib"], 0.1), 1)
+    }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""End-to-end benchmark of the scrape pipeline against the local Azure stand-in
+
+Starts benchmarks.fake_azure in a subprocess, points the app at it and runs the real
+sddrlddr_orchestrator (getnfsbloblist -> divideaccounts -> getnfsblobmetrics ->
+exposemetrics) in process with benchmarks.local_orchestration. For every scrape
+it reports wall time, requests sent, response bytes, client-side request latency p50/p99, throttled
+responses, durable payload bytes and peak RSS.
+
+Each fleet size runs in its own process so the peak RSS figures do not mix. With --push,
+benchmarks.push_receiver also runs and the push sink is pointed at it.
+
+Usage: python -m benchmarks.bench_scrape --accounts 10,1000,50000 --scrapes 2
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+from time import perf_counter, sleep
+
+import aiohttp
+from azure.core.credentials import AccessToken
+from msrestazure.azure_cloud import Cloud, CloudEndpoints
+
+CREDENTIAL_KEY = "BenchCredential"
+
+
+class StaticTokenCredential:
+    """Credential that hands out a fixed token, the stand-in does not check it"""
+
+    async def get_token(self, *scopes, **kwargs) -> AccessToken:
+        return AccessToken("local-token", 2**31 - 1)
+
+    async def close(self):
+        pass
+
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(round(q * (len(values) - 1))), len(values) - 1)]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(server: subprocess.Popen, port: int, name: str) -> subprocess.Popen:
+    for _ in range(100):
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.1):
+                return server
+        except OSError:
+            sleep(0.1)
+    server.kill()
+    raise RuntimeError(f"The {name} did not start")
+
+
+def start_receiver(args, port: int) -> subprocess.Popen:
+    command = [
+        sys.executable, "-m", "benchmarks.push_receiver",
+        "--port", str(port),
+        "--username", "bench",
+        "--password", "bench",
+        "--fail-rate", str(args.push_fail_rate)
+    ]
+    return wait_for_port(subprocess.Popen(command), port, "local push receiver")
+
+
+def start_server(args, port: int) -> subprocess.Popen:
+    command = [
+        sys.executable, "-m", "benchmarks.fake_azure",
+        "--port", str(port),
+        "--accounts", str(args.accounts),
+        "--subscriptions", str(args.subscriptions),
+        "--regions", str(args.regions),
+        "--points", str(args.points),
+        "--latency", str(args.latency),
+        "--jitter", str(args.jitter),
+        "--throttle-rate", str(args.throttle_rate),
+        "--tail-rate", str(args.tail_rate),
+        "--tail-latency", str(args.tail_latency)
+    ]
+    return wait_for_port(subprocess.Popen(command), port, "local Azure stand-in")
+
+
+async def run_scrapes(args, url: str, push_url: str = None):
+    os.environ["CredentialKeys"] = CREDENTIAL_KEY
+    os.environ["MetricsBatchEndpoint"] = url
+    os.environ.setdefault("StateStorePath", tempfile.mkdtemp(prefix="blobnfs-bench-"))
+    # everything runs in this process, no need for a blob container
+    os.environ.setdefault("ResultStoreBackend", "local")
+    os.environ.setdefault("ResultStorePath", tempfile.mkdtemp(prefix="blobnfs-bench-results-"))
+    if push_url is not None:
+        os.environ["PushMode"] = args.push
+        os.environ["PushUrl"] = push_url + ("/api/v1/write" if args.push == "remote_write" else "")
+        os.environ["PushUsername"] = "bench"
+        os.environ["PushPassword"] = "bench"
+
+    from shared_code.client_pool import ClientPool
+    from shared_code.latency import LatencyTracker
+    from services.auth_service import AuthService
+    import function_app
+    from benchmarks.local_orchestration import LocalOrchestrationRunner
+
+    latencies = []
+
+    async def on_request_start(session, context, params):
+        context.t0 = perf_counter()
+
+    async def on_request_end(session, context, params):
+        latencies.append(perf_counter() - context.t0)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    ClientPool.add_trace_config(trace_config)
+
+    cloud = Cloud("LocalStandIn", endpoints=CloudEndpoints(resource_manager=url, active_directory=url))
+    AuthService.register_credential(CREDENTIAL_KEY, StaticTokenCredential(), cloud)
+    runner = LocalOrchestrationRunner(function_app.myApp)
+
+    results = []
+    async with aiohttp.ClientSession() as control:
+        for scrape in range(args.scrapes):
+            await control.post(f"{url}/_reset")
+            # the first scrape stays healthy, so the later ones have values to fall back on
+            await control.post(f"{url}/_faults", json={"broken_subscriptions": args.broken_subscriptions if scrape else 0})
+            if push_url is not None:
+                await control.post(f"{push_url}/_reset")
+            latencies.clear()
+            runner.payload_bytes = 0
+            t0 = perf_counter()
+            output = await runner.run("sddrlddr_orchestrator")
+            wall = perf_counter() - t0
+            async with control.get(f"{url}/_stats") as response:
+                stats = await response.json()
+            push = None
+            if push_url is not None:
+                async with control.get(f"{push_url}/_stats") as response:
+                    push = await response.json()
+            results.append({
+                "accounts": args.accounts,
+                "scrape": scrape + 1,
+                "wall_s": round(wall, 3),
+                "requests": stats["total_requests"],
+                "requests_by_api": stats["requests"],
+                "throttled": stats["throttled"],
+                "forbidden": stats["forbidden"],
+                "stale": output.get("stale") if isinstance(output, dict) else None,
+                "response_bytes": stats["bytes_sent"],
+                "p50_ms": round(percentile(latencies, 0.50) * 1000, 1) if latencies else None,
+                "p99_ms": round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+                "hedging": LatencyTracker.default().stats(),
+                "payload_bytes": runner.payload_bytes,
+                "output_bytes": len(json.dumps(output)),
+                "exposition_bytes": output["bytes"] if isinstance(output, dict) else None,
+                "push": push,
+                "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+            })
+    await ClientPool.close()
+    return results
+
+
+def run_single(args):
+    port = free_port()
+    server = start_server(args, port)
+    receiver = None
+    push_url = None
+    if args.push != "off":
+        push_port = free_port()
+        receiver = start_receiver(args, push_port)
+        push_url = f"http://127.0.0.1:{push_port}"
+    try:
+        results = asyncio.run(run_scrapes(args, f"http://127.0.0.1:{port}", push_url))
+    finally:
+        for process in filter(None, (server, receiver)):
+            process.terminate()
+            process.wait()
+    for result in results:
+        print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--accounts", default="10,1000", help="comma separated fleet sizes")
+    parser.add_argument("--subscriptions", type=int, default=10)
+    parser.add_argument("--regions", type=int, default=2)
+    parser.add_argument("--points", type=int, default=60)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--tail-rate", type=float, default=0.0)
+    parser.add_argument("--tail-latency", type=float, default=1.0)
+    parser.add_argument("--scrapes", type=int, default=2)
+    parser.add_argument("--broken-subscriptions", type=int, default=0,
+                        help="subscriptions answering 403 to the metrics calls from the second scrape on")
+    parser.add_argument("--push", choices=["off", "pushgateway", "remote_write"], default="off")
+    parser.add_argument("--push-fail-rate", type=float, default=0.0, help="share of pushes answered with 503")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level)
+
+    sizes = [int(size) for size in str(args.accounts).split(",") if size]
+    if len(sizes) == 1:
+        args.accounts = sizes[0]
+        run_single(args)
+        return
+
+    for size in sizes:
+        command = [sys.executable, "-m", "benchmarks.bench_scrape"] + [
+            arg if not arg.startswith("--accounts=") else f"--accounts={size}" for arg in sys.argv[1:]
+        ]
+        if "--accounts" in command:
+            command[command.index("--accounts") + 1] = str(size)
+        elif not any(arg.startswith("--accounts=") for arg in command):
+            command += ["--accounts", str(size)]
+        subprocess.run(command, check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Startup profile of the function app: import time of the host module and of each trigger
+
+Every measurement runs in a fresh interpreter, like a cold start. The host import is
+profiled with 'python -X importtime' and the slowest modules are listed by cumulative
+time. Each trigger is then timed on the modules it loads on its first invocation.
+
+Usage: python -m benchmarks.bench_startup --repeat 5 --top 15
+"""
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+from statistics import median
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import importlib, json, sys
+from time import perf_counter
+start = perf_counter()
+import function_app
+host = perf_counter() - start
+start = perf_counter()
+for module in sys.argv[1:]:
+    importlib.import_module(module)
+print(json.dumps({"host": host, "trigger": perf_counter() - start}))
+"""
+
+
+def trigger_modules() -> dict[str, list[str]]:
+    """Modules each trigger of function_app imports on its first invocation, read from its source
+
+    Every decorated function is a trigger, its function-level imports are the modules it loads.
+    The orchestrators import none and are left out.
+    """
+    with open(os.path.join(ROOT, "function_app.py"), "r") as f:
+        tree = ast.parse(f.read())
+    triggers = {}
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) or not node.decorator_list:
+            continue
+        modules = []
+        for child in ast.walk(node):
+            if isinstance(child, ast.ImportFrom):
+                modules.append(child.module)
+            elif isinstance(child, ast.Import):
+                modules.extend(alias.name for alias in child.names)
+        if modules:
+            triggers[node.name] = list(dict.fromkeys(modules))
+    return triggers
+
+
+def import_profile() -> list[tuple[str, int, int]]:
+    """(module, self us, cumulative us) of every module imported by function_app, in import order"""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import function_app"],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        # nested imports keep their indentation in the module column
+        rows.append((module[1:], int(self_us), int(cumulative_us)))
+    return rows
+
+
+def cold_start(modules: list[str]) -> dict:
+    completed = subprocess.run(
+        [sys.executable, "-c", PROBE, *modules],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    return json.loads(completed.stdout.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="slowest modules to list")
+    args = parser.parse_args()
+
+    profile = import_profile()
+    # top-level modules only: nested ones are already in their parent's cumulative time
+    top_level = [row for row in profile if not row[0].startswith(" ")]
+    total_us = sum(cumulative for _, _, cumulative in top_level)
+    slowest = sorted(profile, key=lambda row: row[2], reverse=True)[:args.top]
+
+    modules_of = trigger_modules()
+    host = []
+    triggers = {}
+    for _ in range(args.repeat):
+        host.append(cold_start([])["host"])
+        for trigger, modules in modules_of.items():
+            triggers.setdefault(trigger, []).append(cold_start(modules)["trigger"])
+
+    print(json.dumps({
+        "import_function_app_seconds": round(total_us / 1e6, 3),
+        "host_import_median_seconds": round(median(host), 3),
+        "trigger_first_call_import_median_seconds": {
+            trigger: round(median(samples), 3) for trigger, samples in triggers.items()
+        },
+        "slowest_modules": [
+            {"module": module.strip(), "self_ms": round(self_us / 1e3, 1), "cumulative_ms": round(cumulative_us / 1e3, 1)}
+            for module, self_us, cumulative_us in slowest
+        ]
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
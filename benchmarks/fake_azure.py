@@ -0,0 +1,302 @@
+"""Local stand-in for the Azure APIs used by the scrape pipeline
+
+Serves, over plain HTTP:
+    GET  /subscriptions                                    ARM subscription list
+    POST /providers/Microsoft.ResourceGraph/resources      Resource Graph, with $skipToken paging
+    GET  {resourceId}/providers/Microsoft.Insights/metrics ARM metrics, one resource
+    POST /subscriptions/{id}/metrics:getBatch              Monitor data-plane batch metrics
+    GET  /_stats, POST /_reset                             request counters and latencies
+    POST /_faults                                          {"broken_subscriptions": n} answers 403
+                                                           to the metrics calls of the first n subscriptions,
+                                                           {"batch_status": code} answers every getBatch
+                                                           call with that status
+
+Latency, jitter, a slow tail (a share of responses delayed by a fixed extra time) and the
+share of throttled (429) responses are configurable, and the fleet is generated from
+the number of accounts, subscriptions and regions.
+
+Usage: python -m benchmarks.fake_azure --accounts 1000 --port 8080
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import zlib
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+
+from aiohttp import web
+
+REGIONS = ["eastus", "westeurope", "southeastasia", "australiaeast"]
+
+
+class FakeAzure:
+    def __init__(
+        self,
+        accounts: int = 100,
+        subscriptions: int = 10,
+        regions: int = 2,
+        points: int = 60,
+        latency: float = 0.02,
+        jitter: float = 0.01,
+        throttle_rate: float = 0.0,
+        retry_after: float = 1.0,
+        tail_rate: float = 0.0,
+        tail_latency: float = 1.0,
+        seed: int = 0
+    ) -> None:
+        self.points = points
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.random = random.Random(seed)
+        self.subscriptions = [f"{i:08d}-0000-0000-0000-000000000000" for i in range(subscriptions)]
+        self.rows = []
+        for i in range(accounts):
+            subscription_id = self.subscriptions[i % subscriptions]
+            resource_group = f"rg-cus{i % 997:03d}-storage"
+            name = f"blobnfs{i:06d}"
+            self.rows.append({
+                "subscriptionId": subscription_id,
+                "resourceGroup": resource_group,
+                "Customerid": resource_group[6:9],
+                "id": f"/subscriptions/{subscription_id}/resourceGroups/{resource_group}"
+                      f"/providers/Microsoft.Storage/storageAccounts/{name}",
+                "Storageaccountname": name,
+                "subscriptionName": f"subscription-{i % subscriptions}",
+                "location": REGIONS[i % max(min(regions, len(REGIONS)), 1)]
+            })
+        self.broken = set()
+        self.batch_status = None
+        self.reset()
+
+    def reset(self):
+        self.counts = defaultdict(int)
+        self.latencies = defaultdict(list)
+        self.throttled = 0
+        self.forbidden = 0
+        self.bytes_sent = 0
+        # number of resources of each getBatch call
+        self.batch_sizes = []
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 2**20)
+        app.router.add_get("/subscriptions", self.list_subscriptions)
+        app.router.add_post("/providers/Microsoft.ResourceGraph/resources", self.resource_graph)
+        app.router.add_post("/subscriptions/{subscription}/metrics:getBatch", self.metrics_batch)
+        app.router.add_get("/{resource:.*}/providers/Microsoft.Insights/metrics", self.metrics)
+        app.router.add_get("/_stats", self.stats)
+        app.router.add_post("/_reset", self.reset_stats)
+        app.router.add_post("/_faults", self.set_faults)
+        return app
+
+    async def _respond(self, endpoint: str, payload, subscription_id: str = None) -> web.Response:
+        t0 = perf_counter()
+        self.counts[endpoint] += 1
+        delay = max(self.latency + self.random.uniform(-self.jitter, self.jitter), 0)
+        if self.random.random() < self.tail_rate:
+            delay += self.tail_latency
+        await asyncio.sleep(delay)
+        if subscription_id in self.broken:
+            self.forbidden += 1
+            response = web.json_response(
+                {"error": {"code": "AuthorizationFailed", "message": "No access to the subscription"}},
+                status=403
+            )
+        elif self.random.random() < self.throttle_rate:
+            self.throttled += 1
+            response = web.json_response(
+                {"error": {"code": "TooManyRequests", "message": "Rate limit exceeded"}},
+                status=429,
+                headers={"Retry-After": str(self.retry_after)}
+            )
+        else:
+            body = json.dumps(payload() if callable(payload) else payload)
+            self.bytes_sent += len(body)
+            response = web.Response(
+                text=body,
+                content_type="application/json",
+                headers={"x-ms-ratelimit-remaining-subscription-reads": "11999"}
+            )
+        self.latencies[endpoint].append(perf_counter() - t0)
+        return response
+
+    async def list_subscriptions(self, request: web.Request) -> web.Response:
+        return await self._respond("subscriptions", {
+            "value": [
+                {
+                    "id": f"/subscriptions/{subscription_id}",
+                    "subscriptionId": subscription_id,
+                    "displayName": f"subscription-{i}",
+                    "state": "Enabled"
+                } for i, subscription_id in enumerate(self.subscriptions)
+            ]
+        })
+
+    async def resource_graph(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        query = body.get("query", "")
+        options = body.get("options") or {}
+        subscriptions = set(body.get("subscriptions") or self.subscriptions)
+
+        if query.lstrip().startswith("resourcecontainers"):
+            rows = [row for row in self.rows if row["subscriptionId"] in subscriptions]
+            ids = re.search(r"id in~ \(([^)]*)\)", query)
+            if ids:
+                wanted = {value.strip(" '").lower() for value in ids.group(1).split(",")}
+                rows = [row for row in rows if row["id"].lower() in wanted]
+            if "summarize count_" in query:
+                rows = [{"count_": len(rows)}]
+        else:
+            # resourcechanges and any other query: nothing changed
+            rows = []
+
+        top = int(options.get("$top") or 1000)
+        skip = int(options.get("$skipToken") or 0)
+        page = rows[skip:skip + top]
+        payload = {
+            "totalRecords": len(rows),
+            "count": len(page),
+            "resultTruncated": "false",
+            "data": page,
+            "facets": []
+        }
+        if skip + top < len(rows):
+            payload["$skipToken"] = str(skip + top)
+        return await self._respond("resourcegraph", payload)
+
+    @staticmethod
+    def _start(value) -> datetime:
+        """Start of a 'start/end' timespan or of a starttime, None if not given"""
+        if not value:
+            return None
+        start = datetime.fromisoformat(value.split("/")[0].replace("Z", "+00:00").replace(" ", "T"))
+        return start if start.tzinfo else start.replace(tzinfo=timezone.utc)
+
+    def _metric_values(self, resource_id: str, metricnames: str, aggregation: str, start: datetime = None) -> list:
+        end = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+        base = float(zlib.crc32(resource_id.lower().encode()) % 10**9) * 1000
+        aggregations = (aggregation or "average").split(",")
+        values = []
+        for name in (metricnames or "UsedCapacity").split(","):
+            data = []
+            for m in range(self.points, 0, -1):
+                if start is not None and end - timedelta(minutes=m) < start:
+                    continue
+                point = {"timeStamp": (end - timedelta(minutes=m)).isoformat().replace("+00:00", "Z")}
+                for key in aggregations:
+                    point[key] = base + (self.points - m) * 1024.0
+                data.append(point)
+            values.append({
+                "id": f"{resource_id}/providers/Microsoft.Insights/metrics/{name}",
+                "type": "Microsoft.Insights/metrics",
+                "name": {"value": name, "localizedValue": name},
+                "displayDescription": f"{name} of the storage account",
+                "unit": "Bytes",
+                "timeseries": [{"metadatavalues": [], "data": data}],
+                "errorCode": "Success"
+            })
+        return values
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        resource_id = "/" + request.match_info["resource"].strip("/")
+        return await self._respond("metrics", lambda: {
+            "cost": 0,
+            "timespan": request.query.get("timespan"),
+            "interval": request.query.get("interval", "PT1M"),
+            "value": self._metric_values(
+                resource_id,
+                request.query.get("metricnames"),
+                request.query.get("aggregation"),
+                self._start(request.query.get("timespan"))
+            ),
+            "namespace": "Microsoft.Storage/storageAccounts",
+            "resourceregion": "eastus"
+        }, resource_id.split("/")[2])
+
+    async def metrics_batch(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.batch_sizes.append(len(body.get("resourceids", [])))
+        if self.batch_status:
+            self.counts["metrics_batch"] += 1
+            return web.json_response(
+                {"error": {"code": "BadRequest", "message": "The batch API rejected the request"}},
+                status=self.batch_status
+            )
+        metricnames = request.query.get("metricnames")
+        aggregation = request.query.get("aggregation")
+        start = self._start(request.query.get("starttime"))
+        return await self._respond("metrics_batch", lambda: {
+            "values": [
+                {
+                    "starttime": request.query.get("starttime"),
+                    "endtime": request.query.get("endtime"),
+                    "interval": request.query.get("interval", "PT1M"),
+                    "namespace": "Microsoft.Storage/storageAccounts",
+                    "resourceregion": "eastus",
+                    "resourceid": resource_id,
+                    "value": self._metric_values(resource_id, metricnames, aggregation, start)
+                } for resource_id in body.get("resourceids", [])
+            ]
+        }, request.match_info["subscription"])
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "requests": dict(self.counts),
+            "total_requests": sum(self.counts.values()),
+            "throttled": self.throttled,
+            "forbidden": self.forbidden,
+            "bytes_sent": self.bytes_sent,
+            "batch_sizes": self.batch_sizes,
+            "server_latencies": {key: sorted(values) for key, values in self.latencies.items()}
+        })
+
+    async def reset_stats(self, request: web.Request) -> web.Response:
+        self.reset()
+        return web.json_response({})
+
+    async def set_faults(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.broken = set(self.subscriptions[:body.get("broken_subscriptions", 0)])
+        self.batch_status = body.get("batch_status")
+        return web.json_response({"broken": sorted(self.broken), "batch_status": self.batch_status})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--accounts", type=int, default=100)
+    parser.add_argument("--subscriptions", type=int, default=10)
+    parser.add_argument("--regions", type=int, default=2)
+    parser.add_argument("--points", type=int, default=60)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per response")
+    parser.add_argument("--jitter", type=float, default=0.01, help="uniform +/- seconds")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of 429 responses")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="share of slow responses")
+    parser.add_argument("--tail-latency", type=float, default=1.0, help="extra seconds of a slow response")
+    args = parser.parse_args()
+
+    fake = FakeAzure(
+        accounts=args.accounts,
+        subscriptions=args.subscriptions,
+        regions=args.regions,
+        points=args.points,
+        latency=args.latency,
+        jitter=args.jitter,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+        tail_rate=args.tail_rate,
+        tail_latency=args.tail_latency
+    )
+    web.run_app(fake.app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
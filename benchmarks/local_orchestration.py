@@ -0,0 +1,176 @@
+"""In-process driver for the durable orchestrations of function_app
+
+Runs the orchestrator generators against a minimal orchestration context and executes
+the activities and sub-orchestrations they schedule directly, round-tripping every input
+and output through JSON like the durable history does. task_all, task_any and timers
+are supported; timers fire in real time. Used by the benchmarks to run the real pipeline
+without the Functions host.
+"""
+import asyncio
+import inspect
+import json
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+from azure.durable_functions.models.Task import TaskState
+
+
+class _Task:
+    """Durable task stand-in: it starts when first yielded and exposes state and result"""
+
+    def __init__(self) -> None:
+        self._future = None
+
+    @property
+    def state(self) -> TaskState:
+        if self._future is None or not self._future.done():
+            return TaskState.RUNNING
+        if self._future.cancelled() or self._future.exception() is not None:
+            return TaskState.FAILED
+        return TaskState.SUCCEEDED
+
+    @property
+    def result(self) -> Any:
+        if self.state is TaskState.RUNNING or self._future.cancelled():
+            return None
+        return self._future.exception() or self._future.result()
+
+    @property
+    def is_completed(self) -> bool:
+        return self.state is not TaskState.RUNNING
+
+
+class _Call(_Task):
+    def __init__(self, kind: str, name: str, input_: Any = None, instance_id: Optional[str] = None) -> None:
+        super().__init__()
+        self.kind = kind
+        self.name = name
+        self.input = input_
+        self.instance_id = instance_id
+
+
+class _Timer(_Task):
+    def __init__(self, fire_at: datetime) -> None:
+        super().__init__()
+        self.fire_at = fire_at
+
+    def cancel(self):
+        if self.is_completed:
+            raise ValueError("Cannot cancel a completed task.")
+        if self._future is not None:
+            self._future.cancel()
+
+
+class _All:
+    def __init__(self, tasks: list) -> None:
+        self.tasks = tasks
+
+
+class _Any:
+    def __init__(self, tasks: list) -> None:
+        self.tasks = tasks
+
+
+class LocalOrchestrationContext:
+    def __init__(self, instance_id: str, input_: Any = None) -> None:
+        self.instance_id = instance_id
+        self._input = input_
+        self.current_utc_datetime = datetime.now(timezone.utc)
+        self.is_replaying = False
+
+    def get_input(self) -> Any:
+        return self._input
+
+    def call_activity(self, name: str, input_: Any = None) -> _Call:
+        return _Call("activity", name, input_)
+
+    def call_sub_orchestrator(self, name: str, input_: Any = None, instance_id: Optional[str] = None) -> _Call:
+        return _Call("orchestrator", name, input_, instance_id)
+
+    def create_timer(self, fire_at: datetime) -> _Timer:
+        return _Timer(fire_at)
+
+    def task_all(self, tasks: list) -> _All:
+        return _All(tasks)
+
+    def task_any(self, tasks: list) -> _Any:
+        return _Any(tasks)
+
+
+class LocalOrchestrationRunner:
+    """Runs orchestrators and activities of a DFApp in process
+
+    'payload_bytes' accumulates the size of every serialized activity and
+    sub-orchestration input and output, as a proxy for the durable history size.
+    """
+
+    def __init__(self, app) -> None:
+        self._functions = {}
+        for function in app.get_functions():
+            self._functions[function.get_function_name()] = function.get_user_function()
+        self.payload_bytes = 0
+        self.calls = 0
+
+    async def run(self, name: str, input_: Any = None, instance_id: Optional[str] = None) -> Any:
+        function = self._functions[name]
+        orchestrator = getattr(function, "orchestrator_function", None)
+        if orchestrator is None:
+            raise ValueError(f"'{name}' is not an orchestrator")
+
+        context = LocalOrchestrationContext(instance_id or uuid.uuid4().hex, self._roundtrip(input_))
+        generator = orchestrator(context)
+        if not inspect.isgenerator(generator):
+            return generator
+
+        result = None
+        error = None
+        while True:
+            try:
+                if error is not None:
+                    pending, error = generator.throw(error), None
+                else:
+                    pending = generator.send(result)
+            except StopIteration as stop:
+                return self._roundtrip(stop.value)
+            try:
+                result = await self._resolve(pending)
+            except Exception as ex:
+                error = ex
+
+    async def _resolve(self, pending) -> Any:
+        if isinstance(pending, _All):
+            return list(await asyncio.gather(*(self._start(task) for task in pending.tasks)))
+        if isinstance(pending, _Any):
+            futures = [self._start(task) for task in pending.tasks]
+            await asyncio.wait(futures, return_when=asyncio.FIRST_COMPLETED)
+            # like the durable runtime, the winner is returned whether it failed or not
+            return next(task for task, future in zip(pending.tasks, futures) if future.done())
+        return await self._start(pending)
+
+    def _start(self, task: _Task) -> asyncio.Future:
+        if task._future is None:
+            if isinstance(task, _Timer):
+                delay = (task.fire_at - datetime.now(task.fire_at.tzinfo)).total_seconds()
+                task._future = asyncio.ensure_future(asyncio.sleep(max(delay, 0)))
+            else:
+                task._future = asyncio.ensure_future(self._execute(task))
+        return task._future
+
+    async def _execute(self, pending: _Call) -> Any:
+        if pending.kind == "orchestrator":
+            return await self.run(pending.name, pending.input, pending.instance_id)
+
+        self.calls += 1
+        function = self._functions[pending.name]
+        input_ = self._roundtrip(pending.input)
+        if inspect.iscoroutinefunction(function):
+            output = await function(input_)
+        else:
+            output = function(input_)
+        return self._roundtrip(output)
+
+    def _roundtrip(self, value: Any) -> Any:
+        text = json.dumps(value)
+        self.payload_bytes += len(text)
+        return json.loads(text)
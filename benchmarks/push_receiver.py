@@ -0,0 +1,196 @@
+"""Local receiver for the push sinks, standing in for a Pushgateway and a remote-write endpoint
+
+Serves, over plain HTTP:
+    PUT/POST /metrics/job/{job}/{label}/{value}...  Pushgateway, keeps the last body of each group
+    DELETE   /metrics/job/{job}/{label}/{value}...  Pushgateway, deletes the group
+    GET      /api/v1/metrics                        Pushgateway, labels of every group
+    POST     /api/v1/write                          remote write, snappy-compressed WriteRequest
+    GET      /_stats, POST /_reset                  write, sample and byte counters
+
+Remote-write bodies are decoded, so malformed protobuf is answered with 400. With
+--username, requests without the matching basic auth get 401. A share of the writes
+can fail with 503 to exercise the retries.
+
+Usage: python -m benchmarks.push_receiver --port 9091
+"""
+import argparse
+import base64
+import random
+import struct
+from collections import defaultdict
+from urllib.parse import unquote
+
+import snappy
+from aiohttp import web
+
+
+def _varint(data: bytes, position: int):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, position
+
+
+def _fields(data: bytes):
+    """Yields (field number, value) of a protobuf message, value being bytes, int or float"""
+    position = 0
+    while position < len(data):
+        key, position = _varint(data, position)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, position = _varint(data, position)
+        elif wire_type == 1:
+            value = struct.unpack_from("<d", data, position)[0]
+            position += 8
+        elif wire_type == 2:
+            length, position = _varint(data, position)
+            value = data[position:position + length]
+            position += length
+        else:
+            raise ValueError(f"Unexpected wire type {wire_type}")
+        yield field, value
+
+
+def decode_write_request(data: bytes) -> list:
+    """(labels, [(value, timestamp ms)]) of every time series of a WriteRequest"""
+    series = []
+    for field, timeseries in _fields(data):
+        if field != 1:
+            continue
+        labels = {}
+        samples = []
+        for inner, value in _fields(timeseries):
+            if inner == 1:
+                label = dict(_fields(value))
+                labels[label.get(1, b"").decode()] = label.get(2, b"").decode()
+            elif inner == 2:
+                sample = dict(_fields(value))
+                samples.append((sample.get(1, 0.0), sample.get(2, 0)))
+        series.append((labels, samples))
+    return series
+
+
+class PushReceiver:
+    def __init__(self, username: str = None, password: str = "", fail_rate: float = 0.0, seed: int = 0) -> None:
+        self.username = username
+        self.password = password
+        self.fail_rate = fail_rate
+        self.random = random.Random(seed)
+        self.reset()
+
+    def reset(self):
+        self.writes = defaultdict(int)
+        self.failed = 0
+        self.unauthorized = 0
+        self.bytes_received = 0
+        self.samples = 0
+        self.groups = {}
+        self.series = set()
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 2**20)
+        app.router.add_route("*", "/metrics/job/{grouping:.*}", self.pushgateway)
+        app.router.add_post("/api/v1/write", self.remote_write)
+        app.router.add_get("/api/v1/metrics", self.groups_api)
+        app.router.add_get("/_stats", self.stats)
+        app.router.add_post("/_reset", self.reset_stats)
+        return app
+
+    def _check(self, request: web.Request):
+        if self.username is not None:
+            expected = "Basic " + base64.b64encode(f"{self.username}:{self.password}".encode()).decode()
+            if request.headers.get("Authorization") != expected:
+                self.unauthorized += 1
+                raise web.HTTPUnauthorized()
+        if self.random.random() < self.fail_rate:
+            self.failed += 1
+            raise web.HTTPServiceUnavailable()
+
+    async def pushgateway(self, request: web.Request) -> web.Response:
+        self._check(request)
+        if request.method == "DELETE":
+            self.writes["delete"] += 1
+            self.samples -= self.groups.pop(request.match_info["grouping"], 0)
+            return web.Response(status=202)
+        body = await request.read()
+        self.writes["pushgateway"] += 1
+        self.bytes_received += len(body)
+        lines = [line for line in body.decode().splitlines() if line and not line.startswith("#")]
+        previous = self.groups.get(request.match_info["grouping"], 0)
+        self.groups[request.match_info["grouping"]] = len(lines)
+        # a group is replaced on every push, so only the difference counts
+        self.samples += len(lines) - previous
+        return web.Response(status=200)
+
+    @staticmethod
+    def _labels(grouping: str) -> dict:
+        """Labels of a grouping path after the job label name, '@base64' marking encoded values"""
+        parts = ("job/" + grouping).split("/")
+        labels = {}
+        for name, value in zip(parts[0::2], parts[1::2]):
+            if name.endswith("@base64"):
+                name, value = name[:-len("@base64")], base64.urlsafe_b64decode(value).decode()
+            labels[name] = unquote(value)
+        return labels
+
+    async def groups_api(self, request: web.Request) -> web.Response:
+        self._check(request)
+        return web.json_response({
+            "status": "success",
+            "data": [{"labels": self._labels(grouping)} for grouping in self.groups]
+        })
+
+    async def remote_write(self, request: web.Request) -> web.Response:
+        self._check(request)
+        body = await request.read()
+        if request.headers.get("Content-Encoding") != "snappy":
+            raise web.HTTPBadRequest(text="Content-Encoding must be snappy")
+        try:
+            series = decode_write_request(snappy.decompress(body))
+        except Exception as ex:
+            raise web.HTTPBadRequest(text=f"Malformed write request: {ex}")
+        self.writes["remote_write"] += 1
+        self.bytes_received += len(body)
+        for labels, samples in series:
+            if labels != dict(sorted(labels.items())) or "__name__" not in labels:
+                raise web.HTTPBadRequest(text="Labels must be sorted and include __name__")
+            self.series.add(tuple(labels.items()))
+            self.samples += len(samples)
+        return web.Response(status=204)
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "writes": dict(self.writes),
+            "failed": self.failed,
+            "unauthorized": self.unauthorized,
+            "bytes_received": self.bytes_received,
+            "samples": self.samples,
+            "groups": len(self.groups),
+            "series": len(self.series)
+        })
+
+    async def reset_stats(self, request: web.Request) -> web.Response:
+        self.reset()
+        return web.json_response({})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9091)
+    parser.add_argument("--username", default=None, help="require basic auth with this user")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of writes answered with 503")
+    args = parser.parse_args()
+
+    receiver = PushReceiver(username=args.username, password=args.password, fail_rate=args.fail_rate)
+    web.run_app(receiver.app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
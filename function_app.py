@@ -1,11 +1,12 @@
 import azure.functions as func
 import azure.durable_functions as df
-from activityfunctions.getnfslist import Nfsbloblist
-from activityfunctions.divide import Divide
-from activityfunctions.getblobnfsmetrics import Blobnfsmetrics
-from services.promethus_service import Promethus
+# the activity, service and SDK modules are imported by the triggers that use them, so a
+# cold start only pays for what the invoked trigger needs (the orchestrators need none)
+from shared_code.orchestration import fan_out, child_deadline, merge_summaries
+from datetime import datetime, timedelta
 import json
 import logging
+import os
 myApp = df.DFApp(http_auth_level=func.AuthLevel.ANONYMOUS)
 
 # An HTTP-Triggered Function with a Durable Functions Client binding
@@ -17,31 +18,148 @@ async def http_start(req: func.HttpRequest, client):
     function_name = req.route_params.get('sddrlddr_orchestrator')
     instance_id = await client.start_new('sddrlddr_orchestrator',None,None)
     response=await client.wait_for_completion_or_create_check_status_response(req,instance_id)
-    return response
+    status=await client.get_status(instance_id)
+    if status.runtime_status!=df.OrchestrationRuntimeStatus.Completed:
+        return response
+    # the output is a summary, the exposition it names is served as before
+    from services.scrape_service import ScrapeService
+    exposition=await ScrapeService.get_exposition(status.output)
+    if exposition is None:
+        return func.HttpResponse("The scrape completed without an exposition",status_code=500)
+    return func.HttpResponse(exposition,mimetype="text/plain")
+
+# Cached scrape endpoint: serves the last completed collection, refreshing it in the background
+@myApp.route(route="metrics")
+@myApp.durable_client_input(client_name="client")
+async def scrape_metrics(req: func.HttpRequest, client):
+    from services.promethus_service import Promethus
+    from services.scrape_service import ScrapeService
+    if os.getenv('CollectionMode','burst').strip().lower()=='continuous':
+        # the collector timer keeps the cache fresh, a scrape only reads it
+        cached=await ScrapeService.get_collected()
+        exposition=cached['exposition'] if cached is not None else None
+        if cached is not None: cached['refreshing']=False
+    else:
+        cached=await ScrapeService.get_output(client,'sddrlddr_orchestrator')
+        exposition=await ScrapeService.get_exposition(cached['output']) if cached is not None else None
+    if exposition is None:
+        return func.HttpResponse("No metrics collected yet",status_code=503,headers={"Retry-After":"30"})
+    body=exposition+Promethus.scrape_status(cached['age'],cached['refreshing']).encode()
+    if 'application/openmetrics-text' in req.headers.get('Accept',''):
+        return func.HttpResponse(Promethus.openmetrics(body)+b"# EOF\n",headers={"Content-Type":"application/openmetrics-text; version=1.0.0; charset=utf-8"})
+    return func.HttpResponse(body,mimetype="text/plain")
+
+# Continuous collector: with CollectionMode=continuous, refreshes the accounts due every minute.
+# Timer triggers run once per app at a time. The schedule is fixed since a %setting% schedule
+# fails to load without the setting, the tick budget follows the time actually elapsed.
+@myApp.timer_trigger(schedule="0 * * * * *",arg_name="timer",run_on_startup=False,use_monitor=False)
+async def continuous_collector(timer: func.TimerRequest):
+    if os.getenv('CollectionMode','burst').strip().lower()!='continuous':
+        return
+    try:
+        from activityfunctions.collect import Collector
+        await Collector.tickfunction()
+    except Exception as e:
+        logging.error(f"Error in the collector tick {e}")
 
 # Orchestrator
 @myApp.orchestration_trigger(context_name="context")
 def sddrlddr_orchestrator(context):
-    nfsblobaccounts=yield context.call_activity('getnfsbloblist')
-    blobnfs_metrics_parallel=[]
-    bloblist_final=[]
-    for i in nfsblobaccounts:
-        blobnfs_list_divided=yield context.call_activity('divideaccounts',i['data'])
-        blobnfs_metrics_parallel.extend([context.call_activity("getnfsblobmetrics",{"credential_key":i['credential_key'],"data":db}) for db in blobnfs_list_divided])
-    bloblist_final=yield context.task_all(blobnfs_metrics_parallel)
-    json_list=[]
-    for mainlist in bloblist_final:
-        for sublist in mainlist:
-            json_list.append(sublist)
-    promethus_output=Promethus.collector(metriclist=json_list)
-    return promethus_output
+    nfsblobaccounts=yield context.call_activity('getnfsbloblist',context.instance_id)
+    # the fan-out settings are read once here and handed down, so every level replays the same
+    options={
+        "by_subscription":os.getenv('ShardBySubscription','false').strip().lower()=='true',
+        "shard_width":int(os.getenv('ShardFanOutWidth','8')),
+        "activity_width":int(os.getenv('ActivityFanOutWidth','50')),
+        "margin":float(os.getenv('ShardDeadlineMarginSeconds','30')),
+        "deadline":(context.current_utc_datetime+timedelta(seconds=float(os.getenv('ShardTimeoutSeconds','600')))).isoformat()
+    }
+    # one sub-orchestration per credential key, each with its own (smaller) history
+    shards=[
+        (lambda i=i,accounts=accounts: context.call_sub_orchestrator('credential_orchestrator',{
+            "scrape_id":context.instance_id,
+            "shard":str(i),
+            "credential_key":accounts['credential_key'],
+            "data":accounts['data'],
+            "options":options
+        },f"{context.instance_id}-{i}"))
+        for i,accounts in enumerate(nfsblobaccounts or [])
+    ]
+    summaries,failed,timed_out=yield from fan_out(context,shards,options['shard_width'],datetime.fromisoformat(options['deadline']))
+    merged=merge_summaries(summaries)
+    # exposition runs once in an activity rather than on every replay of the orchestrator
+    summary=yield context.call_activity('exposemetrics',{
+        "scrape_id":context.instance_id,
+        "parts":merged['parts'],
+        "telemetry":[f"{context.instance_id}/telemetry/inventory.json"]
+    })
+    return {
+        **(summary or {}),
+        "duplicates_removed":sum(accounts.get('duplicates_removed',0) for accounts in nfsblobaccounts or []),
+        "shards":len(shards),
+        "failed_shards":failed,
+        "timed_out_shards":timed_out,
+        "failed_parts":merged['failed'],
+        "timed_out_parts":merged['timed_out']
+    }
+
+@myApp.orchestration_trigger(context_name="context")
+def credential_orchestrator(context):
+    shard=context.get_input()
+    options=shard['options']
+    if not options['by_subscription']:
+        return (yield from metric_shard(context,shard))
+
+    subscriptions=yield context.call_activity('dividesubscriptions',shard['data'])
+    children=[
+        (lambda i=i,data=data: context.call_sub_orchestrator('subscription_orchestrator',{
+            **shard,
+            "shard":f"{shard['shard']}.{i}",
+            "data":data,
+            "options":{**options,"deadline":child_deadline(options['deadline'],options['margin']).isoformat()}
+        },f"{context.instance_id}-{i}"))
+        for i,data in enumerate(subscriptions or [])
+    ]
+    summaries,failed,timed_out=yield from fan_out(context,children,options['shard_width'],child_deadline(options['deadline'],options['margin']))
+    merged=merge_summaries(summaries)
+    merged['failed']+=failed
+    merged['timed_out']+=timed_out
+    return merged
+
+@myApp.orchestration_trigger(context_name="context")
+def subscription_orchestrator(context):
+    return (yield from metric_shard(context,context.get_input()))
+
+def metric_shard(context,shard):
+    """Divides the accounts of a shard into batches and runs the metric activities"""
+    options=shard['options']
+    blobnfs_list_divided=yield context.call_activity('divideaccounts',shard['data'])
+    # the metric records go to the result store under the scrape ID, only summaries come back
+    calls=[
+        (lambda i=i,db=db: context.call_activity("getnfsblobmetrics",{
+            "credential_key":shard['credential_key'],
+            "data":db,
+            "scrape_id":shard['scrape_id'],
+            "part":f"{shard['shard']}.{i}"
+        }))
+        for i,db in enumerate(blobnfs_list_divided or [])
+    ]
+    parts,failed,timed_out=yield from fan_out(context,calls,options['activity_width'],child_deadline(options['deadline'],options['margin']))
+    parts=[part for part in parts if part is not None]
+    return {
+        "parts":parts,
+        "accounts":sum(part['accounts'] for part in parts),
+        "failed":failed,
+        "timed_out":timed_out
+    }
     
 
 # Activity
 @myApp.activity_trigger(input_name="name")
 async def getnfsbloblist(name: str):
     try:
-        blobnfsaccounts=await Nfsbloblist.getnfsbloblistfunction()
+        from activityfunctions.getnfslist import Nfsbloblist
+        blobnfsaccounts=await Nfsbloblist.getnfsbloblistfunction(name)
         return blobnfsaccounts
     except Exception as e:
         logging.error(f"Error with NFSbloblist function {e}")
@@ -49,16 +167,35 @@ async def getnfsbloblist(name: str):
 @myApp.activity_trigger(input_name="blobnfslist")
 def divideaccounts(blobnfslist):
     try:
+        from activityfunctions.divide import Divide
         divided_list=Divide.dividefunction(blobnfslist)
         return divided_list
     except Exception as e:
         logging.error(f"Error with dividing list {e}")
 
+@myApp.activity_trigger(input_name="accounts")
+def dividesubscriptions(accounts):
+    try:
+        from activityfunctions.divide import Divide
+        return Divide.split_by_subscription(accounts)
+    except Exception as e:
+        logging.error(f"Error with splitting by subscription {e}")
+
 @myApp.activity_trigger(input_name="component")
 async def getnfsblobmetrics(component):
     try:
+        from activityfunctions.getblobnfsmetrics import Blobnfsmetrics
         responseoutput=await Blobnfsmetrics.nfsmetricfunction(component)
         return responseoutput
     except Exception as e:
         logging.error(f"Error in get nfs metrics {e}")
 
+@myApp.activity_trigger(input_name="scrape")
+async def exposemetrics(scrape):
+    try:
+        from activityfunctions.exposemetrics import Exposition
+        summary=await Exposition.exposefunction(scrape)
+        return summary
+    except Exception as e:
+        logging.error(f"Error in exposing metrics {e}")
+
@@ -0,0 +1,124 @@
+import os
+import warnings
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+# default size limit of a storage account, 5 PiB
+DEFAULT_ACCOUNT_CAPACITY = 5 * 2**50
+SECONDS_PER_DAY = 86400.0
+
+
+class AnalyticsService:
+    """Vectorized statistics over the metric timeseries of a whole batch of accounts"""
+
+    @staticmethod
+    def to_matrix(series: list[Optional[tuple[list, list]]]) -> tuple[np.ndarray, np.ndarray]:
+        """Packs per-account (time stamps, values) series into two right-aligned 2-D arrays
+
+        Time stamps are ISO strings or datetimes, converted to epoch seconds. Accounts with
+        fewer points (or no series at all) are padded with NaN on the left.
+
+        Returns:
+            (times, values): float arrays of shape (accounts, longest series).
+        """
+        width = max((len(values) for _, values in filter(None, series)), default=0)
+        times = np.full((len(series), width), np.nan)
+        values = np.full((len(series), width), np.nan)
+        for row, item in enumerate(series):
+            if not item or not item[1]:
+                continue
+            stamps, points = item
+            n = len(points)
+            times[row, width - n:] = AnalyticsService._epoch_seconds(stamps)
+            values[row, width - n:] = np.array(points, dtype=float)
+        return times, values
+
+    @staticmethod
+    def _epoch_seconds(stamps: list) -> np.ndarray:
+        if stamps and isinstance(stamps[0], datetime):
+            return np.array([stamp.timestamp() for stamp in stamps])
+        # 'YYYY-MM-DDTHH:MM:SS' prefix, numpy parses it without the zone suffix
+        parsed = np.array([str(stamp)[:19] for stamp in stamps], dtype="datetime64[s]")
+        return parsed.astype("int64").astype(float)
+
+    @staticmethod
+    def fleet_stats(
+        times: np.ndarray,
+        values: np.ndarray,
+        capacity: Optional[float] = None,
+        percentiles: tuple = (50, 95)
+    ) -> dict[str, np.ndarray]:
+        """Per-account statistics of a (accounts, points) matrix in a single vectorized pass
+
+        NaN marks a missing point. The growth rate is the least-squares slope of the values
+        over time, in units per day, and days_to_full projects it from the latest value up
+        to capacity ('AccountCapacityBytes', default 5 PiB). Entries are NaN where they are
+        undefined: no points, a single point, or no growth for days_to_full.
+
+        Returns:
+            dictionary of 1-D arrays (one entry per account): latest, mean, min, max,
+            p<percentile> for each percentile, growth_per_day and days_to_full.
+        """
+        if values.shape[1] == 0:
+            # no points at all, one missing column keeps the indexing below valid
+            times = values = np.full((values.shape[0], 1), np.nan)
+        if capacity is None:
+            capacity = float(os.getenv("AccountCapacityBytes", str(DEFAULT_ACCOUNT_CAPACITY)))
+        valid = ~np.isnan(values) & ~np.isnan(times)
+        # a point without time stamp is as good as missing
+        values = np.where(valid, values, np.nan)
+        count = valid.sum(axis=1)
+
+        with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+            # rows without points are expected, their statistics stay NaN
+            warnings.simplefilter("ignore", RuntimeWarning)
+            rows = np.arange(values.shape[0])
+            has_points = count > 0
+            last_valid = np.maximum(count - 1, 0)
+
+            # one sort per row (NaN sorts last) gives min, max and the percentiles,
+            # much faster than np.nanpercentile, which falls back to a per-row loop
+            ordered = np.sort(values, axis=1)
+            t = np.where(valid, times, 0.0)
+            y = np.where(valid, values, 0.0)
+            t_mean = t.sum(axis=1) / count
+            y_mean = y.sum(axis=1) / count
+            stats = {
+                "mean": y_mean,
+                "min": np.where(has_points, ordered[:, 0], np.nan),
+                "max": np.where(has_points, ordered[rows, last_valid], np.nan)
+            }
+            for q in percentiles:
+                position = last_valid * (q / 100.0)
+                lower = np.floor(position).astype(int)
+                upper = np.minimum(lower + 1, last_valid)
+                fraction = position - lower
+                value = ordered[rows, lower] * (1 - fraction) + ordered[rows, upper] * fraction
+                stats[f"p{q}"] = np.where(has_points, value, np.nan)
+
+            # newest valid point of each row
+            last = values.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+            stats["latest"] = np.where(has_points, values[rows, last], np.nan)
+
+            # least-squares slope per row, over the valid points only
+            dt = np.where(valid, times - t_mean[:, None], 0.0)
+            dy = np.where(valid, values - y_mean[:, None], 0.0)
+            slope = (dt * dy).sum(axis=1) / (dt * dt).sum(axis=1)
+            growth = np.where(count > 1, slope * SECONDS_PER_DAY, np.nan)
+            stats["growth_per_day"] = growth
+            stats["days_to_full"] = np.where(growth > 0, (capacity - stats["latest"]) / growth, np.nan)
+
+        return stats
+
+    @staticmethod
+    def to_records(stats: dict[str, np.ndarray]) -> list[Optional[dict]]:
+        """Splits the statistics arrays back into one JSON-friendly dictionary per account"""
+        keys = list(stats)
+        columns = [stats[key].tolist() for key in keys]
+        records = []
+        for row in zip(*columns):
+            record = {key: value for key, value in zip(keys, row) if value == value}
+            records.append(record or None)
+        return records
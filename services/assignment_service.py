@@ -0,0 +1,105 @@
+import logging
+import os
+from statistics import median
+from typing import Optional
+
+from shared_code.state_store import get_state_store
+from shared_code.records import resource_key
+
+# weight of the newest observation in the moving average of the fetch latency
+LATENCY_EWMA_ALPHA = 0.3
+
+
+class AssignmentService:
+    """Assigns every storage account to a single credential key before the metric fan-out
+
+    Service principals often overlap on subscriptions, so the inventories of several keys
+    can list the same account. Accounts are keyed on their lower-cased resource ID, and
+    each one is fetched through only one of the keys that can see it.
+    """
+
+    @staticmethod
+    async def assign(inventories: list[dict], strategy: Optional[str] = None) -> list[dict]:
+        """Removes the duplicate accounts across the inventories of the credential keys
+
+        Args:
+            inventories: list of {"credential_key", "data"} with the account rows of each key.
+            strategy: 'load' gives a shared account to the key with the fewest accounts so far,
+                'latency' weighs that count by the key's observed metric fetch time per account,
+                'off' keeps the duplicates. Default is the 'AccountAssignment' setting ('load').
+        Returns:
+            the inventories with each account under a single key and, per key, the number of
+            'duplicates_removed' from its rows.
+        """
+        if strategy is None:
+            strategy = os.getenv("AccountAssignment", "load").strip().lower()
+        if strategy == "off" or len(inventories) < 2:
+            return [{**inventory, "duplicates_removed": 0} for inventory in inventories]
+
+        weights = {inventory["credential_key"]: 1.0 for inventory in inventories}
+        if strategy == "latency":
+            weights.update(await AssignmentService._latency_weights(list(weights)))
+
+        owners = {}
+        rows = {}
+        for order, inventory in enumerate(inventories):
+            for row in inventory["data"]:
+                key = resource_key(row["id"])
+                owners.setdefault(key, []).append(order)
+                rows.setdefault(key, row)
+
+        load = [0] * len(inventories)
+        assigned = [[] for _ in inventories]
+        # accounts only one key can see go first, so the shared ones balance around them
+        for key, candidates in sorted(owners.items(), key=lambda item: (len(item[1]), item[0])):
+            order = min(
+                dict.fromkeys(candidates),
+                key=lambda i: ((load[i] + 1) * weights[inventories[i]["credential_key"]], i)
+            )
+            assigned[order].append(rows[key])
+            load[order] += 1
+
+        output = []
+        for inventory, accounts in zip(inventories, assigned):
+            output.append({
+                **inventory,
+                "data": accounts,
+                "duplicates_removed": len(inventory["data"]) - len(accounts)
+            })
+        duplicates = sum(len(candidates) - 1 for candidates in owners.values())
+        logging.info(
+            f"Assigned {len(owners)} accounts to {len(inventories)} credential keys by {strategy}, "
+            f"removed {duplicates} duplicate fetches"
+        )
+        return output
+
+    @staticmethod
+    async def record_latency(credential_key: str, seconds_per_account: float):
+        """Folds a metric fetch time per account into the moving average of the key"""
+        store = get_state_store("assignment")
+        try:
+            previous = await store.get("latency", credential_key)
+            value = seconds_per_account
+            if previous is not None:
+                value = LATENCY_EWMA_ALPHA * value + (1 - LATENCY_EWMA_ALPHA) * previous["seconds_per_account"]
+            await store.put("latency", credential_key, {"seconds_per_account": value})
+        except Exception as ex:
+            logging.warning(f"Could not record the fetch latency of '{credential_key}': {ex}")
+
+    @staticmethod
+    async def _latency_weights(credential_keys: list[str]) -> dict[str, float]:
+        try:
+            observed = await get_state_store("assignment").get_all("latency")
+        except Exception as ex:
+            logging.warning(f"Could not read the fetch latencies, assigning by load: {ex}")
+            return {}
+        latencies = {
+            key: observed[key]["seconds_per_account"]
+            for key in credential_keys
+            if key in observed and observed[key]["seconds_per_account"] > 0
+        }
+        if not latencies:
+            return {}
+        # keys without observations yet count as typical
+        typical = median(latencies.values())
+        return {key: latencies.get(key, typical) / typical for key in credential_keys}
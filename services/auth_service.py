@@ -4,6 +4,8 @@ from typing import Tuple
 from azure.core.credentials_async import AsyncTokenCredential
 from azure.identity.aio import ChainedTokenCredential, AzureCliCredential, ManagedIdentityCredential, ClientSecretCredential
 from shared_code.cloud_provider import get_cloud_provider
+from shared_code.client_pool import ClientPool
+from shared_code.token_cache import CachedTokenCredential
 from msrestazure.azure_cloud import Cloud
 
 class AuthService:
@@ -13,9 +15,21 @@ class AuthService:
         '''returns Azure Credential object'''
         return ChainedTokenCredential(ManagedIdentityCredential(), AzureCliCredential())
     
+    # process-wide registry of credentials, keyed by credential key
+    _registry: dict[str, Tuple[CachedTokenCredential, Cloud]] = {}
+
     @staticmethod
-    def get_credential(credential_key) -> Tuple[ClientSecretCredential, Cloud]:
-        '''Fetches credentials from configuration'''
+    def get_credential(credential_key) -> Tuple[CachedTokenCredential, Cloud]:
+        '''Fetches credentials from configuration
+
+        Credentials are built once per credential key and shared by the whole worker
+        process, together with their token cache. Exiting an 'async with' block on the
+        returned credential does not close it.
+        '''
+        cached = AuthService._registry.get(credential_key)
+        if cached is not None:
+            return cached
+
         try:
             spn = os.getenv(credential_key, "").strip()
             if not spn:
@@ -36,13 +50,41 @@ class AuthService:
                 client_secret=cred_dict["clientSecret"],
                 authority=cloud.endpoints.active_directory
             )
-
-            return credential, cloud
+            cached = (
+                CachedTokenCredential(
+                    credential,
+                    refresh_margin=float(os.getenv("TokenRefreshMarginSeconds", "300"))
+                ),
+                cloud
+            )
+            AuthService._registry[credential_key] = cached
+            return cached
     
         except Exception as e:
             logging.error(e)
             raise
 
+    @staticmethod
+    def register_credential(credential_key: str, credential: AsyncTokenCredential, cloud: Cloud):
+        '''Registers an already built credential for the key, e.g. for local stand-ins'''
+        AuthService._registry[credential_key] = (CachedTokenCredential(credential), cloud)
+
+    @staticmethod
+    def token_stats() -> dict[str, dict]:
+        '''Returns the token cache hit rate and fetch latency for each credential key'''
+        return {key: credential.stats() for key, (credential, _) in AuthService._registry.items()}
+
+    @staticmethod
+    async def close_credentials():
+        '''Closes every registered credential'''
+        registry = AuthService._registry
+        AuthService._registry = {}
+        for credential, _ in registry.values():
+            try:
+                await credential.aclose()
+            except Exception as e:
+                logging.warning(f"Error closing credential: {e}")
+
     @staticmethod
     def get_credential_keys() -> list[str]:
         result = []
@@ -53,4 +95,7 @@ class AuthService:
             
             result.append(key)
 
-        return result
\ No newline at end of file
+        return result
+
+
+ClientPool.on_close(AuthService.close_credentials)
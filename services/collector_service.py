@@ -0,0 +1,151 @@
+import json
+import math
+import os
+import zlib
+from typing import Optional
+
+import numpy as np
+
+SCHEDULE_VERSION = 1
+# result store objects of the collector read by the scrape endpoint, the status goes last
+STATUS_NAME = "collector/status.json"
+EXPOSITION_NAME = "collector/metrics.txt"
+# columns of a schedule besides the account keys, one float per account
+SCHEDULE_COLUMNS = ("phase", "period", "next_due", "change_rate", "last_fetch")
+
+
+class CollectorService:
+    """Refresh schedule of the continuous collector, one entry per account
+
+    Instead of fetching the whole fleet at once, every tick of the collector refreshes
+    the accounts that are due. Each account is refreshed once its next data point can be
+    there: the newest point it returned plus its period and 'CollectorIngestionDelaySeconds'
+    (default 600). The period starts at 'CollectorPointSeconds' (default 3600, UsedCapacity
+    is published hourly) and follows how often the values of the account actually change:
+    an exponentially weighted change rate over the new points ('CollectorChangeAlpha',
+    default 0.3) gives period = point interval / rate, rounded down to whole intervals,
+    between 'CollectorMinPeriodSeconds' (default 3600) and 'CollectorMaxPeriodSeconds'
+    (default 21600). Accounts whose point is late or whose fetch failed are retried after
+    'CollectorRetrySeconds' (default 300).
+
+    Due times are offset by a phase per subscription and region, so the accounts of a
+    batch request stay due together while the groups spread over the whole interval.
+    A tick takes at most the number of refreshes the schedule needs on average for the
+    time elapsed, times 'CollectorHeadroom' (default 1.5), so overdue accounts wait for the
+    next tick rather than making a burst. Accounts never fetched are taken first, up to
+    'CollectorMaxPerTick' (default 5000).
+    """
+
+    @staticmethod
+    def phase(group: str) -> float:
+        """Deterministic offset in [0, 1) of a (subscription, region) group"""
+        return zlib.crc32(group.encode()) / 2**32
+
+    @staticmethod
+    def align(schedule: Optional[dict], keys: list[str], groups: list[str]) -> dict:
+        """Schedule of the given accounts, keeping the entries of those already scheduled
+
+        New accounts are due right away, with the default period and change rate.
+        """
+        point = float(os.getenv("CollectorPointSeconds", "3600"))
+        n = len(keys)
+        aligned = {
+            "keys": list(keys),
+            "phase": np.array([CollectorService.phase(group) for group in groups], dtype=float),
+            "period": np.full(n, point),
+            "next_due": np.zeros(n),
+            "change_rate": np.ones(n),
+            "last_fetch": np.full(n, np.nan)
+        }
+        if schedule:
+            previous = {key: index for index, key in enumerate(schedule["keys"])}
+            rows = np.array([previous.get(key, -1) for key in keys], dtype=np.int64)
+            kept = rows >= 0
+            for column in ("period", "next_due", "change_rate", "last_fetch"):
+                aligned[column][kept] = schedule[column][rows[kept]]
+        return aligned
+
+    @staticmethod
+    def select(schedule: dict, now: float, elapsed: float) -> np.ndarray:
+        """Indices of the accounts to refresh in this tick, most overdue first
+
+        Args:
+            schedule: schedule from align.
+            now: epoch seconds of the tick.
+            elapsed: seconds since the previous tick, which sets the budget.
+        """
+        headroom = float(os.getenv("CollectorHeadroom", "1.5"))
+        max_per_tick = int(os.getenv("CollectorMaxPerTick", "5000"))
+        never = np.isnan(schedule["last_fetch"])
+        due = np.flatnonzero(~never & (schedule["next_due"] <= now))
+        # refreshes per second the schedule needs on average, for the time elapsed
+        budget = math.ceil(float(np.sum(elapsed / schedule["period"][~never])) * headroom)
+        due = due[np.argsort(schedule["next_due"][due], kind="stable")][:budget]
+        first = np.flatnonzero(never)[:max(max_per_tick - len(due), 0)]
+        return np.concatenate((first, due))
+
+    @staticmethod
+    def reschedule(
+        schedule: dict,
+        indices: np.ndarray,
+        times_before: np.ndarray,
+        times_after: np.ndarray,
+        changed: np.ndarray,
+        now: float
+    ):
+        """Sets the next due time of the refreshed accounts from what their fetch returned
+
+        Args:
+            schedule: schedule from align, updated in place.
+            indices: accounts refreshed.
+            times_before, times_after: epoch seconds of their newest point before and after
+                the fetch, NaN when unknown.
+            changed: whether their values differ from the previous ones.
+            now: epoch seconds of the tick.
+        """
+        point = float(os.getenv("CollectorPointSeconds", "3600"))
+        delay = float(os.getenv("CollectorIngestionDelaySeconds", "600"))
+        retry = float(os.getenv("CollectorRetrySeconds", "300"))
+        alpha = float(os.getenv("CollectorChangeAlpha", "0.3"))
+        min_period = float(os.getenv("CollectorMinPeriodSeconds", "3600"))
+        max_period = float(os.getenv("CollectorMaxPeriodSeconds", "21600"))
+
+        with np.errstate(invalid="ignore"):
+            new_point = ~np.isnan(times_after) & ~(times_after <= times_before)
+        # the change rate only learns from a point that follows a known one
+        learn = new_point & ~np.isnan(times_before)
+        rate = schedule["change_rate"][indices]
+        rate = np.where(learn, (1 - alpha) * rate + alpha * changed, rate)
+        # whole point intervals, rounded down, so the accounts of a group stay due in the same tick
+        period = np.clip(np.floor(1 / np.maximum(rate, point / max_period) + 1e-9) * point, min_period, max_period)
+
+        phase = schedule["phase"][indices] * point
+        next_due = np.where(new_point, times_after + period + delay + phase, now + retry)
+        # a point that should be there already is late, look again shortly
+        next_due = np.where(next_due <= now, now + retry, next_due)
+
+        schedule["change_rate"][indices] = rate
+        schedule["period"][indices] = period
+        schedule["next_due"][indices] = next_due
+        schedule["last_fetch"][indices] = now
+
+    @staticmethod
+    def to_json(schedule: dict) -> str:
+        def column(values: np.ndarray) -> list:
+            return [value if value == value else None for value in values.tolist()]
+
+        return json.dumps({
+            "v": SCHEDULE_VERSION,
+            "keys": schedule["keys"],
+            **{name: column(schedule[name]) for name in SCHEDULE_COLUMNS}
+        }, separators=(",", ":"))
+
+    @staticmethod
+    def from_json(text) -> dict:
+        data = json.loads(text)
+        if data.get("v") != SCHEDULE_VERSION:
+            raise ValueError(f"Unsupported schedule version {data.get('v')}")
+        return {
+            "keys": data["keys"],
+            **{name: np.array([np.nan if value is None else value for value in data[name]], dtype=float) for name in SCHEDULE_COLUMNS}
+        }
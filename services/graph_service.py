@@ -1,4 +1,6 @@
+import asyncio
 import logging
+import os
 from time import time
 
 from azure.core.credentials_async import AsyncTokenCredential
@@ -6,9 +8,14 @@ from azure.mgmt.resourcegraph.aio import ResourceGraphClient
 from azure.mgmt.resourcegraph.models import QueryRequest, QueryRequestOptions
 from msrestazure.azure_cloud import Cloud, AZURE_PUBLIC_CLOUD
 
-from typing import Optional
+from typing import AsyncIterator, Optional
 
 from .subscription_service import SubscriptionService
+from shared_code.client_pool import ClientPool
+from shared_code.circuit_breaker import CircuitBreaker
+from shared_code.scheduler import RequestScheduler
+from shared_code.telemetry import Telemetry
+from shared_code.utilities import list_to_chunks
 
 class GraphService:
 
@@ -17,49 +24,163 @@ class GraphService:
         query_str: str,
         credential: AsyncTokenCredential,
         sub_ids: Optional[list[str]] = None,
-        cloud: Cloud = AZURE_PUBLIC_CLOUD
+        cloud: Cloud = AZURE_PUBLIC_CLOUD,
+        credential_key: Optional[str] = None,
+        shard_size: Optional[int] = None,
+        page_size: Optional[int] = None
     ) -> list[object]:
-        
+        """Runs a Resource Graph query and returns all the rows
+
+        See stream_query for the meaning of the arguments.
+        """
         t0 = time()
         data = []
-        async with credential:
-            if sub_ids is None:
-                sub_ids = await GraphService._get_sub_ids(credential, cloud)
-            graph_client = ResourceGraphClient(
-                credential,
-                base_url=cloud.endpoints.resource_manager,
-                credential_scopes=[cloud.endpoints.resource_manager+"/.default"]
-            )
-            query_request = QueryRequest(subscriptions=sub_ids, query=query_str)
-            async with graph_client:
-                query_response = await graph_client.resources(query_request)
-                data += query_response.data
-                while hasattr(query_response, "skip_token"):
-                    skip_token = query_response.skip_token
-                    if skip_token is None:
-                        break
-                    options = QueryRequestOptions(skip_token=skip_token)
-                    query_request = QueryRequest(
-                        subscriptions=sub_ids, 
-                        query=query_str, 
-                        options=options
-                    )
-                    query_response = await graph_client.resources(query_request)
-                    data += query_response.data
-        
-            if data is None:
-                data = []
+        async for page in GraphService.stream_query(
+            query_str,
+            credential,
+            sub_ids=sub_ids,
+            cloud=cloud,
+            credential_key=credential_key,
+            shard_size=shard_size,
+            page_size=page_size
+        ):
+            data += page
 
         logging.info("Query took {:.3f} s".format(time()-t0))
         logging.info(f"We obtained a total of {len(data)} resources")
         
         return data
 
+    @staticmethod
+    async def stream_query(
+        query_str: str,
+        credential: AsyncTokenCredential,
+        sub_ids: Optional[list[str]] = None,
+        cloud: Cloud = AZURE_PUBLIC_CLOUD,
+        credential_key: Optional[str] = None,
+        shard_size: Optional[int] = None,
+        page_size: Optional[int] = None
+    ) -> AsyncIterator[list]:
+        """Runs a Resource Graph query and yields the pages of rows as they arrive
+
+        Args:
+            query_str: Resource Graph query.
+            credential: token credential with access to the subscriptions.
+            sub_ids: subscriptions to query. Default is every subscription of the credential.
+            cloud: Azure cloud instance to indicate where are the resources.
+            credential_key: if given, the client is taken from the process-wide pool.
+            shard_size: number of subscriptions per shard. Shards run concurrently, each one
+                following its own skip_token chain. 0 disables sharding.
+                Default is the 'GraphShardSize' setting.
+            page_size: maximum rows per page (up to 1000). Default is the 'GraphPageSize' setting.
+        """
+        if shard_size is None:
+            shard_size = int(os.getenv("GraphShardSize", "200"))
+        if page_size is None:
+            page_size = int(os.getenv("GraphPageSize", "1000"))
+
+        async with credential:
+            if sub_ids is None:
+                sub_ids = await GraphService._get_sub_ids(credential, cloud, credential_key)
+            shards = list(list_to_chunks(sub_ids, shard_size)) if shard_size and sub_ids else [sub_ids]
+
+            if credential_key is not None:
+                graph_client = ClientPool.get_client(ResourceGraphClient, credential, cloud, credential_key)
+                async for page in GraphService._merge_shards(
+                    graph_client, query_str, shards, credential_key, page_size
+                ):
+                    yield page
+            else:
+                graph_client = ClientPool.create_client(ResourceGraphClient, credential, cloud)
+                async with graph_client:
+                    async for page in GraphService._merge_shards(
+                        graph_client, query_str, shards, "resourcegraph", page_size
+                    ):
+                        yield page
 
     @staticmethod
-    async def _get_sub_ids(credential: AsyncTokenCredential, cloud: Cloud = AZURE_PUBLIC_CLOUD):
+    async def _merge_shards(
+        graph_client: ResourceGraphClient,
+        query_str: str,
+        shards: list[list[str]],
+        scope: str,
+        page_size: int
+    ) -> AsyncIterator[list]:
+        """Paginates every shard concurrently and yields the pages in arrival order"""
+        queue = asyncio.Queue()
+        done = object()
+
+        async def run_shard(shard: list[str]):
+            try:
+                async for page in GraphService._paginate(graph_client, query_str, shard, scope, page_size):
+                    await queue.put(page)
+                await queue.put(done)
+            except Exception as ex:
+                await queue.put(ex)
+
+        tasks = [asyncio.create_task(run_shard(shard)) for shard in shards]
+        try:
+            remaining = len(tasks)
+            while remaining:
+                page = await queue.get()
+                if page is done:
+                    remaining -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    yield page
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    async def _paginate(
+        graph_client: ResourceGraphClient,
+        query_str: str,
+        sub_ids: list[str],
+        scope: str = "resourcegraph",
+        page_size: Optional[int] = None
+    ) -> AsyncIterator[list]:
+        scheduler = RequestScheduler.default()
+        breaker = os.getenv("CircuitBreaker", "true").strip().lower() == "true"
+
+        async def fetch_page(query_request: QueryRequest):
+            def call():
+                return scheduler.run(
+                    scope,
+                    lambda slot: graph_client.resources(query_request, raw_response_hook=slot.response_hook)
+                )
+            with Telemetry.default().stage("graph_page"):
+                if breaker:
+                    # a credential that keeps failing is rejected at once, see InventoryService
+                    return await CircuitBreaker.default().call(f"graph/{scope}", call)
+                return await call()
+
+        options = QueryRequestOptions(top=page_size) if page_size else None
+        query_request = QueryRequest(subscriptions=sub_ids, query=query_str, options=options)
+        query_response = await fetch_page(query_request)
+        yield query_response.data or []
+        while hasattr(query_response, "skip_token"):
+            skip_token = query_response.skip_token
+            if skip_token is None:
+                break
+            options = QueryRequestOptions(skip_token=skip_token, top=page_size)
+            query_request = QueryRequest(
+                subscriptions=sub_ids, 
+                query=query_str, 
+                options=options
+            )
+            query_response = await fetch_page(query_request)
+            yield query_response.data or []
+
+    @staticmethod
+    async def _get_sub_ids(
+        credential: AsyncTokenCredential,
+        cloud: Cloud = AZURE_PUBLIC_CLOUD,
+        credential_key: Optional[str] = None
+    ):
         
-        subscriptions = await SubscriptionService.subscription_list(credential, cloud)
+        subscriptions = await SubscriptionService.subscription_list(credential, cloud, credential_key)
         sub_ids = SubscriptionService.filter_ids(subscription_list=subscriptions)
 
         return sub_ids
\ No newline at end of file
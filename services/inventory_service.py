@@ -0,0 +1,239 @@
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from time import time
+from typing import Callable, Optional
+
+from azure.core.credentials_async import AsyncTokenCredential
+from msrestazure.azure_cloud import Cloud
+
+from shared_code.state_store import StateStore, get_state_store
+from shared_code.records import resource_key
+from shared_code.utilities import list_to_chunks
+from .graph_service import GraphService
+from .subscription_service import SubscriptionService
+
+# resourcechanges keeps 14 days of history, stay well inside it
+MAX_DELTA_AGE = timedelta(days=7)
+# number of resource IDs sent in a single 'id in~ (...)' filter
+DELTA_ID_CHUNK = 500
+
+
+class InventoryService:
+    """Persisted inventory of the monitored accounts for each credential key
+
+    The inventory is served from the state store while it is younger than
+    'InventoryTtlSeconds'. Once stale it is refreshed in delta mode: Resource Graph
+    'resourcechanges' is queried for the storage accounts changed since the last sync,
+    only those are re-queried, and a cheap count query validates the result. A full
+    query runs when there is no inventory yet, when the subscriptions of the key changed
+    (resourcechanges only covers the subscriptions queried), when the delta fails or does
+    not add up, when 'InventoryDeltaMode' is disabled, or every 'InventoryFullSyncSeconds'.
+    If the full query fails too (e.g. the Resource Graph breaker of the key is open),
+    the stored inventory is served, however old. If the state store cannot be read, the
+    inventory comes from a full query without being stored.
+    """
+
+    @staticmethod
+    def _store() -> StateStore:
+        return get_state_store("inventory")
+
+    @staticmethod
+    async def get_accounts(
+        credential_key: str,
+        credential: AsyncTokenCredential,
+        cloud: Cloud,
+        build_query: Callable[[str], str],
+        count_query: str,
+        resource_type: str = "microsoft.storage/storageaccounts",
+        name_filter: Optional[str] = None
+    ) -> list[dict]:
+        """Returns the inventory rows for the credential key
+
+        Args:
+            credential_key: credential key that owns the inventory.
+            credential: token credential for the credential key.
+            cloud: Azure cloud instance of the credential.
+            build_query: returns the inventory query with an additional filter on the
+                resources (e.g. "| where id in~ (...)"), or the full query for "".
+            count_query: query returning a single 'count_' column with the number of
+                resources that the full inventory query would return.
+            resource_type: resource type tracked in resourcechanges.
+            name_filter: substring of the resource IDs tracked in resourcechanges.
+        Returns:
+            list with the inventory rows, in the shape of the Resource Graph query.
+        """
+        store = InventoryService._store()
+        try:
+            meta = await store.get("meta", credential_key)
+            rows = await store.get_all(credential_key) if meta is not None else {}
+        except Exception as ex:
+            logging.warning(f"Could not read the stored inventory of '{credential_key}', running a full sync: {ex}")
+            meta, rows = None, {}
+        now = datetime.now(timezone.utc)
+        ttl = float(os.getenv("InventoryTtlSeconds", "3600"))
+        full_sync_age = float(os.getenv("InventoryFullSyncSeconds", "86400"))
+        delta_mode = os.getenv("InventoryDeltaMode", "true").strip().lower() == "true"
+
+        sub_ids = None
+        if meta is not None:
+            last_sync = datetime.fromisoformat(meta["last_sync"])
+            last_full_sync = datetime.fromisoformat(meta["last_full_sync"])
+            if (now - last_sync).total_seconds() < ttl:
+                logging.info(f"Serving {len(rows)} inventory rows for '{credential_key}' from the store")
+                return list(rows.values())
+
+            if (
+                delta_mode
+                and now - last_sync < MAX_DELTA_AGE
+                and (now - last_full_sync).total_seconds() < full_sync_age
+            ):
+                try:
+                    # a newly granted subscription has no changes in the subscriptions queried so far
+                    sub_ids = await InventoryService._sub_ids(credential, cloud, credential_key)
+                    if sorted(sub_ids) != sorted(meta["sub_ids"]):
+                        logging.info(f"The subscriptions of '{credential_key}' changed, running a full sync")
+                    else:
+                        delta = await InventoryService._delta_sync(
+                            store, credential_key, credential, cloud, meta, sub_ids, rows,
+                            build_query, count_query, resource_type, name_filter, now
+                        )
+                        if delta is not None:
+                            return delta
+                except Exception as ex:
+                    logging.warning(f"Delta inventory sync failed for '{credential_key}', running a full sync: {ex}")
+
+        try:
+            return await InventoryService._full_sync(store, credential_key, credential, cloud, build_query, now, sub_ids)
+        except Exception as ex:
+            if meta is None:
+                raise
+            logging.warning(f"Full inventory sync failed for '{credential_key}', serving the {len(rows)} stored rows: {ex}")
+            return list(rows.values())
+
+    @staticmethod
+    async def _full_sync(
+        store: StateStore,
+        credential_key: str,
+        credential: AsyncTokenCredential,
+        cloud: Cloud,
+        build_query: Callable[[str], str],
+        now: datetime,
+        sub_ids: Optional[list[str]] = None
+    ) -> list[dict]:
+        t0 = time()
+        if sub_ids is None:
+            sub_ids = await InventoryService._sub_ids(credential, cloud, credential_key)
+        data = await GraphService.run_query(
+            query_str=build_query(""),
+            credential=credential,
+            sub_ids=sub_ids,
+            cloud=cloud,
+            credential_key=credential_key
+        )
+        try:
+            await store.replace(credential_key, {resource_key(row["id"]): row for row in data})
+            await store.put("meta", credential_key, {
+                "last_sync": now.isoformat(),
+                "last_full_sync": now.isoformat(),
+                "sub_ids": sub_ids,
+                "count": len(data)
+            })
+        except Exception as ex:
+            # the next scrape runs a full query again
+            logging.warning(f"Could not store the inventory of '{credential_key}': {ex}")
+        logging.info("Full inventory sync for '{}' took {:.3f}s".format(credential_key, time()-t0))
+        return data
+
+    @staticmethod
+    async def _delta_sync(
+        store: StateStore,
+        credential_key: str,
+        credential: AsyncTokenCredential,
+        cloud: Cloud,
+        meta: dict,
+        sub_ids: list[str],
+        rows: dict,
+        build_query: Callable[[str], str],
+        count_query: str,
+        resource_type: str,
+        name_filter: Optional[str],
+        now: datetime
+    ) -> Optional[list[dict]]:
+        """Applies the resource changes since the last sync, returns None if a full sync is needed"""
+        t0 = time()
+        changes = await GraphService.run_query(
+            query_str=InventoryService._changes_query(meta["last_sync"], resource_type, name_filter),
+            credential=credential,
+            sub_ids=sub_ids,
+            cloud=cloud,
+            credential_key=credential_key
+        )
+        changed = {resource_key(change["targetResourceId"]) for change in changes if change["changeType"] != "Delete"}
+        deleted = {resource_key(change["targetResourceId"]) for change in changes if change["changeType"] == "Delete"}
+        deleted -= changed
+
+        refreshed = {}
+        for chunk in list_to_chunks(sorted(changed), DELTA_ID_CHUNK):
+            ids = ",".join(f"'{resource_id}'" for resource_id in chunk)
+            data = await GraphService.run_query(
+                query_str=build_query(f"| where id in~ ({ids})"),
+                credential=credential,
+                sub_ids=sub_ids,
+                cloud=cloud,
+                credential_key=credential_key
+            )
+            refreshed.update({resource_key(row["id"]): row for row in data})
+
+        # changed resources that no longer match the inventory query are dropped
+        removed = [key for key in rows if key in deleted or (key in changed and key not in refreshed)]
+        for key in removed:
+            rows.pop(key)
+        rows.update(refreshed)
+
+        count = await GraphService.run_query(
+            query_str=count_query,
+            credential=credential,
+            sub_ids=sub_ids,
+            cloud=cloud,
+            credential_key=credential_key
+        )
+        expected = count[0]["count_"] if count else 0
+        if expected != len(rows):
+            logging.warning(
+                f"Inventory for '{credential_key}' has {len(rows)} rows after the delta "
+                f"but the fleet has {expected}, a full sync is needed"
+            )
+            return None
+
+        if removed:
+            await store.delete_many(credential_key, removed)
+        if refreshed:
+            await store.put_many(credential_key, refreshed)
+        await store.put("meta", credential_key, {**meta, "last_sync": now.isoformat(), "count": len(rows)})
+        logging.info("Delta inventory sync for '{}' applied {} changes in {:.3f}s".format(
+            credential_key, len(changed) + len(deleted), time()-t0
+        ))
+        return list(rows.values())
+
+    @staticmethod
+    async def _sub_ids(credential: AsyncTokenCredential, cloud: Cloud, credential_key: str) -> list[str]:
+        subscriptions = await SubscriptionService.subscription_list(credential, cloud, credential_key)
+        return SubscriptionService.filter_ids(subscriptions)
+
+    @staticmethod
+    def _changes_query(since: str, resource_type: str, name_filter: Optional[str]) -> str:
+        since = datetime.fromisoformat(since).astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        query = f"""resourcechanges
+                | extend changeTime = todatetime(properties.changeAttributes.timestamp),
+                    targetResourceId = tostring(properties.targetResourceId),
+                    targetResourceType = tostring(properties.targetResourceType),
+                    changeType = tostring(properties.changeType)
+                | where changeTime > datetime({since})
+                | where targetResourceType =~ '{resource_type}'"""
+        if name_filter:
+            query += f"""
+                | where targetResourceId contains '{name_filter}'"""
+        query += """
+                | project targetResourceId, changeType, changeTime"""
+        return query
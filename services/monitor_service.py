@@ -1,36 +1,58 @@
 
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from time import time
 import logging
 import asyncio
 from statistics import mean
 import json
+import os
+import aiohttp
 from azure.mgmt.monitor.aio import MonitorManagementClient
 from azure.mgmt.monitor.models import Metric, MetricValue, MetricCollection, TimeSeriesElement, MetadataValue
 from azure.core.credentials_async import AsyncTokenCredential
+from azure.core.exceptions import HttpResponseError
 from msrestazure.azure_cloud import Cloud, AZURE_PUBLIC_CLOUD
 
-from shared_code.utilities import get_resource_value, gather_with_concurrency
+from shared_code.utilities import get_resource_value, gather_with_concurrency, list_to_chunks
+from shared_code.cloud_provider import get_metrics_batch_endpoint, get_metrics_batch_scope
+from shared_code.client_pool import ClientPool
+from shared_code.scheduler import RequestScheduler
+from shared_code.latency import hedged_call
+from shared_code.circuit_breaker import CircuitBreaker, CircuitOpenError
+from shared_code.state_store import get_state_store
+from shared_code.records import AccountTable, resource_key
+from shared_code.history import MetricHistory
+from services.analytics_service import AnalyticsService
 
-from typing import Optional, Any
+from typing import Optional, Any, Callable, Union
+
+
+# maximum number of resource IDs accepted by a single metrics:getBatch call
+BATCH_MAX_RESOURCES = 50
+# metrics measured against the account capacity, the only ones with a days_to_full statistic
+CAPACITY_METRICS = ("UsedCapacity",)
+BATCH_API_VERSION = "2024-02-01"
+METRICS_API_VERSION = "2018-01-01"
+STORAGE_METRIC_NAMESPACE = "Microsoft.Storage/storageAccounts"
+# metrics of STORAGE_METRIC_NAMESPACE, those of the blob, file, queue and table services
+# (e.g. BlobCapacity) are only defined on the service resources and fail the whole request
+ACCOUNT_METRICS = ("UsedCapacity", "Transactions", "Ingress", "Egress", "SuccessServerLatency", "SuccessE2ELatency", "Availability")
 
 
 class MonitorService(object):
     """Class that handles the interaction with the Azure Monitor API to obtain resources' metrics"""
 
     @staticmethod
-    async def _get_metrics(
+    def _create_client(
         credential: AsyncTokenCredential,
-        resource_id: str, 
-        metricnames: str, 
-        range: Optional[dict] = None,
-        interval: Optional[dict] = None, 
-        timestamp: Optional[str] = None,
-        filter: Optional[str] = None,
-        timeout: float = 3600.0,
-        aggregation: str = "average",
+        subscription_id: str,
         cloud: Cloud = AZURE_PUBLIC_CLOUD
-    ):
+    ) -> MonitorManagementClient:
+        return ClientPool.create_client(MonitorManagementClient, credential, cloud, subscription_id)
+
+    @staticmethod
+    def _time_window(range: Optional[dict] = None, timestamp: Optional[str] = None):
+        """Returns the (start, end) datetimes of the requested metric window"""
         if timestamp is not None:
             timestamp = datetime.fromisoformat(timestamp)
         else:
@@ -41,46 +63,14 @@ class MonitorService(object):
 
         now = timestamp
         past = now - timedelta(**range)
-        timespan = f"{past}/{now}"
-            
-        if interval is not None:
-            interval = timedelta(**interval)
-        
-        t0 = time()
-        data = None
-        subscription_id = get_resource_value(resource_id, "/subscriptions")
-        client = MonitorManagementClient(
-            credential=credential,
-            subscription_id=subscription_id,
-            base_url=cloud.endpoints.resource_manager,
-            credential_scopes=[cloud.endpoints.resource_manager + '/.default']
-        )
-        async with client:
-            try:
-                task = asyncio.create_task(
-                    client.metrics.list(
-                        resource_id,
-                        metricnames=metricnames,
-                        timespan=timespan,
-                        interval=interval,
-                        aggregation=aggregation,
-                        filter=filter
-                    )
-                )
-                data: MetricCollection = await asyncio.wait_for(task, timeout=timeout)
-            except asyncio.TimeoutError:
-                logging.warning(f"The metric fetching for '{resource_id}' has timed out.")
-            except Exception as ex:
-                logging.error(f"Error getting metrics: {ex}")
-
-        logging.info("The metric fetching for '{}' took {:.3f}s".format(resource_id, time()-t0))
-
-        if data is None or not hasattr(data, "value"):
-            return None
+        return past, now
 
+    @staticmethod
+    def _parse_metrics(values: list[Metric], aggregation: str = "average") -> dict:
+        """Builds the per-resource result dictionary out of the metric models"""
         result = {}
         value: Metric
-        for value in data.value:
+        for value in values:
             try:
                 timeseries: list[TimeSeriesElement] = value.timeseries
                 result[value.name.value] = {
@@ -106,6 +96,386 @@ class MonitorService(object):
 
         return result
 
+    @staticmethod
+    def _parse_metrics_raw(values: list[dict], aggregation: str = "average", keep_series: bool = False) -> dict:
+        """Latest-only counterpart of _parse_metrics working on the raw JSON response
+
+        Only the newest non-null point of each aggregation is kept, no SDK models or
+        timeseries copies are built. With keep_series, the points are also kept as
+        plain lists under "series", for the analytics.
+        """
+        aggregation_list = (aggregation or "average,maximum,minimum,total").split(",")
+        result = {}
+        for value in values:
+            try:
+                name = value["name"]["value"]
+                result[name] = {
+                    "unit": value.get("unit"),
+                    "description": value.get("displayDescription"),
+                    "resource": [
+                        {
+                            "latest": MonitorService._latest_value_raw(element.get("data") or [], aggregation_list),
+                            "metadata": element.get("metadatavalues"),
+                            **({"series": MonitorService._series_raw(element.get("data") or [], aggregation_list)} if keep_series else {})
+                        } for element in value.get("timeseries") or []
+                    ]
+                }
+            except Exception as ex:
+                logging.error(f"{ex}")
+
+        return result
+
+    @staticmethod
+    def _series_raw(timeseries: list[dict], aggregation_list: list[str]) -> dict:
+        """Columns of the raw metric values: time stamps and one list per aggregation"""
+        series = {"time_stamp": [point.get("timeStamp") for point in timeseries]}
+        for aggregation in aggregation_list:
+            series[aggregation] = [point.get(aggregation) for point in timeseries]
+        return series
+
+    @staticmethod
+    def _latest_value_raw(timeseries: list[dict], aggregation_list: list[str]) -> dict:
+        """Reads the newest non-null point of each aggregation from raw metric values"""
+        output = dict.fromkeys(aggregation_list)
+        output["time_stamp"] = None
+        for aggregation in aggregation_list:
+            for i in range(len(timeseries) - 1, -1, -1):
+                point = timeseries[i]
+                value = point.get(aggregation)
+                if value is not None:
+                    output[aggregation] = value
+                    output["time_stamp"] = point.get("timeStamp")
+                    break
+
+        return output
+
+    @staticmethod
+    async def _get_metrics_latest(
+        credential: AsyncTokenCredential,
+        session: aiohttp.ClientSession,
+        resource_id: str,
+        metricnames: str,
+        range: Optional[dict] = None,
+        interval: Optional[dict] = None,
+        timestamp: Optional[str] = None,
+        filter: Optional[str] = None,
+        timeout: float = 3600.0,
+        aggregation: str = "average",
+        cloud: Cloud = AZURE_PUBLIC_CLOUD,
+        keep_series: bool = False,
+        breaker_scope: Optional[str] = None
+    ):
+        """Latest-only counterpart of _get_metrics that calls the ARM metrics API directly
+
+        The response is parsed as plain JSON with _parse_metrics_raw.
+        """
+        past, now = MonitorService._time_window(range, timestamp)
+        params = {
+            "api-version": METRICS_API_VERSION,
+            "metricnames": metricnames,
+            "timespan": f"{MonitorService._to_iso_utc(past)}/{MonitorService._to_iso_utc(now)}",
+            "aggregation": aggregation
+        }
+        if interval is not None:
+            params["interval"] = MonitorService._to_iso_duration(timedelta(**interval))
+        if filter is not None:
+            params["$filter"] = filter
+
+        resource_manager = cloud.endpoints.resource_manager.rstrip("/")
+        url = f"{resource_manager}{resource_id}/providers/Microsoft.Insights/metrics"
+        t0 = time()
+        data = None
+        try:
+            token = await credential.get_token(resource_manager + "/.default")
+
+            async def get(slot):
+                async with session.get(
+                    url,
+                    params=params,
+                    headers={"Authorization": f"Bearer {token.token}"},
+                    timeout=aiohttp.ClientTimeout(total=timeout)
+                ) as response:
+                    slot.observe(response.status, response.headers)
+                    response.raise_for_status()
+                    body = await response.read()
+                    slot.size = len(body)
+                    return json.loads(body)
+
+            data = await MonitorService._guarded(breaker_scope, lambda: hedged_call(
+                "metrics",
+                get,
+                timeout=timeout,
+                scheduler=RequestScheduler.default(),
+                scope=get_resource_value(resource_id, "/subscriptions")
+            ))
+        except CircuitOpenError:
+            # the scope is known to fail, the breaker already counted the skipped call
+            pass
+        except asyncio.TimeoutError:
+            logging.warning(f"The metric fetching for '{resource_id}' has timed out.")
+        except Exception as ex:
+            logging.error(f"Error getting metrics: {ex}")
+
+        logging.info("The metric fetching for '{}' took {:.3f}s".format(resource_id, time()-t0))
+
+        if data is None or "value" not in data:
+            return None
+
+        return MonitorService._parse_metrics_raw(data["value"], aggregation=aggregation, keep_series=keep_series)
+
+    @staticmethod
+    async def _get_metrics_batch(
+        credential: AsyncTokenCredential,
+        session: aiohttp.ClientSession,
+        subscription_id: str,
+        region: str,
+        resource_ids: list[str],
+        metricnames: str,
+        range: Optional[dict] = None,
+        interval: Optional[dict] = None,
+        timestamp: Optional[str] = None,
+        filter: Optional[str] = None,
+        timeout: float = 3600.0,
+        aggregation: str = "average",
+        cloud: Cloud = AZURE_PUBLIC_CLOUD,
+        latest_only: bool = False,
+        keep_series: bool = False,
+        breaker_scope: Optional[str] = None
+    ) -> dict:
+        """Fetches metrics for up to BATCH_MAX_RESOURCES resources with a single metrics:getBatch call
+
+        All the resources must belong to the same subscription and region.
+        Returns a dictionary keyed by the lower-cased resource ID, where each value has the same
+        shape as the output of _get_metrics (or _get_metrics_latest if latest_only is set).
+        Raises on any HTTP or transport error, or CircuitOpenError while the breaker of
+        breaker_scope is open.
+        """
+        if len(resource_ids) > BATCH_MAX_RESOURCES:
+            raise ValueError(f"metrics:getBatch accepts at most {BATCH_MAX_RESOURCES} resources")
+
+        past, now = MonitorService._time_window(range, timestamp)
+        params = {
+            "api-version": BATCH_API_VERSION,
+            "metricnamespace": STORAGE_METRIC_NAMESPACE,
+            "metricnames": metricnames,
+            "starttime": MonitorService._to_iso_utc(past),
+            "endtime": MonitorService._to_iso_utc(now),
+            "aggregation": aggregation
+        }
+        if interval is not None:
+            params["interval"] = MonitorService._to_iso_duration(timedelta(**interval))
+        if filter is not None:
+            params["filter"] = filter
+
+        token = await credential.get_token(get_metrics_batch_scope(cloud))
+        url = "{}/subscriptions/{}/metrics:getBatch".format(
+            get_metrics_batch_endpoint(cloud, region),
+            subscription_id
+        )
+        t0 = time()
+
+        async def post(slot):
+            async with session.post(
+                url,
+                params=params,
+                json={"resourceids": resource_ids},
+                headers={"Authorization": f"Bearer {token.token}"},
+                timeout=aiohttp.ClientTimeout(total=timeout)
+            ) as response:
+                slot.observe(response.status, response.headers)
+                response.raise_for_status()
+                body = await response.read()
+                slot.size = len(body)
+                return json.loads(body)
+
+        payload = await MonitorService._guarded(breaker_scope, lambda: hedged_call(
+            f"metrics:getBatch/{region}",
+            post,
+            timeout=timeout,
+            scheduler=RequestScheduler.default(),
+            scope=subscription_id
+        ))
+
+        logging.info("The batch metric fetching for {} resources in '{}/{}' took {:.3f}s".format(
+            len(resource_ids), subscription_id, region, time()-t0
+        ))
+
+        result = {}
+        for resource in payload.get("values", []):
+            if latest_only:
+                metrics = MonitorService._parse_metrics_raw(
+                    resource.get("value", []),
+                    aggregation=aggregation,
+                    keep_series=keep_series
+                )
+            else:
+                values = [Metric.deserialize(metric) for metric in resource.get("value", [])]
+                metrics = MonitorService._parse_metrics(values, aggregation=aggregation)
+            result[resource["resourceid"].lower()] = metrics
+        return result
+
+    @staticmethod
+    def _batch_unsupported(ex: Exception) -> bool:
+        """Whether the batch API rejected the request itself (400, 404), so single requests may still work"""
+        if isinstance(ex, aiohttp.ClientResponseError):
+            return ex.status in (400, 404)
+        if isinstance(ex, HttpResponseError):
+            return ex.status_code in (400, 404)
+        return False
+
+    @staticmethod
+    async def _get_metrics_group(
+        credential: AsyncTokenCredential,
+        session: aiohttp.ClientSession,
+        client: MonitorManagementClient,
+        subscription_id: str,
+        region: str,
+        resource_ids: list[str],
+        latest_only: bool = False,
+        keep_series: bool = False,
+        **kwargs
+    ) -> list:
+        """Fetches a chunk of resources through the batch API
+
+        Resources the batch did not return, or all of them when the batch API rejected the
+        request (400, 404), fall back to single requests. Throttled, unauthorized and failed
+        batches do not, their resources are reported without values.
+        """
+        batch = {}
+        try:
+            batch = await MonitorService._get_metrics_batch(
+                credential,
+                session,
+                subscription_id,
+                region,
+                resource_ids,
+                latest_only=latest_only,
+                keep_series=keep_series,
+                **kwargs
+            )
+        except CircuitOpenError:
+            # single requests would be rejected too
+            return [None] * len(resource_ids)
+        except Exception as ex:
+            if not MonitorService._batch_unsupported(ex):
+                # throttling, auth and transient errors would hit every single request as well
+                logging.warning(
+                    f"Batch metric fetching failed for {len(resource_ids)} resources in "
+                    f"'{subscription_id}/{region}': {ex}"
+                )
+                return [None] * len(resource_ids)
+            logging.warning(
+                f"Batch metric fetching failed for {len(resource_ids)} resources in "
+                f"'{subscription_id}/{region}', falling back to single requests: {ex}"
+            )
+
+        async def fetch(resource_id: str):
+            metric = batch.get(resource_id.lower())
+            if metric is None and latest_only:
+                metric = await MonitorService._get_metrics_latest(
+                    credential,
+                    session,
+                    resource_id,
+                    keep_series=keep_series,
+                    **kwargs
+                )
+            elif metric is None:
+                metric = await MonitorService._get_metrics(
+                    credential,
+                    resource_id,
+                    client=client,
+                    **kwargs
+                )
+            return metric
+
+        return await asyncio.gather(*(fetch(resource_id) for resource_id in resource_ids))
+
+    @staticmethod
+    def _to_iso_utc(value: datetime) -> str:
+        if value.tzinfo is None:
+            return value.isoformat() + "Z"
+        return value.isoformat()
+
+    @staticmethod
+    def _to_iso_duration(value: timedelta) -> str:
+        seconds = int(value.total_seconds())
+        if seconds % 86400 == 0:
+            return f"P{seconds // 86400}D"
+        if seconds % 3600 == 0:
+            return f"PT{seconds // 3600}H"
+        return f"PT{seconds // 60}M"
+
+    @staticmethod
+    async def _get_metrics(
+        credential: AsyncTokenCredential,
+        resource_id: str, 
+        metricnames: str, 
+        range: Optional[dict] = None,
+        interval: Optional[dict] = None, 
+        timestamp: Optional[str] = None,
+        filter: Optional[str] = None,
+        timeout: float = 3600.0,
+        aggregation: str = "average",
+        cloud: Cloud = AZURE_PUBLIC_CLOUD,
+        client: Optional[MonitorManagementClient] = None,
+        breaker_scope: Optional[str] = None
+    ):
+        if client is None:
+            subscription_id = get_resource_value(resource_id, "/subscriptions")
+            async with MonitorService._create_client(credential, subscription_id, cloud) as client:
+                return await MonitorService._get_metrics(
+                    credential,
+                    resource_id,
+                    metricnames=metricnames,
+                    range=range,
+                    interval=interval,
+                    timestamp=timestamp,
+                    filter=filter,
+                    timeout=timeout,
+                    aggregation=aggregation,
+                    cloud=cloud,
+                    client=client,
+                    breaker_scope=breaker_scope
+                )
+
+        past, now = MonitorService._time_window(range, timestamp)
+        timespan = f"{past}/{now}"
+            
+        if interval is not None:
+            interval = timedelta(**interval)
+        
+        t0 = time()
+        data = None
+        try:
+            data: MetricCollection = await MonitorService._guarded(breaker_scope, lambda: hedged_call(
+                "metrics",
+                lambda slot: client.metrics.list(
+                    resource_id,
+                    metricnames=metricnames,
+                    timespan=timespan,
+                    interval=interval,
+                    aggregation=aggregation,
+                    filter=filter,
+                    raw_response_hook=slot.response_hook
+                ),
+                timeout=timeout,
+                scheduler=RequestScheduler.default(),
+                scope=get_resource_value(resource_id, "/subscriptions")
+            ))
+        except CircuitOpenError:
+            pass
+        except asyncio.TimeoutError:
+            logging.warning(f"The metric fetching for '{resource_id}' has timed out.")
+        except Exception as ex:
+            logging.error(f"Error getting metrics: {ex}")
+
+        logging.info("The metric fetching for '{}' took {:.3f}s".format(resource_id, time()-t0))
+
+        if data is None or not hasattr(data, "value"):
+            return None
+
+        return MonitorService._parse_metrics(data.value, aggregation=aggregation)
+
 
     @staticmethod
     async def get_metrics_single_resource(
@@ -159,7 +529,7 @@ class MonitorService(object):
     @staticmethod
     async def get_metrics_for_data( 
         credential: AsyncTokenCredential,
-        data: list[dict],
+        data: Union[list[dict], AccountTable],
         metricnames: str,
         range: Optional[dict] = None, 
         interval: Optional[dict] = None, 
@@ -168,7 +538,15 @@ class MonitorService(object):
         filter: Optional[str] = None,
         num_threads: Optional[int] = None,
         timeout: float = 3600.0,
-        cloud: Cloud = AZURE_PUBLIC_CLOUD
+        cloud: Cloud = AZURE_PUBLIC_CLOUD,
+        use_batch: Optional[bool] = None,
+        credential_key: Optional[str] = None,
+        latest_only: Optional[bool] = None,
+        metric_set: Optional[dict[str, list[str]]] = None,
+        incremental: Optional[bool] = None,
+        analytics: Optional[bool] = None,
+        breaker: Optional[bool] = None,
+        history: Optional[bool] = None
     ):
         """Method that fetches metrics for a list of Azure resources
 
@@ -176,6 +554,7 @@ class MonitorService(object):
             credential: token credential that has access to all resources in the list.
             data: list with the resource information. 
                 For each element it is required its Resource ID with key "id".
+                An AccountTable is filled in place instead, and returned.
             metricnames: single string with the desired metric names, separated by commas.
             range: total time range of the fetched metrics in dictionary format.
                 Default is {"hours": 1}.
@@ -185,49 +564,472 @@ class MonitorService(object):
                 Default is current timestamp (now).
             aggregation: The list of aggregation types (comma separated) to retrieve.
             filter: Addional filter for resources or metrics (can allow splitting)
-            num_threads: if given, maximum number of resources that will be simultaneously processed.
+            num_threads: if given, maximum number of requests (single or batch) that will be
+                simultaneously processed.
             timeout: number of seconds allowed to wait for the API response.
             cloud: Azure cloud instance to indicate where are the resources.
+            use_batch: whether resources with a "location" are fetched through the regional
+                metrics:getBatch API, grouped by subscription and region. Resources missing from
+                a batch response, or from a batch the API rejected (400, 404), fall back to single
+                requests. Default is the 'MetricsBatchApi' setting.
+            credential_key: if given, the Monitor clients are taken from the process-wide pool
+                for this key instead of being created and closed for the call.
+            latest_only: whether responses are parsed from the raw JSON keeping only the newest
+                point of each aggregation, without SDK models or timeseries.
+                Default is the 'MetricsLatestOnly' setting.
+            metric_set: if given, the aggregations to report for each metric name, as returned by
+                parse_metric_set. All of them are fetched in the same request per resource (or
+                batch), and it takes precedence over metricnames and aggregation.
+            incremental: whether the time stamp of the newest point of each resource and metric is
+                kept in the 'watermarks' state store, so that later calls only request the window
+                since then (with an overlap of 'MetricsWatermarkOverlapMinutes'). Resources without
+                a new point keep their stored value while it is still inside range. There is one
+                partition per credential key and subscription, and a call only reads and writes
+                the entries of its own resources.
+                Default is the 'MetricsIncremental' setting.
+            analytics: whether the whole range is fetched and summarized per metric and
+                aggregation with AnalyticsService.fleet_stats (percentiles, growth per day,
+                and days to full for UsedCapacity) under an additional "analytics" key. Unless the
+                statistics come from the metric history, it turns the incremental windows off, the
+                last values are still kept for the breaker.
+                Default is the 'MetricsAnalytics' setting.
+            breaker: whether the requests of each credential key and subscription go through
+                a CircuitBreaker, so a failing subscription is skipped for a while instead of
+                holding concurrency. The last values of every resource are then kept in the
+                'watermarks' state store, even without incremental, and served as stale while
+                the breaker of its subscription is open. Default is the 'CircuitBreaker' setting.
+            history: whether every point downloaded is appended to the local MetricHistory,
+                and the analytics are computed from the points stored over range instead
+                of fetching the whole range each time. Default is the 'MetricHistory' setting.
         Returns:
             data_with_metrics: similar list as the input data, but now each element has an additional
-                "metrics" dictionary with the full timeseries and latest value.
+                "metrics" dictionary with the latest value of each metric and aggregation,
+                e.g. {"UsedCapacity": {"average": 1024.0}}, or None if nothing was fetched.
+                In incremental mode or with the breaker, a resource whose fetch failed keeps its last stored values
+                for up to 'StaleValueMaxSeconds' (default 1 day) and has "stale" set to True.
         """
         n = len(data)
+        table = data if isinstance(data, AccountTable) else None
+        if table is not None:
+            ids = table.columns["id"]
+            locations = table.columns["location"]
+        else:
+            ids = [elem["id"] for elem in data]
+            locations = [elem.get("location") for elem in data]
         logging.info(f"Fetching metrics for {n} resources...")
 
         t0 = time()
-        data_with_metrics = []
+        if use_batch is None:
+            use_batch = os.getenv("MetricsBatchApi", "true").strip().lower() == "true"
+        if latest_only is None:
+            latest_only = os.getenv("MetricsLatestOnly", "true").strip().lower() == "true"
+        if metric_set is None:
+            metric_set = {name: aggregation.split(",") for name in metricnames.split(",")}
+        else:
+            metricnames = ",".join(metric_set)
+            aggregation = ",".join(dict.fromkeys(key for keys in metric_set.values() for key in keys))
+        if incremental is None:
+            incremental = os.getenv("MetricsIncremental", "true").strip().lower() == "true"
+        if analytics is None:
+            analytics = os.getenv("MetricsAnalytics", "false").strip().lower() == "true"
+        if history is None:
+            history = os.getenv("MetricHistory", "false").strip().lower() == "true"
+        if breaker is None:
+            breaker = os.getenv("CircuitBreaker", "true").strip().lower() == "true"
+        # the last values feed both the incremental windows and what is served while a breaker is open
+        keep_last = incremental or breaker
+        if analytics and not history:
+            # the statistics need the whole range, not only the points since the watermark
+            incremental = False
+        if timestamp is None:
+            # the same window end for every request, the incremental windows are relative to it
+            timestamp = datetime.utcnow().isoformat()
+
+        watermarks = {}
+        if keep_last:
+            store = get_state_store("watermarks")
+            # only the watermarks of this batch, from the partitions of its subscriptions
+            wanted = {}
+            for resource_id in ids:
+                wanted.setdefault(MonitorService._watermark_partition(credential_key, resource_id), []).append(resource_key(resource_id))
+            try:
+                for found in await asyncio.gather(*(store.get_many(partition, keys) for partition, keys in wanted.items())):
+                    watermarks.update(found)
+            except Exception as ex:
+                logging.warning(f"Could not read the metric watermarks, fetching the full range: {ex}")
+        windows = [
+            MonitorService._watermark_range(
+                watermarks.get(resource_key(resource_id)) if incremental else None, metric_set, range, timestamp
+            )
+            for resource_id in ids
+        ]
+
+        options = dict(
+            metricnames=metricnames,
+            range=range,
+            interval=interval,
+            timestamp=timestamp,
+            timeout=timeout,
+            aggregation=aggregation,
+            filter=filter,
+            cloud=cloud
+        )
+        metrics = [None] * n
         async with credential:
-            tasks = [
-                asyncio.create_task(
-                    MonitorService._get_metrics(
+            # one client per subscription, shared by every resource of the batch
+            clients = {}
+            pooled = credential_key is not None
+            # resources are grouped by subscription and region for the batch API
+            groups = {}
+            singles = []
+            for index, resource_id in enumerate(ids):
+                subscription_id = get_resource_value(resource_id, "/subscriptions")
+                if subscription_id not in clients:
+                    if pooled:
+                        clients[subscription_id] = ClientPool.get_client(
+                            MonitorManagementClient, credential, cloud, credential_key, subscription_id
+                        )
+                    else:
+                        clients[subscription_id] = MonitorService._create_client(
+                            credential, subscription_id, cloud
+                        )
+                region = locations[index]
+                if use_batch and region:
+                    groups.setdefault((subscription_id, region.lower()), []).append(index)
+                else:
+                    singles.append(index)
+
+            session = ClientPool.get_session()
+
+            def breaker_scope(subscription_id: str) -> Optional[str]:
+                return f"metrics/{credential_key or 'default'}/{subscription_id}" if breaker else None
+
+            async def fetch_single(index: int):
+                subscription_id = get_resource_value(ids[index], "/subscriptions")
+                if latest_only:
+                    return [await MonitorService._get_metrics_latest(
                         credential,
-                        elem["id"],
-                        metricnames=metricnames,
-                        range=range,
-                        interval=interval,
-                        timestamp=timestamp,
-                        timeout=timeout,
-                        aggregation=aggregation,
-                        filter=filter,
-                        cloud=cloud
-                    )
-                ) for elem in data
-            ]
-            if num_threads is not None:
-                metrics = await gather_with_concurrency(num_threads,*tasks)
-            else:
-                metrics = await asyncio.gather(*tasks)
+                        session,
+                        ids[index],
+                        keep_series=analytics or history,
+                        **{**options, "range": windows[index], "breaker_scope": breaker_scope(subscription_id)}
+                    )]
+                return [await MonitorService._get_metrics(
+                    credential,
+                    ids[index],
+                    client=clients[subscription_id],
+                    **{**options, "range": windows[index], "breaker_scope": breaker_scope(subscription_id)}
+                )]
+
+            try:
+                jobs = []
+                for (subscription_id, region), indices in groups.items():
+                    for chunk in list_to_chunks(indices, BATCH_MAX_RESOURCES):
+                        jobs.append((chunk, MonitorService._get_metrics_group(
+                            credential,
+                            session,
+                            clients[subscription_id],
+                            subscription_id,
+                            region,
+                            [ids[i] for i in chunk],
+                            latest_only=latest_only,
+                            keep_series=analytics or history,
+                            breaker_scope=breaker_scope(subscription_id),
+                            # one window for the chunk, wide enough for its oldest watermark
+                            **{**options, "range": max((windows[i] for i in chunk), key=lambda w: timedelta(**w))}
+                        )))
+                jobs.extend(([index], fetch_single(index)) for index in singles)
+
+                if num_threads is not None:
+                    results = await gather_with_concurrency(num_threads, *(job for _, job in jobs))
+                else:
+                    results = await asyncio.gather(*(job for _, job in jobs))
+                for (indices, _), result in zip(jobs, results):
+                    for index, metric in zip(indices, result):
+                        metrics[index] = metric
+            finally:
+                if not pooled:
+                    await asyncio.gather(*(client.close() for client in clients.values()))
         
-        data_with_metrics = [
-            {
-                **elem, 
-                "metrics": metric['UsedCapacity']['resource'][0]['latest']['average']
-            } for elem, metric in zip(data, metrics)
-        ]
+        if history:
+            try:
+                stored = await asyncio.to_thread(MonitorService._record_history, ids, metrics, metric_set)
+                logging.info(f"Stored {stored} new points in the metric history")
+            except Exception as ex:
+                logging.warning(f"Could not store the metric history: {ex}")
+
+        if keep_last:
+            latest, stale, times = await MonitorService._apply_watermarks(
+                store, credential_key, ids, metrics, watermarks, metric_set, range, timestamp
+            )
+        else:
+            latest = [MonitorService._latest_metrics(metric, metric_set) for metric in metrics]
+            stale = [False] * n
+            times = [
+                MonitorService._newest_time(MonitorService._latest_time_stamp(metric, name) for name in metric_set)
+                for metric in metrics
+            ]
+
+        # the values go to a table either way, the legacy rows are rebuilt from it
+        output = table if table is not None else AccountTable({"id": ids})
+        for index, values in enumerate(latest):
+            output.set_metrics(index, values)
+            if stale[index]:
+                output.stale[index] = 1
+            output.times[index] = times[index]
+        if analytics:
+            output.with_analytics = True
+            matrix = None
+            if history:
+                matrix = MonitorService._history_matrix(ids, range, timestamp)
+            for index, stats in enumerate(MonitorService._analytics(metrics, metric_set, matrix)):
+                output.set_analytics(index, stats)
+        missing = output.missing()
+        if missing:
+            logging.warning(f"No metric value for {missing} of {n} resources, they are reported without it")
+        if any(stale):
+            logging.warning(f"Serving the last known values of {sum(stale)} of {n} resources whose fetch failed")
         logging.info("Total metric fetching for took {:.3f}s".format(time()-t0))
         
-        return data_with_metrics
+        if table is not None:
+            return table
+        return [{**elem, **output.extras(index)} for index, elem in enumerate(data)]
+
+    @staticmethod
+    def _latest_metrics(metric: Optional[dict], metric_set: dict[str, list[str]]) -> Optional[dict]:
+        """Latest value of each metric and aggregation of the set, None if the fetch failed or had no data"""
+        output = {}
+        for name, aggregations in metric_set.items():
+            try:
+                latest = metric[name]["resource"][0]["latest"]
+            except (KeyError, IndexError, TypeError):
+                continue
+            values = {key: latest[key] for key in aggregations if latest.get(key) is not None}
+            if values:
+                output[name] = values
+        return output or None
+
+    @staticmethod
+    def _analytics(
+        metrics: list[Optional[dict]],
+        metric_set: dict[str, list[str]],
+        matrix: Optional[Callable[[str, str], tuple]] = None
+    ) -> list[Optional[dict]]:
+        """Statistics of every metric and aggregation of the set, one vectorized pass each
+
+        matrix(name, aggregation), if given, returns the (times, values) to summarize
+        instead of the series fetched, e.g. those of the metric history.
+        """
+        output = [{} for _ in metrics]
+        for name, aggregations in metric_set.items():
+            for aggregation in aggregations:
+                if matrix is not None:
+                    times, values = matrix(name, aggregation)
+                else:
+                    series = [MonitorService._series(metric, name, aggregation) for metric in metrics]
+                    times, values = AnalyticsService.to_matrix(series)
+                stats = AnalyticsService.fleet_stats(times, values)
+                # the latest value is already exposed as the metric itself
+                stats.pop("latest")
+                if name not in CAPACITY_METRICS:
+                    # a projection to the account capacity only means something for bytes stored
+                    stats.pop("days_to_full")
+                records = AnalyticsService.to_records(stats)
+                for account, record in zip(output, records):
+                    if record is not None:
+                        account.setdefault(name, {})[aggregation] = record
+        return [account or None for account in output]
+
+    @staticmethod
+    def _record_history(ids: list[str], metrics: list[Optional[dict]], metric_set: dict[str, list[str]]) -> int:
+        """Appends the points fetched for each resource to the MetricHistory, returns how many were new"""
+        history = MetricHistory.default()
+        keys = [resource_key(resource_id) for resource_id in ids]
+        stored = 0
+        for name, aggregations in metric_set.items():
+            for aggregation in aggregations:
+                accounts, times, values = [], [], []
+                for key, metric in zip(keys, metrics):
+                    series = MonitorService._series(metric, name, aggregation)
+                    if not series or not series[1]:
+                        continue
+                    accounts.extend([key] * len(series[1]))
+                    times.extend(AnalyticsService._epoch_seconds(series[0]))
+                    values.extend(series[1])
+                stored += history.append(name, aggregation, accounts, times, values)
+        return stored
+
+    @staticmethod
+    def _history_matrix(ids: list[str], range: Optional[dict], timestamp: str) -> Callable[[str, str], tuple]:
+        """matrix function of _analytics reading the points stored over range"""
+        past, now = MonitorService._time_window(range, timestamp)
+        start = past.replace(tzinfo=timezone.utc).timestamp()
+        end = now.replace(tzinfo=timezone.utc).timestamp()
+        keys = [resource_key(resource_id) for resource_id in ids]
+
+        def matrix(name: str, aggregation: str) -> tuple:
+            return MetricHistory.default().matrix(name, aggregation, keys, start, end)
+
+        return matrix
+
+    @staticmethod
+    def _series(metric: Optional[dict], name: str, aggregation: str) -> Optional[tuple[list, list]]:
+        """(time stamps, values) of one metric and aggregation, from either parse path"""
+        try:
+            resource = metric[name]["resource"][0]
+        except (KeyError, IndexError, TypeError):
+            return None
+        if "series" in resource:
+            series = resource["series"]
+            return series["time_stamp"], [value if value is not None else float("nan") for value in series[aggregation]]
+        timeseries = resource.get("timeseries") or []
+        values = []
+        for point in timeseries:
+            value = getattr(point, aggregation, None)
+            values.append(float("nan") if value is None else value)
+        return [point.time_stamp for point in timeseries], values
+
+    @staticmethod
+    def _parse_time_stamp(value: Optional[str]) -> Optional[datetime]:
+        """Parses an API time stamp into a naive UTC datetime, like the ones of _time_window"""
+        if not value:
+            return None
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    @staticmethod
+    def _watermark_range(
+        watermark: Optional[dict],
+        metric_set: dict[str, list[str]],
+        range: Optional[dict],
+        timestamp: str
+    ) -> dict:
+        """Range to request for a resource: since its oldest metric watermark, at most the full range"""
+        past, now = MonitorService._time_window(range, timestamp)
+        full = {"seconds": (now - past).total_seconds()}
+        if not watermark:
+            return full
+        marks = [MonitorService._parse_time_stamp(watermark.get(name, {}).get("time_stamp")) for name in metric_set]
+        if any(mark is None for mark in marks):
+            return full
+        overlap = timedelta(minutes=float(os.getenv("MetricsWatermarkOverlapMinutes", "5")))
+        start = max(min(marks) - overlap, past)
+        return {"seconds": max((now - start).total_seconds(), overlap.total_seconds())}
+
+    @staticmethod
+    def _watermark_partition(credential_key: Optional[str], resource_id: str) -> str:
+        """Partition of the watermarks of a resource, one per credential key and subscription"""
+        subscription_id = (get_resource_value(resource_id, "/subscriptions") or "").lower()
+        return f"{credential_key or 'default'}:{subscription_id}"
+
+    @staticmethod
+    async def _apply_watermarks(
+        store,
+        credential_key: Optional[str],
+        ids: list[str],
+        metrics: list[Optional[dict]],
+        watermarks: dict[str, dict],
+        metric_set: dict[str, list[str]],
+        range: Optional[dict],
+        timestamp: str
+    ) -> tuple[list[Optional[dict]], list[bool], list[float]]:
+        """Merges the fetched values with the stored ones and advances the watermarks
+
+        A metric without a new point keeps its stored value, as long as that value is
+        still inside the configured range (a full range request would have returned it).
+        When the fetch failed (metric is None), the stored values are served as stale for
+        up to 'StaleValueMaxSeconds', even outside the range.
+
+        Returns:
+            (values, stale, times): the latest values of each resource, whether they are
+            stale and the epoch seconds of their newest point (NaN if none).
+        """
+        past, now = MonitorService._time_window(range, timestamp)
+        stale_cutoff = now - timedelta(seconds=float(os.getenv("StaleValueMaxSeconds", "86400")))
+        output = []
+        stale = []
+        times = []
+        updated = {}
+        for resource_id, metric in zip(ids, metrics):
+            key = resource_key(resource_id)
+            stored = watermarks.get(key) or {}
+            fetched = MonitorService._latest_metrics(metric, metric_set) or {}
+            merged = {}
+            marks = {}
+            for name in metric_set:
+                time_stamp = MonitorService._latest_time_stamp(metric, name)
+                if name in fetched and time_stamp is not None:
+                    merged[name] = fetched[name]
+                    marks[name] = {"time_stamp": str(time_stamp), "values": fetched[name]}
+                    continue
+                previous = stored.get(name)
+                mark = MonitorService._parse_time_stamp(previous.get("time_stamp")) if previous else None
+                if mark is not None and mark >= (past if metric is not None else min(past, stale_cutoff)):
+                    merged[name] = previous["values"]
+                    marks[name] = previous
+            output.append(merged or None)
+            stale.append(metric is None and bool(merged))
+            times.append(MonitorService._newest_time(mark.get("time_stamp") for mark in marks.values()))
+            if marks and marks != stored:
+                updated.setdefault(MonitorService._watermark_partition(credential_key, resource_id), {})[key] = marks
+        if updated:
+            try:
+                await asyncio.gather(*(store.put_many(partition, items) for partition, items in updated.items()))
+            except Exception as ex:
+                logging.warning(f"Could not store the metric watermarks: {ex}")
+        return output, stale, times
+
+    @staticmethod
+    def _latest_time_stamp(metric: Optional[dict], name: str):
+        """Time stamp of the newest point of a metric, None if there is none"""
+        try:
+            return metric[name]["resource"][0]["latest"]["time_stamp"]
+        except (KeyError, IndexError, TypeError):
+            return None
+
+    @staticmethod
+    def _newest_time(time_stamps) -> float:
+        """Epoch seconds of the newest of the given time stamps, NaN if there is none"""
+        newest = float("nan")
+        for time_stamp in time_stamps:
+            parsed = MonitorService._parse_time_stamp(str(time_stamp)) if time_stamp is not None else None
+            if parsed is not None:
+                value = parsed.replace(tzinfo=timezone.utc).timestamp()
+                newest = value if newest != newest else max(newest, value)
+        return newest
+
+    @staticmethod
+    def _guarded(breaker_scope: Optional[str], call):
+        """Awaitable of call(), through the circuit breaker of breaker_scope when there is one"""
+        if breaker_scope is None:
+            return call()
+        return CircuitBreaker.default().call(breaker_scope, call)
+
+    @staticmethod
+    def parse_metric_set(value: str) -> dict[str, list[str]]:
+        """Parses a metric set setting such as 'UsedCapacity:average;Transactions:total,maximum'
+
+        Metrics are separated by ';' and their aggregations by ','. A metric without
+        aggregations defaults to average. Every metric is requested from the storage account,
+        so metrics outside its namespace (ACCOUNT_METRICS) are left out with an error, and a
+        set without any account metric raises ValueError.
+        """
+        known = {name.lower() for name in ACCOUNT_METRICS}
+        metric_set = {}
+        for item in value.split(";"):
+            name, _, aggregations = item.partition(":")
+            if not name.strip():
+                continue
+            if name.strip().lower() not in known:
+                logging.error(f"Metric '{name.strip()}' is not a {STORAGE_METRIC_NAMESPACE} metric, it is left out of the metric set")
+                continue
+            keys = [key.strip() for key in aggregations.split(",") if key.strip()]
+            metric_set[name.strip()] = keys or ["average"]
+        if not metric_set:
+            raise ValueError(f"The metric set '{value}' has no {STORAGE_METRIC_NAMESPACE} metric")
+        return metric_set
 
     @staticmethod    
     def _latest_value(
@@ -247,7 +1049,7 @@ class MonitorService(object):
         }
         # iterate the timeseries from the latest value onwards
         for aggregation in aggregation_list:
-            for metric_value in timeseries[::-1]:
+            for metric_value in reversed(timeseries):
                 try: 
                     value = getattr(metric_value, aggregation)
                     time_stamp = metric_value.time_stamp.isoformat()
@@ -2,18 +2,167 @@ import logging
 import os
 import azure.functions as func
 from prometheus_client import CollectorRegistry,Gauge
-from prometheus_client.exposition import basic_auth_handler
 from prometheus_client import  generate_latest
+from prometheus_client.utils import floatToGoString
+from shared_code.records import AccountTable
+from shared_code.telemetry import DESCRIPTIONS
 import json
+import re
 
 class Promethus:
-    def collector(metriclist):
+    def collector(metriclist, telemetry=None):
+        """Exposition of the latest value of every metric and aggregation fetched, as one string"""
+        return ''.join(Promethus.stream(metriclist,telemetry))
+
+    def stream(metriclist, telemetry=None):
+        """Yields the exposition of the metric records family by family, without a registry
+
+        metriclist is an AccountTable, or a list of record dictionaries.
+
+        Each (metric, aggregation) pair becomes a gauge family named
+        blobnfs_<metric>_<aggregation>, e.g. blobnfs_used_capacity_average. The
+        UsedCapacity average is also kept under the original Used_capacity gauge.
+        Records whose fetch failed ('metrics' is None) are left out rather than reported as 0.
+        Records with 'analytics' add a family per statistic of each metric and aggregation,
+        e.g. blobnfs_used_capacity_average_p95 or blobnfs_used_capacity_average_days_to_full.
+        Records served from their last known values ('stale') are flagged in blobnfs_stale.
+        A Telemetry snapshot, if given, adds the blobnfs_self_* families of the pipeline itself.
+        The output is valid Prometheus text and OpenMetrics, minus the final '# EOF'.
+        """
+        table=Promethus._table(metriclist)
+        labels=Promethus._label_sets(table)
+        for family,description,column in Promethus._families(table):
+            yield f'# HELP {family} {description}\n# TYPE {family} gauge\n'
+            yield from Promethus._samples(family,labels,column)
+        if telemetry:
+            yield from Promethus.telemetry(telemetry)
+
+    def telemetry(snapshot: dict):
+        """Yields the exposition of a Telemetry snapshot: counters, gauges and then histograms"""
+        families={}
+        for name,labels,value in snapshot['counters']:
+            families.setdefault(('counter',name),[]).append((labels,value))
+        for name,labels,value in snapshot.get('gauges',[]):
+            families.setdefault(('gauge',name),[]).append((labels,value))
+        for name,labels,counts,total in snapshot['histograms']:
+            families.setdefault(('histogram',name),[]).append((labels,(counts,total)))
+        bounds=[floatToGoString(bound) for bound in snapshot['buckets']]+['+Inf']
+
+        for (kind,name),series in sorted(families.items()):
+            # the text format names a counter like its samples, openmetrics drops the suffix
+            family=f'{name}_total' if kind=='counter' else name
+            yield f'# HELP {family} {DESCRIPTIONS.get(name,name)}\n# TYPE {family} {kind}\n'
+            lines=[]
+            for labels,value in sorted(series,key=lambda item: sorted(item[0].items())):
+                if kind=='counter':
+                    lines.append(f'{name}_total{Promethus._labels(labels)} {floatToGoString(value)}\n')
+                    continue
+                if kind=='gauge':
+                    lines.append(f'{name}{Promethus._labels(labels)} {floatToGoString(value)}\n')
+                    continue
+                counts,total=value
+                cumulative=0
+                for bound,count in zip(bounds,counts):
+                    cumulative+=count
+                    lines.append(f'{name}_bucket{Promethus._labels({**labels,"le":bound})} {floatToGoString(cumulative)}\n')
+                lines.append(f'{name}_sum{Promethus._labels(labels)} {floatToGoString(total)}\n')
+                lines.append(f'{name}_count{Promethus._labels(labels)} {floatToGoString(cumulative)}\n')
+            yield ''.join(lines)
+
+    def openmetrics(exposition: bytes):
+        """The exposition in OpenMetrics, whose counter families are named without the _total of their samples
+
+        Only the blobnfs_self_* families, written last, contain counters.
+        """
+        start=exposition.find(b'# HELP blobnfs_self_')
+        if start<0:
+            return exposition
+        tail=exposition[start:]
+        counters=set(re.findall(rb'^# TYPE (\S+)_total counter$',tail,re.M))
+        tail=re.sub(
+            rb'^# (HELP|TYPE) (\S+)_total ',
+            lambda match: b'# '+match[1]+b' '+match[2]+b' ' if match[2] in counters else match[0],
+            tail,
+            flags=re.M
+        )
+        return exposition[:start]+tail
+
+    def _labels(labels: dict):
+        if not labels:
+            return ''
+        return '{'+','.join(f'{key}="{Promethus._escape(value)}"' for key,value in labels.items())+'}'
+
+    def series(metriclist):
+        """Yields (family, labels, value) of every sample of stream, for the push sinks"""
+        table=Promethus._table(metriclist)
+        labels=[
+            {"Customerid":str(customer),"Storageaccountname":str(name),"subscriptionId":str(subscription)}
+            for customer,name,subscription in zip(
+                table.columns["Customerid"],table.columns["Storageaccountname"],table.columns["subscriptionId"]
+            )
+        ]
+        for family,_,column in Promethus._families(table):
+            for label,value in zip(labels,column):
+                if value==value:
+                    yield family,label,value
+
+    def _table(metriclist):
+        """AccountTable of the records, lists of record dictionaries are converted"""
+        if isinstance(metriclist,AccountTable):
+            return metriclist
+        return AccountTable.from_rows(metriclist)
+
+    def _families(table: AccountTable):
+        """(family, help text, column) of each gauge family, column being the values of every account, NaN if none"""
+        yield 'Used_capacity','Used Capacity for storage',table.values.get(('UsedCapacity','average'),())
+        for (name,aggregation),column in table.values.items():
+            family=Promethus._family_name(name,aggregation)
+            yield family,f'{name} ({aggregation}) of the storage account from Azure Monitor',column
+        for (name,aggregation,stat),column in table.analytics.items():
+            family=f'{Promethus._family_name(name,aggregation)}_{stat}'
+            yield family,f'{stat} of {name} ({aggregation}) over the collected range',column
+        if any(table.stale):
+            nan=float('nan')
+            yield 'blobnfs_stale','Whether the values of the storage account are the last known ones, its fetch failed',[1.0 if flag else nan for flag in table.stale]
+
+    def _label_sets(table: AccountTable):
+        """Label set of each account, escaped once and shared by every family"""
+        escape=Promethus._escape
+        return [
+            f'{{Customerid="{escape(customer)}",Storageaccountname="{escape(name)}",subscriptionId="{escape(subscription)}"}}'
+            for customer,name,subscription in zip(
+                table.columns["Customerid"],table.columns["Storageaccountname"],table.columns["subscriptionId"]
+            )
+        ]
+
+    def _samples(family: str, labels: list, column):
+        """Sample lines of a family"""
+        lines=[]
+        for label,value in zip(labels,column):
+            if value!=value:
+                continue
+            lines.append(f'{family}{label} {floatToGoString(value)}\n')
+            # hand out the text in chunks rather than one line at a time
+            if len(lines)>=1000:
+                yield ''.join(lines)
+                lines=[]
+        if lines:
+            yield ''.join(lines)
+
+    def _escape(value):
+        return str(value).replace('\\','\\\\').replace('\n','\\n').replace('"','\\"')
+
+    def _family_name(name: str, aggregation: str):
+        """Prometheus family name of a metric and aggregation, e.g. UsedCapacity -> blobnfs_used_capacity_average"""
+        snake=re.sub(r'(?<=[a-z0-9])(?=[A-Z])','_',name)
+        snake=re.sub(r'[^a-zA-Z0-9_]','_',snake).lower()
+        return f'blobnfs_{snake}_{aggregation.lower()}'
+
+    def scrape_status(age_seconds: float, refreshing: bool):
+        """Exposition of the age of the served data and whether a refresh is running"""
         registry=CollectorRegistry()
-        UsedCapacity_metrics=Gauge('Used_capacity','Used Capacity for storage',['Customerid','Storageaccountname','subscriptionId'],registry=registry)
-        for metric in metriclist:
-            UsedCapacity_metrics.labels(
-                metric['Customerid'],
-                metric['Storageaccountname'],
-                metric['subscriptionId']
-            ).set(metric['metrics'])
-        return generate_latest(registry).decode()
\ No newline at end of file
+        data_age=Gauge('blobnfs_scrape_data_age_seconds','Seconds since the served metrics were collected',registry=registry)
+        data_age.set(age_seconds)
+        refresh=Gauge('blobnfs_scrape_refresh_in_progress','Whether a background collection is running',registry=registry)
+        refresh.set(1 if refreshing else 0)
+        return generate_latest(registry).decode()
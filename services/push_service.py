@@ -0,0 +1,206 @@
+import base64
+import os
+import struct
+from time import time
+from typing import Iterable, Optional
+from urllib.parse import quote
+
+import aiohttp
+
+from services.promethus_service import Promethus
+from shared_code.client_pool import ClientPool
+from shared_code.latency import hedged_call
+from shared_code.telemetry import Telemetry
+from shared_code.utilities import gather_with_concurrency, list_to_chunks
+
+REMOTE_WRITE_HEADERS = {
+    "Content-Encoding": "snappy",
+    "Content-Type": "application/x-protobuf",
+    "X-Prometheus-Remote-Write-Version": "0.1.0"
+}
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _length_delimited(field: int, payload: bytes) -> bytes:
+    return _varint(field << 3 | 2) + _varint(len(payload)) + payload
+
+
+def encode_write_request(series: Iterable[tuple[dict, float]], timestamp_ms: int) -> bytes:
+    """Encodes a remote-write WriteRequest protobuf, one sample per time series
+
+    Hand-written for the four messages involved, so no protobuf runtime is needed:
+    WriteRequest{timeseries=1}, TimeSeries{labels=1, samples=2}, Label{name=1, value=2}
+    and Sample{value=1 (double), timestamp=2 (int64)}. Labels are sorted by name, as
+    the protocol requires, and must include __name__.
+    """
+    timestamp = b"\x10" + _varint(timestamp_ms)
+    out = bytearray()
+    for labels, value in series:
+        body = bytearray()
+        for name, label_value in sorted(labels.items()):
+            body += _length_delimited(1, _length_delimited(1, name.encode()) + _length_delimited(2, label_value.encode()))
+        sample = b"\x09" + struct.pack("<d", value) + timestamp
+        body += _length_delimited(2, sample)
+        out += _length_delimited(1, bytes(body))
+    return bytes(out)
+
+
+class PushService:
+    """Pushes the metric records of each activity as soon as they are fetched
+
+    Settings: 'PushMode' is off (default), 'pushgateway' or 'remote_write'. 'PushUrl' is
+    the Pushgateway base URL or the remote-write endpoint, 'PushUsername' and
+    'PushPassword' enable basic auth. 'PushJob' (default blobnfsmonitoring) is the job
+    label. Remote writes carry at most 'PushBatchSamples' samples (default 5000) and
+    'PushConcurrency' of them (default 2) are in flight per activity. Every write times
+    out after 'PushTimeoutSeconds' (default 30) and is retried 'PushRetries' times
+    (default 3) on transport errors and 5xx responses.
+    """
+
+    @staticmethod
+    def mode() -> str:
+        return os.getenv("PushMode", "off").strip().lower()
+
+    @staticmethod
+    async def push(records: list[dict], group: dict[str, str], mode: Optional[str] = None) -> int:
+        """Pushes the records of one activity
+
+        Args:
+            records: metric records, as served by the exposition: an AccountTable or a list of dictionaries.
+            group: labels identifying the activity, e.g. {"part": "0.3"}. With a Pushgateway
+                they form the grouping key, so each activity replaces only its own metrics,
+                and prune deletes the groups a scrape did not push.
+            mode: 'pushgateway' or 'remote_write'. Default is the 'PushMode' setting.
+        Returns:
+            the number of samples pushed.
+        """
+        mode = mode or PushService.mode()
+        url = os.getenv("PushUrl", "")
+        if not url:
+            raise ValueError(f"PushMode is '{mode}' but PushUrl is not set")
+        job = os.getenv("PushJob", "blobnfsmonitoring")
+
+        if mode == "pushgateway":
+            samples = await PushService._pushgateway(url, job, records, group)
+        elif mode == "remote_write":
+            samples = await PushService._remote_write(url, job, records)
+        else:
+            raise ValueError(f"Unknown PushMode '{mode}'")
+        Telemetry.default().inc("blobnfs_self_pushed_samples", samples, mode=mode)
+        return samples
+
+    @staticmethod
+    async def _pushgateway(url: str, job: str, records: list[dict], group: dict[str, str]) -> int:
+        # the body of one activity is bounded by the account batch size of divideaccounts
+        body = "".join(Promethus.stream(records)).encode()
+        # PUT replaces the whole group, so accounts gone since the last push disappear too
+        await PushService._send("PUT", url.rstrip("/") + PushService._group_path(job, group), body, {"Content-Type": "text/plain; version=0.0.4"}, "push:pushgateway")
+        return sum(1 for _ in Promethus.series(records))
+
+    @staticmethod
+    async def prune(pushed: list[dict[str, str]]) -> int:
+        """Deletes the Pushgateway groups of the job that were not pushed by the current scrape
+
+        The groups are the parts of a scrape, whose boundaries move when the fleet or the batch
+        size changes. Without this, the groups of parts that no longer exist keep their last
+        series forever, and their accounts show up twice.
+
+        Args:
+            pushed: grouping labels of every push of the scrape, without the job.
+        Returns:
+            the number of groups deleted.
+        """
+        url = os.getenv("PushUrl", "").rstrip("/")
+        job = os.getenv("PushJob", "blobnfsmonitoring")
+        keep = {tuple(sorted(group.items())) for group in pushed}
+        keys = {name for group in pushed for name in group}
+        session = ClientPool.get_session()
+        async with session.get(
+            url + "/api/v1/metrics",
+            auth=PushService._auth(),
+            timeout=aiohttp.ClientTimeout(total=float(os.getenv("PushTimeoutSeconds", "30")))
+        ) as response:
+            response.raise_for_status()
+            payload = await response.json()
+
+        stale = []
+        for group in payload.get("data", []):
+            # the Pushgateway reports unset labels as empty strings
+            labels = {name: value for name, value in group.get("labels", {}).items() if value}
+            if labels.pop("job", None) != job or not labels or set(labels) - keys:
+                continue
+            if tuple(sorted(labels.items())) not in keep:
+                stale.append(labels)
+        for labels in stale:
+            await PushService._send("DELETE", url + PushService._group_path(job, labels), b"", {}, "push:pushgateway")
+        return len(stale)
+
+    @staticmethod
+    async def _remote_write(url: str, job: str, records: list[dict]) -> int:
+        import snappy
+
+        timestamp_ms = int(time() * 1000)
+        series = [
+            ({**labels, "__name__": family, "job": job}, float(value))
+            for family, labels, value in Promethus.series(records)
+        ]
+        batch_size = int(os.getenv("PushBatchSamples", "5000"))
+
+        async def write(batch: list):
+            body = snappy.compress(encode_write_request(batch, timestamp_ms))
+            await PushService._send("POST", url, body, REMOTE_WRITE_HEADERS, "push:remote_write")
+
+        await gather_with_concurrency(
+            int(os.getenv("PushConcurrency", "2")),
+            *((lambda batch=batch: write(batch)) for batch in list_to_chunks(series, batch_size))
+        )
+        return len(series)
+
+    @staticmethod
+    async def _send(method: str, url: str, body: bytes, headers: dict, endpoint: str):
+        session = ClientPool.get_session()
+        auth = PushService._auth()
+        timeout = float(os.getenv("PushTimeoutSeconds", "30"))
+
+        async def send():
+            async with session.request(
+                method,
+                url,
+                data=body,
+                headers=headers,
+                auth=auth,
+                timeout=aiohttp.ClientTimeout(total=timeout)
+            ) as response:
+                response.raise_for_status()
+
+        # a duplicate write is harmless but wasteful, so no hedging
+        await hedged_call(endpoint, send, timeout, retries=int(os.getenv("PushRetries", "3")), hedge=False)
+
+    @staticmethod
+    def _auth() -> Optional[aiohttp.BasicAuth]:
+        if os.getenv("PushUsername"):
+            return aiohttp.BasicAuth(os.getenv("PushUsername"), os.getenv("PushPassword", ""))
+        return None
+
+    @staticmethod
+    def _group_path(job: str, group: dict[str, str]) -> str:
+        return "/metrics/job" + PushService._path_value(job) + "".join(
+            f"/{name}{PushService._path_value(value)}" for name, value in group.items()
+        )
+
+    @staticmethod
+    def _path_value(value: str) -> str:
+        """Grouping key value in a Pushgateway URL, base64 when it contains a slash"""
+        if not value:
+            return "@base64/="
+        if "/" in value:
+            return "@base64/" + base64.urlsafe_b64encode(value.encode()).decode()
+        return "/" + quote(value, safe="")
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from time import time
+from typing import Optional
+
+from azure.durable_functions.models.OrchestrationRuntimeStatus import OrchestrationRuntimeStatus
+
+from services.collector_service import STATUS_NAME
+from shared_code.result_store import get_result_store
+
+RUNNING_STATUSES = (
+    OrchestrationRuntimeStatus.Running,
+    OrchestrationRuntimeStatus.Pending,
+    OrchestrationRuntimeStatus.ContinuedAsNew
+)
+
+
+class ScrapeService:
+    """Stale-while-revalidate cache in front of the scrape orchestration
+
+    Refreshes run under a deterministic instance ID per refresh window
+    ('<ScrapeInstancePrefix>-<epoch>', where the epoch advances every
+    'ScrapeMaxAgeSeconds'). Every worker computes the same ID, so at most one refresh
+    runs per window across the app, and the durable store keeps its output. A scrape
+    serves the last completed output straight away and starts the refresh of the current
+    window if it is not running yet. Only when there is no completed output at all does
+    it wait, up to 'ScrapeWaitSeconds'. With 'CollectionMode' set to continuous, the
+    collector timer keeps the cache up to date instead and a scrape only reads it.
+    """
+
+    # last completed output seen by this worker
+    _cache: Optional[dict] = None
+    # exposition text of the last output read from the result store
+    _exposition: Optional[tuple] = None
+
+    @staticmethod
+    async def get_output(client, orchestrator_name: str) -> Optional[dict]:
+        """Returns the cached scrape output, starting a background refresh when it is stale
+
+        Returns:
+            dictionary with the 'output', its 'age' in seconds and whether a 'refreshing'
+            orchestration is running, or None if no output is available yet.
+        """
+        max_age = float(os.getenv("ScrapeMaxAgeSeconds", "300"))
+        prefix = os.getenv("ScrapeInstancePrefix", "blobnfs-scrape")
+        epoch = int(time() // max_age)
+        current_id = f"{prefix}-{epoch}"
+
+        status = await client.get_status(current_id)
+        refreshing = status.runtime_status in RUNNING_STATUSES
+        if status.runtime_status == OrchestrationRuntimeStatus.Completed:
+            ScrapeService._remember(status)
+        elif not refreshing and ScrapeService._can_start(status):
+            try:
+                await client.start_new(orchestrator_name, current_id, None)
+                logging.info(f"Started scrape refresh '{current_id}'")
+            except Exception as ex:
+                # another scrape started the same window first, its refresh is the one running
+                logging.info(f"Scrape refresh '{current_id}' not started here: {ex}")
+            refreshing = True
+
+        cache = ScrapeService._cache
+        if cache is None or cache["instance_id"] not in (current_id, f"{prefix}-{epoch - 1}"):
+            # another worker may have completed the previous window
+            previous = await client.get_status(f"{prefix}-{epoch - 1}")
+            if previous.runtime_status == OrchestrationRuntimeStatus.Completed:
+                ScrapeService._remember(previous)
+
+        if ScrapeService._cache is None and refreshing:
+            await ScrapeService._wait_for(client, current_id, float(os.getenv("ScrapeWaitSeconds", "60")))
+
+        cache = ScrapeService._cache
+        if cache is None:
+            return None
+        return {
+            "output": cache["output"],
+            "age": max(time() - cache["completed_at"], 0.0),
+            "refreshing": refreshing and cache["instance_id"] != current_id
+        }
+
+    @staticmethod
+    async def get_exposition(output) -> Optional[bytes]:
+        """Reads the exposition text of a scrape output from the result store
+
+        The text of the last scrape is kept in memory, so the store is read once per scrape
+        and worker. Outputs of orchestrations from before the result store carry the text.
+        """
+        if not ScrapeService._has_exposition(output):
+            return None
+        if isinstance(output, str):
+            return output.encode()
+        name = output["exposition"]
+        if ScrapeService._exposition is not None and ScrapeService._exposition[0] == name:
+            return ScrapeService._exposition[1]
+        body = await get_result_store().read(name)
+        if body is None:
+            logging.warning(f"Exposition '{name}' not found in the result store")
+            return None
+        ScrapeService._exposition = (name, body)
+        return body
+
+    @staticmethod
+    async def get_collected() -> Optional[dict]:
+        """Returns the exposition written by the continuous collector, None before its first tick
+
+        Returns:
+            dictionary with the 'exposition' text and its 'age' in seconds. The status
+            object is read on every scrape, the text only when a tick wrote a new one.
+        """
+        store = get_result_store()
+        body = await store.read(STATUS_NAME)
+        if body is None:
+            return None
+        status = json.loads(body)
+        # the object name is the same for every tick, the generation tells them apart
+        name = f"{status['exposition']}@{status['generation']}"
+        if ScrapeService._exposition is None or ScrapeService._exposition[0] != name:
+            exposition = await store.read(status["exposition"])
+            if exposition is None:
+                logging.warning(f"Collector exposition '{status['exposition']}' not found in the result store")
+                return None
+            ScrapeService._exposition = (name, exposition)
+        return {
+            "exposition": ScrapeService._exposition[1],
+            "age": max(time() - status["updated_at"], 0.0)
+        }
+
+    @staticmethod
+    def _can_start(status) -> bool:
+        if status.runtime_status is None:
+            return True
+        # back off before restarting a failed refresh of the same window
+        retry_after = float(os.getenv("ScrapeRetrySeconds", "60"))
+        return ScrapeService._timestamp(status.last_updated_time) < time() - retry_after
+
+    @staticmethod
+    async def _wait_for(client, instance_id: str, timeout: float):
+        deadline = time() + timeout
+        while time() < deadline:
+            await asyncio.sleep(1.0)
+            status = await client.get_status(instance_id)
+            if status.runtime_status == OrchestrationRuntimeStatus.Completed:
+                ScrapeService._remember(status)
+                return
+            if status.runtime_status not in RUNNING_STATUSES:
+                logging.warning(f"Scrape refresh '{instance_id}' ended as {status.runtime_status}")
+                return
+
+    @staticmethod
+    def _remember(status):
+        if not ScrapeService._has_exposition(status.output):
+            # the exposition failed, the last good output stays served
+            logging.warning(f"Scrape '{status.instance_id}' completed without an exposition")
+            return
+        completed_at = ScrapeService._timestamp(status.last_updated_time)
+        cache = ScrapeService._cache
+        if cache is None or completed_at >= cache["completed_at"]:
+            ScrapeService._cache = {
+                "instance_id": status.instance_id,
+                "completed_at": completed_at,
+                "output": status.output
+            }
+
+    @staticmethod
+    def _has_exposition(output) -> bool:
+        # outputs of orchestrations from before the result store are the text itself
+        return isinstance(output, str) or (isinstance(output, dict) and bool(output.get("exposition")))
+
+    @staticmethod
+    def _timestamp(value: Optional[datetime]) -> float:
+        if value is None:
+            return 0.0
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
@@ -2,6 +2,10 @@ from azure.mgmt.subscription.aio import SubscriptionClient
 from azure.mgmt.subscription.models import Subscription
 from msrestazure.azure_cloud import Cloud, AZURE_CHINA_CLOUD
 from azure.core.credentials_async import AsyncTokenCredential
+from shared_code.client_pool import ClientPool
+from shared_code.scheduler import RequestScheduler
+from shared_code.telemetry import Telemetry
+from typing import Optional
 
 import logging
 
@@ -14,18 +18,29 @@ class SubscriptionService():
         pass
 
     @staticmethod
-    async def subscription_list(credentials: AsyncTokenCredential, cloud: Cloud) -> list[Subscription]:
-        """Retrieves the list of subscriptions available on the tenant"""
-        subs_client = SubscriptionClient(
-            credential=credentials, 
-            base_url=cloud.endpoints.resource_manager, 
-            credential_scopes=[cloud.endpoints.resource_manager + '/.default']
-        )
+    async def subscription_list(
+        credentials: AsyncTokenCredential,
+        cloud: Cloud,
+        credential_key: Optional[str] = None
+    ) -> list[Subscription]:
+        """Retrieves the list of subscriptions available on the tenant
 
+        If credential_key is given, the client is taken from the process-wide pool.
+        """
+        async def list_all(slot):
+            subs_iterator = subs_client.subscriptions.list(raw_response_hook=slot.response_hook)
+            return [sub async for sub in subs_iterator]
+
+        scope = credential_key or "subscriptions"
         results = []
-        async with subs_client:
-            subs_iterator = subs_client.subscriptions.list()
-            results = [sub async for sub in subs_iterator]
+        with Telemetry.default().stage("subscription_list"):
+            if credential_key is not None:
+                subs_client = ClientPool.get_client(SubscriptionClient, credentials, cloud, credential_key)
+                results = await RequestScheduler.default().run(scope, list_all)
+            else:
+                subs_client = ClientPool.create_client(SubscriptionClient, credentials, cloud)
+                async with subs_client:
+                    results = await RequestScheduler.default().run(scope, list_all)
 
         n_subs = len(results)
         logging.info(f"These credentials can access a total of {n_subs} subscriptions.")
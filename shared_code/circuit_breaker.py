@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import os
+from time import monotonic
+from typing import Any, Awaitable, Callable, Optional
+
+import aiohttp
+from azure.core.exceptions import HttpResponseError
+
+from shared_code.latency import is_retryable
+from shared_code.telemetry import Telemetry
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+# value of the blobnfs_self_breaker_state gauge, the higher the worse
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling while the breaker of the scope is open"""
+
+
+def is_breaker_failure(ex: Exception) -> bool:
+    """Errors that say the whole scope is unhealthy: timeouts, transport errors, 5xx, 401, 403 and 429
+
+    Other errors, e.g. a 404 for a deleted account, concern a single resource and show
+    the scope is answering.
+    """
+    if is_retryable(ex):
+        return True
+    if isinstance(ex, HttpResponseError):
+        return ex.status_code in (401, 403, 429)
+    if isinstance(ex, aiohttp.ClientResponseError):
+        return ex.status in (401, 403, 429)
+    return False
+
+
+class CircuitBreaker:
+    """Circuit breakers per scope, e.g. a credential key and subscription
+
+    A scope opens after 'BreakerFailureThreshold' consecutive failed calls (default 5) and
+    rejects calls with CircuitOpenError for 'BreakerOpenSeconds' (default 60). It then goes
+    half-open and lets 'BreakerHalfOpenProbes' calls through (default 1): a success closes
+    it, a failure opens it again for twice as long, up to 'BreakerMaxOpenSeconds' (600).
+    The state of each scope is kept in the blobnfs_self_breaker_state gauge.
+    """
+
+    _default: Optional["CircuitBreaker"] = None
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        open_seconds: float = 60.0,
+        max_open_seconds: float = 600.0,
+        half_open_probes: int = 1
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.half_open_probes = half_open_probes
+        self._scopes: dict[str, dict] = {}
+
+    @staticmethod
+    def default() -> "CircuitBreaker":
+        if CircuitBreaker._default is None:
+            CircuitBreaker._default = CircuitBreaker(
+                failure_threshold=int(os.getenv("BreakerFailureThreshold", "5")),
+                open_seconds=float(os.getenv("BreakerOpenSeconds", "60")),
+                max_open_seconds=float(os.getenv("BreakerMaxOpenSeconds", "600")),
+                half_open_probes=int(os.getenv("BreakerHalfOpenProbes", "1"))
+            )
+        return CircuitBreaker._default
+
+    def _scope(self, scope: str) -> dict:
+        if scope not in self._scopes:
+            self._scopes[scope] = {"state": CLOSED, "failures": 0, "opened_at": 0.0, "open_for": 0.0, "probes": 0}
+            Telemetry.default().set("blobnfs_self_breaker_state", STATE_VALUES[CLOSED], scope=scope)
+        return self._scopes[scope]
+
+    def _transition(self, scope: str, entry: dict, state: str):
+        if entry["state"] != state:
+            logging.info(f"Circuit breaker of '{scope}' is now {state}")
+        entry["state"] = state
+        Telemetry.default().set("blobnfs_self_breaker_state", STATE_VALUES[state], scope=scope)
+
+    def state(self, scope: str) -> str:
+        entry = self._scope(scope)
+        if entry["state"] == OPEN and monotonic() - entry["opened_at"] >= entry["open_for"]:
+            entry["probes"] = 0
+            self._transition(scope, entry, HALF_OPEN)
+        return entry["state"]
+
+    def allow(self, scope: str) -> bool:
+        """Whether a call may go through now, a half-open scope counts it as a probe"""
+        state = self.state(scope)
+        if state == CLOSED:
+            return True
+        entry = self._scopes[scope]
+        if state == HALF_OPEN and entry["probes"] < self.half_open_probes:
+            entry["probes"] += 1
+            return True
+        return False
+
+    def record_success(self, scope: str):
+        entry = self._scope(scope)
+        entry["failures"] = 0
+        entry["open_for"] = 0.0
+        if entry["state"] != CLOSED:
+            self._transition(scope, entry, CLOSED)
+
+    def record_failure(self, scope: str):
+        entry = self._scope(scope)
+        if entry["state"] == OPEN:
+            # a call that started before the scope opened, the failures that opened it are enough
+            return
+        entry["failures"] += 1
+        if entry["state"] == HALF_OPEN or entry["failures"] >= self.failure_threshold:
+            # each failed probe doubles the open period
+            open_for = entry["open_for"] * 2 if entry["state"] == HALF_OPEN else 0.0
+            entry["open_for"] = min(max(open_for, self.open_seconds), self.max_open_seconds)
+            entry["opened_at"] = monotonic()
+            if entry["state"] != OPEN:
+                Telemetry.default().inc("blobnfs_self_breaker_opened", scope=scope)
+                logging.warning(
+                    f"Opening the circuit breaker of '{scope}' for {entry['open_for']:.0f}s "
+                    f"after {entry['failures']} failures"
+                )
+            self._transition(scope, entry, OPEN)
+
+    async def call(self, scope: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Runs call() through the breaker of the scope, raises CircuitOpenError while it is open"""
+        if not self.allow(scope):
+            Telemetry.default().inc("blobnfs_self_breaker_rejected", scope=scope)
+            raise CircuitOpenError(f"Circuit breaker of '{scope}' is open")
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            # a cancelled call (e.g. a losing hedge) says nothing about the scope
+            entry = self._scopes[scope]
+            entry["probes"] = max(entry["probes"] - 1, 0)
+            raise
+        except Exception as ex:
+            if is_breaker_failure(ex):
+                self.record_failure(scope)
+            else:
+                self.record_success(scope)
+            raise
+        self.record_success(scope)
+        return result
+
+    def stats(self) -> dict:
+        return {scope: self.state(scope) for scope in self._scopes}
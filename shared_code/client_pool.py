@@ -0,0 +1,162 @@
+import asyncio
+import atexit
+import logging
+import os
+from typing import Any, Optional
+
+import aiohttp
+from azure.core.credentials_async import AsyncTokenCredential
+from azure.core.pipeline.policies import SansIOHTTPPolicy
+from azure.core.pipeline.transport import AioHttpTransport
+from msrestazure.azure_cloud import Cloud
+
+
+class _LocalEndpointPolicy(SansIOHTTPPolicy):
+    """Allows bearer tokens over plain HTTP, only used for local stand-ins of ARM"""
+
+    def on_request(self, request):
+        request.context.options["enforce_https"] = False
+
+
+class ClientPool:
+    """Process-wide pool of Azure management clients over a single shared aiohttp session
+
+    Clients are keyed by (client type, credential key, cloud, subscription) and live for the
+    whole worker process, so every call reuses the same keep-alive connections instead of
+    paying TCP+TLS setup per resource. Connection limits are read from the settings
+    'HttpConnectionLimit', 'HttpConnectionLimitPerHost' and 'HttpKeepAliveSeconds'.
+    """
+
+    _session: Optional[aiohttp.ClientSession] = None
+    _loop: Optional[asyncio.AbstractEventLoop] = None
+    _clients: dict = {}
+    _connections_opened: int = 0
+    _close_callbacks: list = []
+    _trace_configs: list = []
+
+    @staticmethod
+    def get_session() -> aiohttp.ClientSession:
+        """Returns the shared aiohttp session, creating it on first use"""
+        loop = asyncio.get_running_loop()
+        if ClientPool._session is not None and ClientPool._loop is not loop:
+            # the session is bound to the loop that created it (e.g. asyncio.run in scripts)
+            logging.info("Event loop changed, discarding the pooled HTTP session and clients")
+            ClientPool._session = None
+            ClientPool._clients = {}
+
+        if ClientPool._session is None or ClientPool._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=int(os.getenv("HttpConnectionLimit", "100")),
+                limit_per_host=int(os.getenv("HttpConnectionLimitPerHost", "20")),
+                keepalive_timeout=float(os.getenv("HttpKeepAliveSeconds", "60"))
+            )
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_connection_create_end.append(ClientPool._on_connection_created)
+            ClientPool._session = aiohttp.ClientSession(
+                connector=connector,
+                trace_configs=[trace_config, *ClientPool._trace_configs]
+            )
+            ClientPool._loop = loop
+
+        return ClientPool._session
+
+    @staticmethod
+    def get_transport() -> AioHttpTransport:
+        """Returns an azure-core transport that borrows the shared session without owning it"""
+        return AioHttpTransport(session=ClientPool.get_session(), session_owner=False)
+
+    @staticmethod
+    def create_client(
+        client_cls: type,
+        credential: AsyncTokenCredential,
+        cloud: Cloud,
+        subscription_id: Optional[str] = None
+    ) -> Any:
+        """Creates a standalone management client on the shared transport"""
+        kwargs = dict(
+            credential=credential,
+            base_url=cloud.endpoints.resource_manager,
+            credential_scopes=[cloud.endpoints.resource_manager + '/.default'],
+            transport=ClientPool.get_transport()
+        )
+        if subscription_id is not None:
+            kwargs["subscription_id"] = subscription_id
+        if cloud.endpoints.resource_manager.startswith("http://"):
+            kwargs["per_call_policies"] = [_LocalEndpointPolicy()]
+        return client_cls(**kwargs)
+
+    @staticmethod
+    def get_client(
+        client_cls: type,
+        credential: AsyncTokenCredential,
+        cloud: Cloud,
+        credential_key: str,
+        subscription_id: Optional[str] = None
+    ) -> Any:
+        """Returns the pooled client for the key, creating it on first use
+
+        Pooled clients must not be closed by the caller. If the credential object for a key
+        changes, the client is rebuilt on the new credential.
+        """
+        ClientPool.get_session()
+        key = (client_cls.__name__, credential_key, cloud.name, subscription_id)
+        pooled = ClientPool._clients.get(key)
+        if pooled is None or pooled[0] is not credential:
+            client = ClientPool.create_client(client_cls, credential, cloud, subscription_id)
+            ClientPool._clients[key] = (credential, client)
+            return client
+        return pooled[1]
+
+    @staticmethod
+    def stats() -> dict:
+        return {
+            "clients": len(ClientPool._clients),
+            "connections_opened": ClientPool._connections_opened
+        }
+
+    @staticmethod
+    def add_trace_config(trace_config: aiohttp.TraceConfig):
+        """Adds an aiohttp trace config to the sessions created from now on"""
+        ClientPool._trace_configs.append(trace_config)
+
+    @staticmethod
+    def on_close(callback):
+        """Registers a coroutine function that is awaited when the pool is closed"""
+        ClientPool._close_callbacks.append(callback)
+
+    @staticmethod
+    async def close():
+        """Closes every pooled client, the registered resources and the shared session"""
+        clients = [client for _, client in ClientPool._clients.values()]
+        ClientPool._clients = {}
+        for client in clients:
+            try:
+                await client.close()
+            except Exception as ex:
+                logging.warning(f"Error closing pooled client: {ex}")
+
+        for callback in ClientPool._close_callbacks:
+            try:
+                await callback()
+            except Exception as ex:
+                logging.warning(f"Error running pool close callback: {ex}")
+
+        if ClientPool._session is not None and not ClientPool._session.closed:
+            await ClientPool._session.close()
+        ClientPool._session = None
+        ClientPool._loop = None
+
+    @staticmethod
+    async def _on_connection_created(session, context, params):
+        ClientPool._connections_opened += 1
+
+
+@atexit.register
+def _close_pool_at_exit():
+    loop = ClientPool._loop
+    if ClientPool._session is None or loop is None or loop.is_closed() or loop.is_running():
+        return
+    try:
+        loop.run_until_complete(ClientPool.close())
+    except Exception as ex:
+        logging.warning(f"Error closing the client pool on shutdown: {ex}")
@@ -1,3 +1,4 @@
+import os
 from msrestazure.azure_cloud import Cloud, AZURE_PUBLIC_CLOUD as CLOUD_PUB, AZURE_CHINA_CLOUD as CLOUD_CH
 
 china_provider = ["CN", "CHINA"]
@@ -8,4 +9,23 @@ def get_cloud_provider(provider: str) -> Cloud:
     if provider in china_provider:
         cloud = CLOUD_CH
     
-    return cloud
\ No newline at end of file
+    return cloud
+
+
+def get_metrics_batch_endpoint(cloud: Cloud, region: str) -> str:
+    """Returns the regional Azure Monitor data-plane endpoint for metrics:getBatch
+
+    The 'MetricsBatchEndpoint' setting overrides it, e.g. to target a local stand-in.
+    """
+    endpoint = os.getenv("MetricsBatchEndpoint", "").strip()
+    if endpoint:
+        return endpoint.rstrip('/')
+
+    suffix = "metrics.monitor.azure.cn" if cloud.name == CLOUD_CH.name else "metrics.monitor.azure.com"
+    return f"https://{region.lower()}.{suffix}"
+
+
+def get_metrics_batch_scope(cloud: Cloud) -> str:
+    if cloud.name == CLOUD_CH.name:
+        return "https://metrics.monitor.azure.cn/.default"
+    return "https://metrics.monitor.azure.com/.default"
@@ -0,0 +1,309 @@
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # no file locks on Windows, the thread lock still applies
+    fcntl = None
+
+HISTORY_VERSION = 1
+# magic, version, capacity, points written since creation, then unused
+HEADER = np.dtype("<i8")
+HEADER_SLOTS = 8
+HEADER_BYTES = HEADER.itemsize * HEADER_SLOTS
+MAGIC = 0x424E4653484953  # 'BNFSHIS'
+RECORD = np.dtype([("account", "<u4"), ("time", "<f8"), ("value", "<f8")])
+
+
+class _Ring:
+    """One memory-mapped ring of (account, time, value) records, for one metric and aggregation"""
+
+    def __init__(self, path: str, capacity: int) -> None:
+        if not os.path.exists(path):
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(np.array([MAGIC, HISTORY_VERSION, capacity, 0] + [0] * (HEADER_SLOTS - 4), dtype=HEADER).tobytes())
+                # sparse on most file systems, pages are only allocated once written
+                f.truncate(HEADER_BYTES + capacity * RECORD.itemsize)
+            try:
+                os.link(tmp, path)
+            except FileExistsError:
+                # created by another worker in the meantime
+                pass
+            finally:
+                os.remove(tmp)
+        self.header = np.memmap(path, dtype=HEADER, mode="r+", shape=(HEADER_SLOTS,))
+        if self.header[0] != MAGIC or self.header[1] != HISTORY_VERSION:
+            raise ValueError(f"'{path}' is not a metric history file of version {HISTORY_VERSION}")
+        self.capacity = int(self.header[2])
+        if self.capacity != capacity:
+            logging.warning(f"Metric history '{path}' keeps {self.capacity} points, not the {capacity} configured")
+        self.records = np.memmap(path, dtype=RECORD, mode="r+", offset=HEADER_BYTES, shape=(self.capacity,))
+        # newest time stamp of each account, to append only points not stored yet
+        self.last = np.full(0, -np.inf)
+        self.synced = 0
+
+    @property
+    def written(self) -> int:
+        return int(self.header[3])
+
+    def _segments(self, since: int = 0) -> list[tuple[int, int]]:
+        """Slices of the ring with the records written since the given count, oldest first"""
+        written = self.written
+        since = max(since, written - self.capacity)
+        if written - since == 0:
+            return []
+        start, end = since % self.capacity, written % self.capacity
+        if start < end:
+            return [(start, end)]
+        return [(start, self.capacity), (0, end)]
+
+    def window(self, since: int = 0) -> np.ndarray:
+        """Records written since the given count that are still in the ring, oldest first"""
+        segments = self._segments(since)
+        if not segments:
+            return self.records[:0]
+        if len(segments) == 1:
+            return self.records[slice(*segments[0])]
+        return np.concatenate([self.records[start:end] for start, end in segments])
+
+    def select(self, start: Optional[float] = None, end: Optional[float] = None, accounts: Optional[np.ndarray] = None) -> np.ndarray:
+        """Copy of the records between the epoch seconds start and end (inclusive), oldest first
+
+        The columns are filtered on the mapped file, only the matching records are copied.
+        """
+        parts = []
+        for first, last in self._segments():
+            records = self.records[first:last]
+            mask = np.ones(last - first, dtype=bool)
+            if start is not None:
+                mask &= records["time"] >= start
+            if end is not None:
+                mask &= records["time"] <= end
+            if accounts is not None:
+                mask &= np.isin(records["account"], accounts)
+            parts.append(records[mask])
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=RECORD)
+
+    def sync(self):
+        """Brings last up to date with the records appended by other workers"""
+        if self.synced == self.written:
+            return
+        records = self.window(self.synced)
+        self._track(records["account"], records["time"])
+        self.synced = self.written
+
+    def _track(self, accounts: np.ndarray, times: np.ndarray):
+        if not len(accounts):
+            return
+        size = int(accounts.max()) + 1
+        if size > len(self.last):
+            self.last = np.concatenate((self.last, np.full(size - len(self.last), -np.inf)))
+        np.maximum.at(self.last, accounts, times)
+
+    def append(self, accounts: np.ndarray, times: np.ndarray, values: np.ndarray) -> int:
+        self.sync()
+        last = np.full(len(accounts), -np.inf)
+        known = accounts < len(self.last)
+        last[known] = self.last[accounts[known]]
+        keep = ~np.isnan(values) & ~np.isnan(times) & (times > last)
+        accounts, times, values = accounts[keep], times[keep], values[keep]
+        if not len(accounts):
+            return 0
+        # oldest first, without the same point twice
+        order = np.lexsort((accounts, times))
+        accounts, times, values = accounts[order], times[order], values[order]
+        unique = np.ones(len(accounts), dtype=bool)
+        unique[1:] = (accounts[1:] != accounts[:-1]) | (times[1:] != times[:-1])
+        accounts, times, values = accounts[unique], times[unique], values[unique]
+        if len(accounts) > self.capacity:
+            accounts, times, values = accounts[-self.capacity:], times[-self.capacity:], values[-self.capacity:]
+
+        n = len(accounts)
+        written = self.written
+        positions = (written + np.arange(n)) % self.capacity
+        self.records["account"][positions] = accounts
+        self.records["time"][positions] = times
+        self.records["value"][positions] = values
+        self.records.flush()
+        # the count goes last, a reader never sees a slot before it is filled
+        self.header[3] = written + n
+        self.header.flush()
+        self._track(accounts, times)
+        self.synced = written + n
+        return n
+
+
+class MetricHistory:
+    """Fixed-size, memory-mapped history of the metric points collected, per account
+
+    Each metric and aggregation has a ring file of 'HistoryCapacity' records (default
+    2^20, 20 bytes each) of (account index, epoch seconds, value) under 'HistoryPath'
+    (default a folder in the temp directory), next to an accounts.json sidecar mapping
+    resource keys to account indices. Appends cost O(1) per point and overwrite the
+    oldest ones once the ring is full. Reads are vectorized over the mapped file, so
+    trends are computed from the points already collected, without calling
+    Azure Monitor again. Files are shared by the worker processes of a host and survive
+    restarts.
+    """
+
+    _default: Optional["MetricHistory"] = None
+    # serializes the appends of the worker threads, a file lock those of other processes
+    _lock = threading.Lock()
+
+    def __init__(self, path: str, capacity: int = 2**20) -> None:
+        self.path = path
+        self.capacity = capacity
+        os.makedirs(path, exist_ok=True)
+        self._rings: dict[tuple[str, str], _Ring] = {}
+        self._accounts: dict[str, int] = {}
+        self._accounts_mtime = None
+
+    @staticmethod
+    def default() -> "MetricHistory":
+        if MetricHistory._default is None:
+            MetricHistory._default = MetricHistory(
+                os.getenv("HistoryPath") or os.path.join(tempfile.gettempdir(), "blobnfsmonitoring", "history"),
+                capacity=int(os.getenv("HistoryCapacity", str(2**20)))
+            )
+        return MetricHistory._default
+
+    @contextmanager
+    def _locked(self):
+        with MetricHistory._lock, open(os.path.join(self.path, ".lock"), "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _ring(self, metric: str, aggregation: str) -> _Ring:
+        key = (metric, aggregation)
+        if key not in self._rings:
+            safe = re.sub(r"[^A-Za-z0-9_.-]", "_", f"{metric}.{aggregation}")
+            self._rings[key] = _Ring(os.path.join(self.path, f"{safe}.ring"), self.capacity)
+        return self._rings[key]
+
+    def _accounts_file(self) -> str:
+        return os.path.join(self.path, "accounts.json")
+
+    def _load_accounts(self):
+        try:
+            mtime = os.stat(self._accounts_file()).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._accounts_mtime:
+            with open(self._accounts_file(), "r") as f:
+                self._accounts = json.load(f)
+            self._accounts_mtime = mtime
+
+    def account_indices(self, keys: list[str], create: bool = False) -> np.ndarray:
+        """Index of each account key in the rings, -1 for unknown ones unless create is set"""
+        missing = [key for key in dict.fromkeys(keys) if key not in self._accounts]
+        if missing:
+            self._load_accounts()
+            missing = [key for key in missing if key not in self._accounts]
+        if missing and create:
+            with self._locked():
+                self._load_accounts()
+                for key in missing:
+                    self._accounts.setdefault(key, len(self._accounts))
+                fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+                with os.fdopen(fd, "w") as f:
+                    json.dump(self._accounts, f)
+                os.replace(tmp, self._accounts_file())
+                self._accounts_mtime = os.stat(self._accounts_file()).st_mtime_ns
+        return np.array([self._accounts.get(key, -1) for key in keys], dtype=np.int64)
+
+    def append(self, metric: str, aggregation: str, keys: list[str], times, values) -> int:
+        """Stores points of the given accounts, one (key, epoch seconds, value) per entry
+
+        Points that are not newer than the last one stored for the account are skipped,
+        so the overlapping windows of consecutive scrapes are stored once.
+
+        Returns:
+            the number of points stored.
+        """
+        if not len(keys):
+            return 0
+        accounts = self.account_indices(keys, create=True).astype(np.uint32)
+        with self._locked():
+            return self._ring(metric, aggregation).append(
+                accounts, np.asarray(times, dtype=float), np.asarray(values, dtype=float)
+            )
+
+    def read(
+        self,
+        metric: str,
+        aggregation: str,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        keys: Optional[list[str]] = None
+    ) -> np.ndarray:
+        """Stored records between the epoch seconds start and end (inclusive), oldest first
+
+        Returns:
+            structured array with the 'account', 'time' and 'value' of each point,
+            optionally only those of the given account keys.
+        """
+        accounts = None
+        if keys is not None:
+            indices = self.account_indices(keys)
+            accounts = indices[indices >= 0]
+        ring = self._ring(metric, aggregation)
+        # an append cannot wrap over the records while they are copied
+        with self._locked():
+            return ring.select(start, end, accounts)
+
+    def matrix(
+        self,
+        metric: str,
+        aggregation: str,
+        keys: list[str],
+        start: Optional[float] = None,
+        end: Optional[float] = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """(times, values) of the given accounts, in the layout of AnalyticsService.to_matrix
+
+        One row per key, right-aligned and padded with NaN, ready for fleet_stats.
+        """
+        indices = self.account_indices(keys)
+        records = self.read(metric, aggregation, start, end)
+        row_of = np.full(max(int(indices.max(initial=-1)), int(records["account"].max(initial=0))) + 1, -1)
+        known = indices >= 0
+        row_of[indices[known]] = np.arange(len(keys))[known]
+        rows = row_of[records["account"]] if len(records) else np.zeros(0, dtype=np.int64)
+        records, rows = records[rows >= 0], rows[rows >= 0]
+
+        order = np.lexsort((records["time"], rows))
+        records, rows = records[order], rows[order]
+        counts = np.bincount(rows, minlength=len(keys))
+        width = int(counts.max(initial=0))
+        times = np.full((len(keys), width), np.nan)
+        values = np.full((len(keys), width), np.nan)
+        if len(rows):
+            first = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            columns = width - counts[rows] + np.arange(len(rows)) - first[rows]
+            times[rows, columns] = records["time"]
+            values[rows, columns] = records["value"]
+        return times, values
+
+    def stats(self) -> dict:
+        return {
+            "accounts": len(self._accounts),
+            "series": {
+                f"{metric}/{aggregation}": {"points": min(ring.written, ring.capacity), "written": ring.written}
+                for (metric, aggregation), ring in self._rings.items()
+            }
+        }
@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import os
+import random
+from collections import defaultdict, deque
+from time import monotonic
+from typing import Any, Awaitable, Callable, Optional
+
+import aiohttp
+from azure.core.exceptions import HttpResponseError, ServiceRequestError, ServiceResponseError
+
+from shared_code.scheduler import RequestScheduler
+from shared_code.telemetry import Telemetry
+
+
+class LatencyTracker:
+    """Rolling per-endpoint latency window used to derive timeouts and hedging delays
+
+    Settings: 'LatencyWindow' (samples kept per endpoint), 'LatencyMinSamples' (samples
+    needed before the window is trusted), 'TimeoutP99Factor' and 'MinTimeoutSeconds'.
+    """
+
+    _default: Optional["LatencyTracker"] = None
+
+    def __init__(
+        self,
+        window: int = 500,
+        min_samples: int = 20,
+        p99_factor: float = 3.0,
+        min_timeout: float = 5.0
+    ) -> None:
+        self.min_samples = min_samples
+        self.p99_factor = p99_factor
+        self.min_timeout = min_timeout
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._stats = defaultdict(lambda: {"calls": 0, "timeouts": 0, "retries": 0, "hedges": 0, "hedge_wins": 0})
+
+    @staticmethod
+    def default() -> "LatencyTracker":
+        if LatencyTracker._default is None:
+            LatencyTracker._default = LatencyTracker(
+                window=int(os.getenv("LatencyWindow", "500")),
+                min_samples=int(os.getenv("LatencyMinSamples", "20")),
+                p99_factor=float(os.getenv("TimeoutP99Factor", "3")),
+                min_timeout=float(os.getenv("MinTimeoutSeconds", "5"))
+            )
+        return LatencyTracker._default
+
+    def record(self, endpoint: str, seconds: float):
+        self._samples[endpoint].append(seconds)
+
+    def quantile(self, endpoint: str, q: float) -> Optional[float]:
+        """Returns the q-quantile of the window, or None while there are too few samples"""
+        samples = self._samples.get(endpoint)
+        if samples is None or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def timeout(self, endpoint: str, upper: float) -> float:
+        """Timeout for the next call: a multiple of the rolling p99, bounded by upper"""
+        p99 = self.quantile(endpoint, 0.99)
+        if p99 is None:
+            return upper
+        return min(upper, max(self.min_timeout, p99 * self.p99_factor))
+
+    def stats(self) -> dict:
+        return {
+            endpoint: {
+                **counters,
+                "p50": self.quantile(endpoint, 0.50),
+                "p95": self.quantile(endpoint, 0.95),
+                "p99": self.quantile(endpoint, 0.99)
+            } for endpoint, counters in self._stats.items()
+        }
+
+
+def is_retryable(ex: Exception) -> bool:
+    """Timeouts, transport errors and 5xx responses are worth retrying, other errors are not"""
+    if isinstance(ex, (asyncio.TimeoutError, ServiceRequestError, ServiceResponseError)):
+        return True
+    if isinstance(ex, HttpResponseError):
+        return ex.status_code is None or ex.status_code >= 500
+    if isinstance(ex, aiohttp.ClientResponseError):
+        return ex.status >= 500
+    return isinstance(ex, aiohttp.ClientError)
+
+
+async def hedged_call(
+    endpoint: str,
+    call: Callable[[], Awaitable[Any]],
+    timeout: float,
+    retries: Optional[int] = None,
+    hedge: Optional[bool] = None,
+    backoff: Optional[float] = None,
+    tracker: Optional[LatencyTracker] = None,
+    scheduler: Optional[RequestScheduler] = None,
+    scope: Optional[str] = None
+) -> Any:
+    """Runs call() with a latency-aware timeout, optional hedging and jittered retries
+
+    Each request times out after a multiple of the endpoint's rolling p99 (bounded by
+    timeout). When hedging is on and the request is still pending at the rolling p95, a
+    duplicate request is sent and the first successful response wins. Retryable failures
+    are retried after a full-jitter exponential backoff.
+    With a scheduler, every request (the hedge too) runs as call(slot) in its own slot of
+    the scope, and the timeout, the hedge delay and the latency samples only cover the time
+    spent in the slot, not the wait for it nor the Retry-After pauses of the scheduler.
+    Settings: 'HedgeRequests', 'RequestRetries' and 'RetryBackoffSeconds'.
+    """
+    tracker = tracker or LatencyTracker.default()
+    if retries is None:
+        retries = int(os.getenv("RequestRetries", "2"))
+    if hedge is None:
+        hedge = os.getenv("HedgeRequests", "true").strip().lower() == "true"
+    if backoff is None:
+        backoff = float(os.getenv("RetryBackoffSeconds", "0.5"))
+
+    stats = tracker._stats[endpoint]
+    stats["calls"] += 1
+    telemetry = Telemetry.default()
+    attempt = 0
+    # the whole call is one 'request' stage, so its duration includes the retries
+    with telemetry.stage("request", endpoint=endpoint):
+        while True:
+            attempt_timeout = tracker.timeout(endpoint, timeout)
+            hedge_after = tracker.quantile(endpoint, 0.95) if hedge else None
+            try:
+                return await _attempt(endpoint, call, attempt_timeout, hedge_after, tracker, scheduler, scope)
+            except Exception as ex:
+                if isinstance(ex, asyncio.TimeoutError):
+                    stats["timeouts"] += 1
+                    telemetry.inc("blobnfs_self_request_timeouts", endpoint=endpoint)
+                    # count the timeout as a sample so slow endpoints get longer timeouts
+                    tracker.record(endpoint, attempt_timeout)
+                if attempt >= retries or not is_retryable(ex):
+                    raise
+                attempt += 1
+                stats["retries"] += 1
+                telemetry.inc("blobnfs_self_request_retries", endpoint=endpoint)
+                delay = random.uniform(0, backoff * 2 ** attempt)
+                logging.info(f"Retrying call to '{endpoint}' in {delay:.2f}s after: {ex!r}")
+                await asyncio.sleep(delay)
+
+
+async def _attempt(
+    endpoint: str,
+    call: Callable[..., Awaitable[Any]],
+    timeout: float,
+    hedge_after: Optional[float],
+    tracker: LatencyTracker,
+    scheduler: Optional[RequestScheduler] = None,
+    scope: Optional[str] = None
+) -> Any:
+    # time at which each request got its slot, the primary is 0
+    starts = {}
+    primary_started = asyncio.Event()
+
+    def request(index: int) -> asyncio.Future:
+        async def timed(*slot):
+            starts[index] = monotonic()
+            if index == 0:
+                primary_started.set()
+            result = await asyncio.wait_for(call(*slot), timeout)
+            return result, monotonic() - starts[index]
+
+        if scheduler is None:
+            return asyncio.ensure_future(timed())
+        return asyncio.ensure_future(scheduler.run(scope, timed))
+
+    primary = request(0)
+    tasks = [primary]
+    try:
+        if hedge_after is not None and hedge_after < timeout:
+            started = asyncio.ensure_future(primary_started.wait())
+            try:
+                await asyncio.wait([primary, started], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                started.cancel()
+            if not primary.done():
+                done, _ = await asyncio.wait(tasks, timeout=max(starts[0] + hedge_after - monotonic(), 0.0))
+                if not done:
+                    tracker._stats[endpoint]["hedges"] += 1
+                    Telemetry.default().inc("blobnfs_self_request_hedges", endpoint=endpoint)
+                    tasks.append(request(1))
+
+        error = None
+        while tasks:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                tasks.remove(task)
+                if task.exception() is None:
+                    result, seconds = task.result()
+                    tracker.record(endpoint, seconds)
+                    if task is not primary:
+                        tracker._stats[endpoint]["hedge_wins"] += 1
+                    return result
+                error = task.exception()
+        # every request of the attempt failed, surface the last error
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional
+
+from azure.durable_functions.models.Task import TaskState
+
+
+def fan_out(context, calls: list[Callable[[], Any]], width: int, deadline: Optional[datetime] = None):
+    """Orchestrator helper that runs durable tasks with at most width of them pending
+
+    Each element of calls creates one task (activity or sub-orchestration) when it is
+    its turn. Use it with 'yield from'. Tasks that fail (or return None, as the activities
+    do after logging their error), or are still pending when the deadline timer fires,
+    leave None in their slot instead of failing the orchestration.
+
+    Returns:
+        (results, failed, timed_out): the results in the order of calls, and the number
+        of failed and timed out tasks.
+    """
+    results = [None] * len(calls)
+    pending = {}
+    failed = 0
+    next_index = 0
+    timer = context.create_timer(deadline) if deadline is not None else None
+
+    while next_index < len(calls) or pending:
+        while next_index < len(calls) and len(pending) < max(width, 1):
+            pending[calls[next_index]()] = next_index
+            next_index += 1
+
+        done = [task for task in pending if task.is_completed]
+        if not done:
+            winner = yield context.task_any(list(pending) + ([timer] if timer is not None else []))
+            if winner is timer:
+                break
+            continue
+
+        for task in done:
+            index = pending.pop(task)
+            if task.state is TaskState.SUCCEEDED and task.result is not None:
+                results[index] = task.result
+            else:
+                failed += 1
+
+    timed_out = len(pending) + len(calls) - next_index
+    if timer is not None and not timer.is_completed:
+        timer.cancel()
+    return results, failed, timed_out
+
+
+def child_deadline(deadline: Optional[str], margin: float) -> Optional[datetime]:
+    """Deadline of the next level down, margin seconds before the parent's, so it reports first"""
+    if deadline is None:
+        return None
+    return datetime.fromisoformat(deadline) - timedelta(seconds=margin)
+
+
+def merge_summaries(summaries: list[Optional[dict]]) -> dict:
+    """Aggregates the summaries of the shards of one level
+
+    A shard summary has the metric record 'parts' of its activities and the counts of
+    'accounts', 'failed' and 'timed_out' tasks below it. Missing summaries (failed or
+    timed out shards) are expected to be counted by the caller.
+    """
+    merged = {"parts": [], "accounts": 0, "failed": 0, "timed_out": 0}
+    for summary in summaries:
+        if summary is None:
+            continue
+        merged["parts"].extend(summary["parts"])
+        for key in ("accounts", "failed", "timed_out"):
+            merged[key] += summary[key]
+    return merged
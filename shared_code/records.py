@@ -0,0 +1,271 @@
+import json
+import math
+import sys
+from array import array
+from functools import lru_cache
+from typing import Iterable, Iterator, Optional, Union
+
+from shared_code.wire import ACCOUNT_FIELDS, decode_columns, encode_columns
+
+RECORDS_VERSION = 1
+
+
+@lru_cache(maxsize=2**17)
+def resource_key(resource_id: str) -> str:
+    """Lower-cased resource ID used to key an account, interned and cached per ID"""
+    return sys.intern(resource_id.lower())
+
+
+class AccountRecord:
+    """View of one account of an AccountTable, read like the row dictionary it replaces"""
+
+    __slots__ = ("table", "index")
+
+    def __init__(self, table: "AccountTable", index: int) -> None:
+        self.table = table
+        self.index = index
+
+    def __getitem__(self, key: str):
+        return self.table.value(self.index, key)
+
+    def get(self, key: str, default=None):
+        try:
+            return self.table.value(self.index, key)
+        except KeyError:
+            return default
+
+
+class AccountTable:
+    """Column store of a batch of accounts and of their latest metric values
+
+    Account fields are lists of interned strings, so the thousands of accounts of a
+    subscription, region or customer share a single string for it. Each (metric,
+    aggregation) is an array of doubles and each (metric, aggregation, statistic) of the
+    analytics another one, NaN marking a missing value, instead of nested dictionaries
+    per account. Records stay readable by index (table[i]["Storageaccountname"]) and
+    to_rows gives back the record dictionaries of the JSON output. times holds the epoch
+    seconds of the newest point of each account, NaN if unknown.
+    """
+
+    __slots__ = ("fields", "columns", "values", "analytics", "stale", "times", "with_analytics")
+
+    def __init__(self, columns: dict[str, list], fields: Iterable[str] = ACCOUNT_FIELDS) -> None:
+        self.fields = tuple(fields)
+        n = len(next(iter(columns.values()), []))
+        self.columns = {field: columns.get(field, [None] * n) for field in self.fields}
+        self.values: dict[tuple, array] = {}
+        self.analytics: dict[tuple, array] = {}
+        self.stale = bytearray(n)
+        self.times = array("d", [math.nan]) * n
+        # whether the records carry an 'analytics' key, even a None one
+        self.with_analytics = False
+
+    @staticmethod
+    def from_rows(rows: Iterable[dict], fields: Iterable[str] = ACCOUNT_FIELDS) -> "AccountTable":
+        """Table of row dictionaries, with their 'metrics', 'analytics' and 'stale' if any"""
+        rows = list(rows)
+        fields = tuple(fields)
+        table = AccountTable({
+            field: [sys.intern(value) if isinstance(value, str) else value for value in (row.get(field) for row in rows)]
+            for field in fields
+        }, fields)
+        for index, row in enumerate(rows):
+            table.set_metrics(index, row.get("metrics"))
+            if "analytics" in row:
+                table.with_analytics = True
+                table.set_analytics(index, row["analytics"])
+            if row.get("stale"):
+                table.stale[index] = 1
+        return table
+
+    @staticmethod
+    def from_wire(payload: Optional[Union[dict, list]]) -> "AccountTable":
+        """Table of a compact wire payload (see shared_code.wire), plain lists of rows are accepted too"""
+        if payload is None:
+            return AccountTable({field: [] for field in ACCOUNT_FIELDS})
+        if isinstance(payload, list):
+            return AccountTable.from_rows(payload)
+        n, columns = decode_columns(payload)
+        return AccountTable({field: columns.get(field, [None] * n) for field in ACCOUNT_FIELDS})
+
+    def to_wire(self) -> dict:
+        return encode_columns(self.columns, len(self))
+
+    def __len__(self) -> int:
+        return len(self.stale)
+
+    def __getitem__(self, index: int) -> AccountRecord:
+        if not -len(self) <= index < len(self):
+            raise IndexError(index)
+        return AccountRecord(self, index % len(self) if index < 0 else index)
+
+    def __iter__(self) -> Iterator[AccountRecord]:
+        return (AccountRecord(self, index) for index in range(len(self)))
+
+    def value(self, index: int, key: str):
+        if key in self.columns:
+            return self.columns[key][index]
+        if key == "metrics":
+            return self.metrics(index)
+        if key == "analytics" and self.with_analytics:
+            return self.analytics_of(index)
+        if key == "stale" and self.stale[index]:
+            return True
+        raise KeyError(key)
+
+    def take(self, indices: list[int]) -> "AccountTable":
+        """Table of the given accounts, in that order, sharing the strings of this one"""
+        table = AccountTable({field: [column[i] for i in indices] for field, column in self.columns.items()}, self.fields)
+        for key, column in self.values.items():
+            table.values[key] = array("d", (column[i] for i in indices))
+        for key, column in self.analytics.items():
+            table.analytics[key] = array("d", (column[i] for i in indices))
+        table.stale = bytearray(self.stale[i] for i in indices)
+        table.times = array("d", (self.times[i] for i in indices))
+        table.with_analytics = self.with_analytics
+        return table
+
+    def assign(self, indices: list[int], source: "AccountTable"):
+        """Replaces the values of the given accounts by those of the rows of source, in order
+
+        E.g. table.assign(due, fetched) with fetched the result of table.take(due) once
+        its metrics were fetched. Values the source does not have are cleared.
+        """
+        for target, columns in ((self.values, source.values), (self.analytics, source.analytics)):
+            for key, column in target.items():
+                if key not in columns:
+                    for i in indices:
+                        column[i] = math.nan
+            for key, column in columns.items():
+                column_target = self._column(target, key)
+                for row, i in enumerate(indices):
+                    column_target[i] = column[row]
+        for row, i in enumerate(indices):
+            self.stale[i] = source.stale[row]
+            self.times[i] = source.times[row]
+        self.with_analytics = self.with_analytics or source.with_analytics
+
+    @staticmethod
+    def concat(tables: list["AccountTable"]) -> "AccountTable":
+        """One table of the accounts of every table, e.g. of the parts of a scrape
+
+        Metric columns keep the order in which the accounts first have them, as if the
+        accounts had been added one by one.
+        """
+        fields = tables[0].fields if tables else ACCOUNT_FIELDS
+        table = AccountTable({field: [value for part in tables for value in part.columns[field]] for field in fields}, fields)
+        offset = 0
+        for part in tables:
+            for source, target in ((part.values, table.values), (part.analytics, table.analytics)):
+                for key, column in source.items():
+                    if key not in target:
+                        target[key] = array("d", [math.nan]) * len(table)
+                    target[key][offset:offset + len(part)] = column
+            table.stale[offset:offset + len(part)] = part.stale
+            table.times[offset:offset + len(part)] = part.times
+            table.with_analytics = table.with_analytics or part.with_analytics
+            offset += len(part)
+        return table
+
+    def _column(self, columns: dict, key: tuple) -> array:
+        column = columns.get(key)
+        if column is None:
+            column = columns[key] = array("d", [math.nan]) * len(self)
+        return column
+
+    def set_metrics(self, index: int, metrics: Optional[dict]):
+        """Stores {metric: {aggregation: value}} of an account, None values are left missing
+
+        The column of a None value is created all the same, its family is known.
+        """
+        for name, aggregations in (metrics or {}).items():
+            for aggregation, value in aggregations.items():
+                column = self._column(self.values, (name, aggregation))
+                if value is not None:
+                    column[index] = value
+
+    def metrics(self, index: int) -> Optional[dict]:
+        """{metric: {aggregation: value}} of an account, None when it has no value at all"""
+        output = {}
+        for (name, aggregation), column in self.values.items():
+            value = column[index]
+            if value == value:
+                output.setdefault(name, {})[aggregation] = value
+        return output or None
+
+    def set_analytics(self, index: int, analytics: Optional[dict]):
+        for name, aggregations in (analytics or {}).items():
+            for aggregation, stats in aggregations.items():
+                for stat, value in stats.items():
+                    column = self._column(self.analytics, (name, aggregation, stat))
+                    if value is not None:
+                        column[index] = value
+
+    def analytics_of(self, index: int) -> Optional[dict]:
+        output = {}
+        for (name, aggregation, stat), column in self.analytics.items():
+            value = column[index]
+            if value == value:
+                output.setdefault(name, {}).setdefault(aggregation, {})[stat] = value
+        return output or None
+
+    def missing(self) -> int:
+        """Number of accounts without any metric value"""
+        present = bytearray(len(self))
+        for column in self.values.values():
+            for index, value in enumerate(column):
+                if value == value:
+                    present[index] = 1
+        return len(self) - sum(present)
+
+    def extras(self, index: int) -> dict:
+        """Keys the metric fetch adds to an account row: metrics, analytics and stale"""
+        extras = {"metrics": self.metrics(index)}
+        if self.with_analytics:
+            extras["analytics"] = self.analytics_of(index)
+        if self.stale[index]:
+            extras["stale"] = True
+        return extras
+
+    def to_rows(self) -> list[dict]:
+        """Record dictionaries of the accounts, as the JSON output has them"""
+        return [
+            {**{field: column[index] for field, column in self.columns.items()}, **self.extras(index)}
+            for index in range(len(self))
+        ]
+
+    def json_chunks(self) -> Iterator[str]:
+        """Serializes the table by column: accounts in the wire schema, values with null for NaN"""
+        def column(values: array) -> list:
+            return [value if value == value else None for value in values]
+
+        yield json.dumps({
+            "v": RECORDS_VERSION,
+            "accounts": self.to_wire(),
+            "values": [[*key, column(values)] for key, values in self.values.items()],
+            "analytics": [[*key, column(values)] for key, values in self.analytics.items()],
+            "with_analytics": self.with_analytics,
+            "stale": [index for index, flag in enumerate(self.stale) if flag],
+            "times": column(self.times)
+        }, separators=(",", ":"))
+
+    @staticmethod
+    def from_json(text: Union[str, bytes]) -> "AccountTable":
+        """Table of json_chunks output, or of a JSON array of record dictionaries"""
+        data = json.loads(text)
+        if isinstance(data, list):
+            return AccountTable.from_rows(data)
+        if data.get("v") != RECORDS_VERSION:
+            raise ValueError(f"Unsupported records version {data.get('v')}")
+        table = AccountTable.from_wire(data["accounts"])
+        nan = math.nan
+        for *key, values in data["values"]:
+            table.values[tuple(key)] = array("d", (nan if value is None else value for value in values))
+        for *key, values in data["analytics"]:
+            table.analytics[tuple(key)] = array("d", (nan if value is None else value for value in values))
+        table.with_analytics = data["with_analytics"]
+        for index in data["stale"]:
+            table.stale[index] = 1
+        if "times" in data:
+            table.times = array("d", (nan if value is None else value for value in data["times"]))
+        return table
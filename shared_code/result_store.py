@@ -0,0 +1,224 @@
+import asyncio
+import base64
+import os
+import random
+import re
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from time import time
+from typing import Callable, Iterable, Optional
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from azure.storage.blob import BlobBlock
+from azure.storage.blob.aio import BlobServiceClient
+
+# size of the blocks staged while streaming a blob
+BLOB_BLOCK_SIZE = 4 * 2**20
+# attempts of update before giving up when other writers keep changing the object
+UPDATE_ATTEMPTS = 10
+
+
+class ResultStore(ABC):
+    """Store for the artifacts of a scrape (metric records, exposition text)
+
+    Objects are addressed by a '/' separated name, usually prefixed with the scrape ID,
+    and written from an iterable of text chunks so they never have to be built in memory.
+    """
+
+    @abstractmethod
+    async def write(self, name: str, chunks: Iterable[str]) -> int:
+        """Writes the chunks as one object, returns the number of bytes written"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def read(self, name: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def update(self, name: str, update: Callable[[Optional[bytes]], str]) -> int:
+        """Replaces the object with update(current content, None if missing) unless another
+        writer changed it in between, in which case update is called again on its content.
+        Returns the number of bytes written.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def prune(self, max_age: float):
+        """Deletes the objects older than max_age seconds"""
+        raise NotImplementedError
+
+
+class LocalResultStore(ResultStore):
+    """Result store backed by files in a local directory"""
+
+    # serializes the read-modify-write cycles of update
+    _lock = threading.Lock()
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, name: str) -> str:
+        parts = [re.sub(r"[^A-Za-z0-9_.-]", "_", part) for part in name.split("/") if part]
+        return os.path.join(self.path, *parts)
+
+    def _write(self, name: str, chunks: Iterable[str]) -> int:
+        target = self._file(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                data = chunk.encode()
+                f.write(data)
+                size += len(data)
+        os.replace(tmp, target)
+        return size
+
+    def _read(self, name: str) -> Optional[bytes]:
+        try:
+            with open(self._file(name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _update(self, name: str, update: Callable[[Optional[bytes]], str]) -> int:
+        with LocalResultStore._lock:
+            return self._write(name, [update(self._read(name))])
+
+    def _prune(self, max_age: float):
+        cutoff = time() - max_age
+        for root, dirs, files in os.walk(self.path, topdown=False):
+            for file in files:
+                path = os.path.join(root, file)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+            if root != self.path and not os.listdir(root):
+                os.rmdir(root)
+
+    async def write(self, name: str, chunks: Iterable[str]) -> int:
+        return await asyncio.to_thread(self._write, name, chunks)
+
+    async def read(self, name: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._read, name)
+
+    async def update(self, name: str, update: Callable[[Optional[bytes]], str]) -> int:
+        return await asyncio.to_thread(self._update, name, update)
+
+    async def prune(self, max_age: float):
+        await asyncio.to_thread(self._prune, max_age)
+
+
+class BlobResultStore(ResultStore):
+    """Result store backed by an Azure Storage blob container (or Azurite)
+
+    Objects are block blobs, staged in BLOB_BLOCK_SIZE blocks as the chunks come in.
+    """
+
+    def __init__(self, container: str, connection_string: str) -> None:
+        self.container = container
+        self.connection_string = connection_string
+        self._created = False
+
+    async def _container(self, service: BlobServiceClient):
+        container = service.get_container_client(self.container)
+        if not self._created:
+            try:
+                await container.create_container()
+            except ResourceExistsError:
+                pass
+            self._created = True
+        return container
+
+    async def write(self, name: str, chunks: Iterable[str]) -> int:
+        async with BlobServiceClient.from_connection_string(self.connection_string) as service:
+            blob = (await self._container(service)).get_blob_client(name)
+            blocks = []
+            buffer = bytearray()
+            size = 0
+
+            async def stage():
+                block_id = base64.b64encode(f"{len(blocks):08d}".encode()).decode()
+                await blob.stage_block(block_id, bytes(buffer))
+                blocks.append(BlobBlock(block_id=block_id))
+                buffer.clear()
+
+            for chunk in chunks:
+                data = chunk.encode()
+                buffer.extend(data)
+                size += len(data)
+                if len(buffer) >= BLOB_BLOCK_SIZE:
+                    await stage()
+            if buffer or not blocks:
+                await stage()
+            await blob.commit_block_list(blocks)
+        return size
+
+    async def read(self, name: str) -> Optional[bytes]:
+        async with BlobServiceClient.from_connection_string(self.connection_string) as service:
+            blob = (await self._container(service)).get_blob_client(name)
+            try:
+                downloader = await blob.download_blob()
+            except ResourceNotFoundError:
+                return None
+            return await downloader.readall()
+
+    async def update(self, name: str, update: Callable[[Optional[bytes]], str]) -> int:
+        # conditional on the ETag read, or on the blob still missing, a 409/412 means another writer won
+        async with BlobServiceClient.from_connection_string(self.connection_string) as service:
+            blob = (await self._container(service)).get_blob_client(name)
+            attempt = 0
+            while True:
+                try:
+                    downloader = await blob.download_blob()
+                    current = await downloader.readall()
+                    condition = {"etag": downloader.properties.etag, "match_condition": MatchConditions.IfNotModified}
+                except ResourceNotFoundError:
+                    current = None
+                    condition = {"match_condition": MatchConditions.IfMissing}
+                data = update(current).encode()
+                try:
+                    await blob.upload_blob(data, overwrite=True, **condition)
+                    return len(data)
+                except (ResourceModifiedError, ResourceExistsError):
+                    attempt += 1
+                    if attempt >= UPDATE_ATTEMPTS:
+                        raise
+                    await asyncio.sleep(random.uniform(0, 0.1 * attempt))
+
+    async def prune(self, max_age: float):
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=max_age)
+        async with BlobServiceClient.from_connection_string(self.connection_string) as service:
+            container = await self._container(service)
+            async for blob in container.list_blobs():
+                if blob.last_modified < cutoff:
+                    try:
+                        await container.delete_blob(blob.name)
+                    except ResourceNotFoundError:
+                        pass
+
+
+def get_result_store() -> ResultStore:
+    """Returns the configured result store
+
+    'ResultStoreBackend' selects 'blob' (the default; container in 'ResultStoreContainer',
+    connection string in 'ResultStoreConnection', or 'AzureWebJobsStorage') or 'local'
+    (directory in 'ResultStorePath', default a folder in the temp directory). The activities,
+    the collector and the scrape endpoint may run on different instances of the app, so
+    the local backend only suits a single process, such as the benchmarks.
+    """
+    backend = os.getenv("ResultStoreBackend", "blob").strip().lower()
+    if backend == "blob":
+        connection = os.getenv("ResultStoreConnection") or os.getenv("AzureWebJobsStorage")
+        if not connection:
+            raise KeyError("No connection string configured for the blob result store")
+        return BlobResultStore(os.getenv("ResultStoreContainer", "blobnfs-results"), connection)
+
+    path = os.getenv("ResultStorePath") or os.path.join(tempfile.gettempdir(), "blobnfsmonitoring", "results")
+    return LocalResultStore(path)
@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import os
+import random
+from email.utils import parsedate_to_datetime
+from time import monotonic, time
+from typing import Any, Awaitable, Callable, Optional
+
+import aiohttp
+from azure.core.exceptions import HttpResponseError
+
+from shared_code.telemetry import Telemetry
+
+# ARM and Resource Graph headers that report the remaining request quota
+REMAINING_HEADERS = (
+    "x-ms-ratelimit-remaining-subscription-reads",
+    "x-ms-ratelimit-remaining-subscription-global-reads",
+    "x-ms-ratelimit-remaining-tenant-reads",
+    "x-ms-user-quota-remaining"
+)
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """Returns the number of seconds requested by a Retry-After (or Resource Graph reset) header"""
+    if headers is None:
+        return None
+
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    if value:
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            try:
+                return max(parsedate_to_datetime(value).timestamp() - time(), 0.0)
+            except Exception:
+                return None
+
+    # Resource Graph reports its quota window as hh:mm:ss
+    value = headers.get("x-ms-user-quota-resets-after")
+    if value and headers.get("x-ms-user-quota-remaining") == "0":
+        try:
+            hours, minutes, seconds = value.split(":")
+            return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+        except ValueError:
+            return None
+
+    return None
+
+
+def parse_remaining(headers) -> Optional[int]:
+    """Returns the lowest remaining quota reported by the response headers"""
+    if headers is None:
+        return None
+
+    remaining = None
+    for header in REMAINING_HEADERS:
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            value = int(value)
+        except ValueError:
+            continue
+        remaining = value if remaining is None else min(remaining, value)
+    return remaining
+
+
+class TokenBucket:
+    """Token bucket that spaces out the requests sent to a single throttling scope"""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = monotonic()
+        self._paused_until = 0.0
+
+    def pause(self, seconds: float):
+        """Blocks the bucket for the given seconds, e.g. after a Retry-After"""
+        self._paused_until = max(self._paused_until, monotonic() + seconds)
+
+    async def acquire(self):
+        while True:
+            now = monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class Slot:
+    """Handle given to a scheduled call to report the response it received"""
+
+    def __init__(self, scheduler: "RequestScheduler", scope: str) -> None:
+        self._scheduler = scheduler
+        self.scope = scope
+        self.status: Optional[int] = None
+        self.headers = None
+        # bytes of the response body, from Content-Length unless the caller measured it
+        self.size: Optional[int] = None
+
+    def observe(self, status: int, headers):
+        self.status = status
+        self.headers = headers
+        length = headers.get("Content-Length") if headers is not None else None
+        if length is not None and length.isdigit():
+            self.size = int(length)
+
+    def response_hook(self, pipeline_response):
+        """azure-core 'raw_response_hook' that records the status and headers of the response"""
+        response = pipeline_response.http_response
+        self.observe(response.status_code, response.headers)
+
+
+class RequestScheduler:
+    """Bounded, throttle-aware scheduler for the Azure management and metrics calls
+
+    Calls are started lazily when a concurrency slot is free, so the number of requests
+    in flight never exceeds the current limit. The limit follows AIMD: it grows additively
+    while ARM reports spare quota and is cut multiplicatively on a 429 or when the
+    x-ms-ratelimit-remaining-* headers run low. Each scope (a subscription, or a credential
+    key for tenant-level APIs) also has its own token bucket, paused for the Retry-After
+    period when throttled. Settings: 'SchedulerMinConcurrency', 'SchedulerMaxConcurrency',
+    'SchedulerInitialConcurrency', 'SchedulerRatePerSecond', 'SchedulerBurst',
+    'SchedulerLowQuota' and 'SchedulerMaxRetries'.
+    """
+
+    _default: Optional["RequestScheduler"] = None
+
+    def __init__(
+        self,
+        min_concurrency: int = 1,
+        max_concurrency: int = 32,
+        initial_concurrency: int = 8,
+        rate: float = 20.0,
+        burst: float = 100.0,
+        low_quota: int = 100,
+        max_retries: int = 3,
+        decrease_factor: float = 0.5
+    ) -> None:
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.limit = float(min(max(initial_concurrency, min_concurrency), max_concurrency))
+        self.rate = rate
+        self.burst = burst
+        self.low_quota = low_quota
+        self.max_retries = max_retries
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self._buckets: dict[str, TokenBucket] = {}
+        self._condition: Optional[asyncio.Condition] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._last_decrease = 0.0
+        self._stats = {"requests": 0, "throttled": 0, "retries": 0}
+
+    @staticmethod
+    def default() -> "RequestScheduler":
+        """Returns the process-wide scheduler built from the settings"""
+        if RequestScheduler._default is None:
+            RequestScheduler._default = RequestScheduler(
+                min_concurrency=int(os.getenv("SchedulerMinConcurrency", "1")),
+                max_concurrency=int(os.getenv("SchedulerMaxConcurrency", "32")),
+                initial_concurrency=int(os.getenv("SchedulerInitialConcurrency", "8")),
+                rate=float(os.getenv("SchedulerRatePerSecond", "20")),
+                burst=float(os.getenv("SchedulerBurst", "100")),
+                low_quota=int(os.getenv("SchedulerLowQuota", "100")),
+                max_retries=int(os.getenv("SchedulerMaxRetries", "3"))
+            )
+        return RequestScheduler._default
+
+    async def run(self, scope: str, call: Callable[[Slot], Awaitable[Any]]) -> Any:
+        """Runs call(slot) once a slot and a scope token are available
+
+        Throttled calls (HTTP 429) are retried up to max_retries times after the
+        Retry-After period. Any other error is raised to the caller.
+        """
+        attempt = 0
+        while True:
+            await self._bucket(scope).acquire()
+            await self._acquire()
+            slot = Slot(self, scope)
+            try:
+                self._stats["requests"] += 1
+                Telemetry.default().inc("blobnfs_self_requests")
+                result = await call(slot)
+                self._on_response(slot)
+                return result
+            except (HttpResponseError, aiohttp.ClientResponseError) as ex:
+                status, headers = self._error_details(ex)
+                if status != 429:
+                    raise
+                self._on_throttled(scope, headers)
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self._stats["retries"] += 1
+            finally:
+                await self._release()
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "concurrency_limit": self.limit,
+            "in_flight": self.in_flight
+        }
+
+    def _bucket(self, scope: str) -> TokenBucket:
+        if scope not in self._buckets:
+            self._buckets[scope] = TokenBucket(self.rate, self.burst)
+        return self._buckets[scope]
+
+    def _get_condition(self) -> asyncio.Condition:
+        loop = asyncio.get_running_loop()
+        if self._condition is None or self._loop is not loop:
+            self._condition = asyncio.Condition()
+            self._loop = loop
+            self.in_flight = 0
+        return self._condition
+
+    async def _acquire(self):
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def _release(self):
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight = max(self.in_flight - 1, 0)
+            condition.notify_all()
+
+    def _on_response(self, slot: Slot):
+        if slot.size:
+            Telemetry.default().inc("blobnfs_self_response_bytes", slot.size)
+        remaining = parse_remaining(slot.headers)
+        if remaining is not None and remaining < self.low_quota:
+            self._decrease()
+            if remaining <= 0:
+                retry_after = parse_retry_after(slot.headers)
+                if retry_after:
+                    self._bucket(slot.scope).pause(retry_after)
+        else:
+            self._increase()
+
+    def _on_throttled(self, scope: str, headers):
+        self._stats["throttled"] += 1
+        Telemetry.default().inc("blobnfs_self_throttled")
+        retry_after = parse_retry_after(headers)
+        if retry_after is None:
+            retry_after = 1.0 + random.random()
+        logging.warning(f"Throttled on scope '{scope}', waiting {retry_after:.1f}s")
+        self._bucket(scope).pause(retry_after)
+        self._decrease()
+
+    def _increase(self):
+        # additive increase: roughly +1 slot once a full window of calls succeeded
+        self.limit = min(self.max_concurrency, self.limit + 1.0 / max(self.limit, 1.0))
+
+    def _decrease(self):
+        # multiplicative decrease, at most once per second so a burst of 429s counts once
+        now = monotonic()
+        if now - self._last_decrease < 1.0:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_concurrency, self.limit * self.decrease_factor)
+
+    @staticmethod
+    def _error_details(ex: Exception):
+        if isinstance(ex, HttpResponseError):
+            response = ex.response
+            return ex.status_code, (response.headers if response is not None else None)
+        return ex.status, ex.headers
@@ -0,0 +1,231 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from azure.data.tables import TransactionOperation
+from azure.data.tables.aio import TableServiceClient
+
+# maximum number of operations accepted by a single table transaction
+TABLE_BATCH_SIZE = 100
+# row keys per query of get_many, a table filter accepts at most 15 comparisons
+TABLE_QUERY_KEYS = 14
+
+
+class StateStore(ABC):
+    """Small key/value store for state that must survive between scrapes
+
+    Values are JSON-serializable dictionaries grouped in partitions.
+    """
+
+    @abstractmethod
+    async def get(self, partition: str, key: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_all(self, partition: str) -> dict[str, dict]:
+        raise NotImplementedError
+
+    async def get_many(self, partition: str, keys: list[str]) -> dict[str, dict]:
+        """Values of the given keys that exist in the partition"""
+        wanted = set(keys)
+        return {key: value for key, value in (await self.get_all(partition)).items() if key in wanted}
+
+    async def put(self, partition: str, key: str, value: dict):
+        await self.put_many(partition, {key: value})
+
+    @abstractmethod
+    async def put_many(self, partition: str, items: dict[str, dict]):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_many(self, partition: str, keys: list[str]):
+        raise NotImplementedError
+
+    async def replace(self, partition: str, items: dict[str, dict]):
+        """Replaces the whole content of the partition"""
+        existing = await self.get_all(partition)
+        stale = [key for key in existing if key not in items]
+        if stale:
+            await self.delete_many(partition, stale)
+        await self.put_many(partition, items)
+
+
+class LocalStateStore(StateStore):
+    """State store backed by one JSON file per partition in a local directory"""
+
+    # serializes the read-modify-write cycles of the worker threads
+    _lock = threading.Lock()
+
+    def __init__(self, name: str, path: str) -> None:
+        self.path = os.path.join(path, name)
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, partition: str) -> str:
+        safe = re.sub(r"[^A-Za-z0-9_.-]", "_", partition)
+        return os.path.join(self.path, f"{safe}.json")
+
+    def _read(self, partition: str) -> dict:
+        try:
+            with open(self._file(partition), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as ex:
+            logging.warning(f"Discarding unreadable state file for '{partition}': {ex}")
+            return {}
+
+    def _write(self, partition: str, content: dict):
+        target = self._file(partition)
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(content, f)
+        os.replace(tmp, target)
+
+    def _update(self, partition: str, items: dict, deleted: list):
+        with LocalStateStore._lock:
+            content = self._read(partition)
+            content.update(items)
+            for key in deleted:
+                content.pop(key, None)
+            self._write(partition, content)
+
+    async def get(self, partition: str, key: str) -> Optional[dict]:
+        return (await self.get_all(partition)).get(key)
+
+    async def get_all(self, partition: str) -> dict[str, dict]:
+        return await asyncio.to_thread(self._read, partition)
+
+    async def put_many(self, partition: str, items: dict[str, dict]):
+        await asyncio.to_thread(self._update, partition, items, [])
+
+    async def delete_many(self, partition: str, keys: list[str]):
+        await asyncio.to_thread(self._update, partition, {}, keys)
+
+    async def replace(self, partition: str, items: dict[str, dict]):
+        await asyncio.to_thread(self._update_all, partition, dict(items))
+
+    def _update_all(self, partition: str, content: dict):
+        with LocalStateStore._lock:
+            self._write(partition, content)
+
+
+class TableStateStore(StateStore):
+    """State store backed by an Azure Storage table (or Azurite)
+
+    Each value is one entity: the partition is the PartitionKey, the RowKey is a hash of
+    the key (table keys cannot contain '/'), and the payload is kept as a JSON string.
+    """
+
+    def __init__(self, name: str, connection_string: str) -> None:
+        self.table_name = re.sub(r"[^A-Za-z0-9]", "", name)
+        self.connection_string = connection_string
+        self._created = False
+
+    @staticmethod
+    def _row_key(key: str) -> str:
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    async def _table(self, service: TableServiceClient):
+        table = service.get_table_client(self.table_name)
+        if not self._created:
+            try:
+                await table.create_table()
+            except ResourceExistsError:
+                pass
+            self._created = True
+        return table
+
+    async def get(self, partition: str, key: str) -> Optional[dict]:
+        async with TableServiceClient.from_connection_string(self.connection_string) as service:
+            table = await self._table(service)
+            try:
+                entity = await table.get_entity(partition, self._row_key(key))
+            except ResourceNotFoundError:
+                return None
+        return json.loads(entity["value"])
+
+    async def get_all(self, partition: str) -> dict[str, dict]:
+        result = {}
+        async with TableServiceClient.from_connection_string(self.connection_string) as service:
+            table = await self._table(service)
+            entities = table.query_entities(
+                "PartitionKey eq @partition",
+                parameters={"partition": partition}
+            )
+            async for entity in entities:
+                result[entity["key"]] = json.loads(entity["value"])
+        return result
+
+    async def get_many(self, partition: str, keys: list[str]) -> dict[str, dict]:
+        row_keys = list(dict.fromkeys(self._row_key(key) for key in keys))
+        result = {}
+        async with TableServiceClient.from_connection_string(self.connection_string) as service:
+            table = await self._table(service)
+
+            async def query(chunk: list[str]):
+                parameters = {"partition": partition, **{f"r{i}": row_key for i, row_key in enumerate(chunk)}}
+                rows = " or ".join(f"RowKey eq @r{i}" for i in range(len(chunk)))
+                async for entity in table.query_entities(f"PartitionKey eq @partition and ({rows})", parameters=parameters):
+                    result[entity["key"]] = json.loads(entity["value"])
+
+            await asyncio.gather(*(
+                query(row_keys[i:i + TABLE_QUERY_KEYS]) for i in range(0, len(row_keys), TABLE_QUERY_KEYS)
+            ))
+        return result
+
+    async def put_many(self, partition: str, items: dict[str, dict]):
+        operations = [
+            (
+                TransactionOperation.UPSERT,
+                {
+                    "PartitionKey": partition,
+                    "RowKey": self._row_key(key),
+                    "key": key,
+                    "value": json.dumps(value)
+                }
+            ) for key, value in items.items()
+        ]
+        await self._submit(operations)
+
+    async def delete_many(self, partition: str, keys: list[str]):
+        operations = [
+            (
+                TransactionOperation.DELETE,
+                {"PartitionKey": partition, "RowKey": self._row_key(key)}
+            ) for key in keys
+        ]
+        await self._submit(operations)
+
+    async def _submit(self, operations: list):
+        if not operations:
+            return
+        async with TableServiceClient.from_connection_string(self.connection_string) as service:
+            table = await self._table(service)
+            for i in range(0, len(operations), TABLE_BATCH_SIZE):
+                await table.submit_transaction(operations[i:i + TABLE_BATCH_SIZE])
+
+
+def get_state_store(name: str) -> StateStore:
+    """Returns the configured state store for the given name
+
+    'StateStoreBackend' selects 'table' (connection string in 'StateStoreConnection',
+    or 'AzureWebJobsStorage') or 'local' (directory in 'StateStorePath', default a
+    folder in the temp directory).
+    """
+    backend = os.getenv("StateStoreBackend", "local").strip().lower()
+    if backend == "table":
+        connection = os.getenv("StateStoreConnection") or os.getenv("AzureWebJobsStorage")
+        if not connection:
+            raise KeyError("No connection string configured for the table state store")
+        return TableStateStore(name, connection)
+
+    path = os.getenv("StateStorePath") or os.path.join(tempfile.gettempdir(), "blobnfsmonitoring")
+    return LocalStateStore(name, path)
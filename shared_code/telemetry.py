@@ -0,0 +1,168 @@
+import importlib
+import json
+import logging
+import os
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+from typing import Callable, ContextManager, Optional
+
+# upper bounds (seconds) of the latency histogram buckets, +Inf is implied
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# result store object with the running totals of the self-instrumentation counters and histograms
+TOTALS_NAME = "self/telemetry.json"
+
+# help text of the self-instrumentation families, without the _total suffix of counters
+DESCRIPTIONS = {
+    "blobnfs_self_stage_seconds": "Duration of each stage of the collection pipeline and of the Azure API calls",
+    "blobnfs_self_stage_errors": "Stages of the collection pipeline that raised an error",
+    "blobnfs_self_request_retries": "Azure API calls retried after a timeout or a transient error",
+    "blobnfs_self_request_timeouts": "Azure API call attempts that timed out",
+    "blobnfs_self_request_hedges": "Duplicate requests sent for slow Azure API calls",
+    "blobnfs_self_requests": "Azure API requests sent by the request scheduler",
+    "blobnfs_self_throttled": "Azure API requests throttled with HTTP 429",
+    "blobnfs_self_response_bytes": "Bytes received in the Azure API responses",
+    "blobnfs_self_pushed_samples": "Samples pushed to the Pushgateway or remote-write endpoint",
+    "blobnfs_self_breaker_state": "Circuit breaker state of each scope: 0 closed, 1 half-open, 2 open",
+    "blobnfs_self_breaker_opened": "Times the circuit breaker of each scope opened",
+    "blobnfs_self_breaker_rejected": "Calls rejected without a request while the breaker of the scope was open",
+    "blobnfs_self_collector_refreshed": "Accounts refreshed by the continuous collector",
+    "blobnfs_self_collector_overdue": "Accounts past their due time after the last collector tick"
+}
+
+
+class Telemetry:
+    """Counters and latency histograms of the collection pipeline itself
+
+    Every activity records into the process-wide instance and hands a snapshot of it
+    (see drain) to the exposition, which merges the snapshots of the whole scrape and
+    adds them to the running totals it exports (see accumulate).
+    Histograms share fixed buckets, so merging only adds up the counts. Gauges hold a
+    current state rather than a count: draining keeps them and merging keeps the highest.
+
+    A span hook can be set to trace the stages as well: a callable taking the stage name
+    and its labels and returning a context manager, e.g. an OpenTelemetry tracer's
+    'lambda name, attributes: tracer.start_as_current_span(name, attributes=attributes)'.
+    The 'TelemetrySpanHook' setting ('module:attribute') loads one at startup.
+    """
+
+    _default: Optional["Telemetry"] = None
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS, span_hook: Optional[Callable[[str, dict], ContextManager]] = None) -> None:
+        self.buckets = tuple(buckets)
+        self.span_hook = span_hook
+        self._counters: dict[tuple, float] = {}
+        # per series, the count of each bucket (not cumulative, +Inf last) and the sum
+        self._histograms: dict[tuple, list] = {}
+        self._gauges: dict[tuple, float] = {}
+
+    @staticmethod
+    def default() -> "Telemetry":
+        """Returns the process-wide instance, with the span hook of the settings if any"""
+        if Telemetry._default is None:
+            Telemetry._default = Telemetry(span_hook=Telemetry._load_hook(os.getenv("TelemetrySpanHook", "")))
+        return Telemetry._default
+
+    @staticmethod
+    def _load_hook(path: str) -> Optional[Callable]:
+        if not path:
+            return None
+        try:
+            module, _, attribute = path.partition(":")
+            return getattr(importlib.import_module(module), attribute)
+        except Exception as ex:
+            logging.warning(f"Could not load the span hook '{path}', tracing is off: {ex}")
+            return None
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        """Adds value to a counter, name is given without the _total suffix"""
+        key = (name, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels):
+        self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        series = self._histograms.get(key)
+        if series is None:
+            series = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        index = next((i for i, bound in enumerate(self.buckets) if seconds <= bound), len(self.buckets))
+        series[0][index] += 1
+        series[1] += seconds
+
+    @contextmanager
+    def stage(self, name: str, **labels):
+        """Times the enclosed block as a pipeline stage, inside a span when a hook is set"""
+        span = self.span_hook(name, dict(labels)) if self.span_hook is not None else nullcontext()
+        t0 = perf_counter()
+        try:
+            with span:
+                yield
+        except BaseException:
+            self.inc("blobnfs_self_stage_errors", stage=name, **labels)
+            raise
+        finally:
+            self.observe("blobnfs_self_stage_seconds", perf_counter() - t0, stage=name, **labels)
+
+    def snapshot(self) -> dict:
+        """JSON-friendly copy of the counters and histograms"""
+        return {
+            "buckets": list(self.buckets),
+            "counters": [[name, dict(labels), value] for (name, labels), value in self._counters.items()],
+            "gauges": [[name, dict(labels), value] for (name, labels), value in self._gauges.items()],
+            "histograms": [
+                [name, dict(labels), list(counts), total]
+                for (name, labels), (counts, total) in self._histograms.items()
+            ]
+        }
+
+    def drain(self) -> dict:
+        """Returns the snapshot and starts over, so each observation is handed out once"""
+        snapshot = self.snapshot()
+        self._counters = {}
+        self._histograms = {}
+        return snapshot
+
+    @staticmethod
+    async def accumulate(store, snapshot: Optional[dict], name: str = TOTALS_NAME) -> dict:
+        """Adds the counts of a snapshot to the running totals kept in the result store, returns the totals
+
+        The snapshots handed between activities hold the counts since the previous one, while
+        exported counters and histograms must only go up. The exposition and the continuous
+        collector may add to the totals at the same time, so they are updated with the
+        conditional store.update. The gauges come from the snapshot, the stored totals have none.
+        """
+        cumulative = {}
+
+        def add(body: Optional[bytes]) -> str:
+            nonlocal cumulative
+            totals = Telemetry(tuple(snapshot["buckets"]) if snapshot else DEFAULT_BUCKETS)
+            if body is not None:
+                totals.merge(json.loads(body))
+            totals.merge(snapshot)
+            cumulative = totals.snapshot()
+            return json.dumps({**cumulative, "gauges": []})
+
+        await store.update(name, add)
+        return cumulative
+
+    def merge(self, snapshot: Optional[dict]):
+        """Adds the counts of a snapshot, e.g. the one of another activity"""
+        if not snapshot:
+            return
+        if tuple(snapshot["buckets"]) != self.buckets:
+            logging.warning("Telemetry snapshot with other histogram buckets, it is left out")
+            return
+        for name, labels, value in snapshot["counters"]:
+            self.inc(name, value, **labels)
+        for name, labels, value in snapshot.get("gauges", []):
+            key = (name, tuple(sorted(labels.items())))
+            self._gauges[key] = max(self._gauges.get(key, value), value)
+        for name, labels, counts, total in snapshot["histograms"]:
+            key = (name, tuple(sorted(labels.items())))
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0] = [a + b for a, b in zip(series[0], counts)]
+            series[1] += total
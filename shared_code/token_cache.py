@@ -0,0 +1,128 @@
+import asyncio
+import logging
+from time import time
+from typing import Optional
+
+from azure.core.credentials import AccessToken
+from azure.core.credentials_async import AsyncTokenCredential
+
+from shared_code.telemetry import Telemetry
+
+
+class CachedTokenCredential(AsyncTokenCredential):
+    """Shared credential wrapper that caches access tokens per scope set
+
+    Tokens are served from memory while valid. Once a token gets within
+    'refresh_margin' seconds of its expiry it is still served, and a single background
+    task fetches its replacement, so callers never wait on AAD for a cached scope.
+    The wrapper is meant to be shared by the whole process: leaving an
+    'async with credential' block does not close it, 'aclose' does.
+    """
+
+    def __init__(
+        self,
+        credential: AsyncTokenCredential,
+        refresh_margin: float = 300.0,
+        min_validity: float = 30.0
+    ) -> None:
+        self._credential = credential
+        self._refresh_margin = refresh_margin
+        self._min_validity = min_validity
+        self._tokens: dict[tuple, AccessToken] = {}
+        self._locks: dict[tuple, asyncio.Lock] = {}
+        self._refresh_tasks: dict[tuple, asyncio.Task] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "fetches": 0,
+            "refreshes": 0,
+            "errors": 0,
+            "fetch_seconds_total": 0.0,
+            "fetch_seconds_max": 0.0
+        }
+
+    async def get_token(self, *scopes: str, claims: Optional[str] = None, tenant_id: Optional[str] = None, **kwargs) -> AccessToken:
+        if claims is not None or tenant_id is not None:
+            # challenges and cross-tenant requests are never served from the cache
+            return await self._fetch(scopes, claims=claims, tenant_id=tenant_id, **kwargs)
+
+        self._check_loop()
+        key = tuple(sorted(scopes))
+        token = self._tokens.get(key)
+        remaining = token.expires_on - time() if token is not None else 0
+        if token is not None and remaining > self._min_validity:
+            self._stats["hits"] += 1
+            if remaining <= self._refresh_margin and key not in self._refresh_tasks:
+                self._refresh_tasks[key] = asyncio.create_task(self._refresh(key, scopes))
+            return token
+
+        self._stats["misses"] += 1
+        async with self._lock(key):
+            token = self._tokens.get(key)
+            if token is not None and token.expires_on - time() > self._min_validity:
+                return token
+            token = await self._fetch(scopes, **kwargs)
+            self._tokens[key] = token
+            return token
+
+    def stats(self) -> dict:
+        """Returns the token cache counters, hit rate and fetch latency"""
+        stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else None
+        stats["fetch_seconds_avg"] = stats["fetch_seconds_total"] / stats["fetches"] if stats["fetches"] else None
+        return stats
+
+    async def _fetch(self, scopes: tuple, **kwargs) -> AccessToken:
+        t0 = time()
+        try:
+            with Telemetry.default().stage("token"):
+                return await self._credential.get_token(*scopes, **kwargs)
+        except Exception:
+            self._stats["errors"] += 1
+            raise
+        finally:
+            elapsed = time() - t0
+            self._stats["fetches"] += 1
+            self._stats["fetch_seconds_total"] += elapsed
+            self._stats["fetch_seconds_max"] = max(self._stats["fetch_seconds_max"], elapsed)
+
+    async def _refresh(self, key: tuple, scopes: tuple):
+        try:
+            async with self._lock(key):
+                token = await self._fetch(scopes)
+                self._tokens[key] = token
+                self._stats["refreshes"] += 1
+        except Exception as ex:
+            logging.warning(f"Background token refresh failed, the cached token is kept: {ex}")
+        finally:
+            self._refresh_tasks.pop(key, None)
+
+    def _lock(self, key: tuple) -> asyncio.Lock:
+        if key not in self._locks:
+            self._locks[key] = asyncio.Lock()
+        return self._locks[key]
+
+    def _check_loop(self):
+        # locks and refresh tasks belong to the loop that created them
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._locks = {}
+            self._refresh_tasks = {}
+            self._loop = loop
+
+    async def close(self) -> None:
+        """No-op: the credential is shared by the process, use 'aclose' to release it"""
+
+    async def aclose(self) -> None:
+        for task in self._refresh_tasks.values():
+            task.cancel()
+        self._refresh_tasks = {}
+        await self._credential.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        pass
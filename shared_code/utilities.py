@@ -2,8 +2,8 @@ from typing import Any, Optional
 
 import json
 import asyncio
-import requests
 import logging
+from functools import lru_cache
 
 
 def list_to_chunks(lst: list, n: int):
@@ -13,11 +13,18 @@ def list_to_chunks(lst: list, n: int):
 
 
 async def gather_with_concurrency(n: int, *tasks):
-    """Limits tasks concurrency to n sized chunks"""
+    """Limits tasks concurrency to n
+
+    Each element must be a coroutine or a coroutine function, so that it only starts
+    once it holds the semaphore. Tasks created with asyncio.create_task are already
+    running and cannot be limited.
+    """
     semaphore = asyncio.Semaphore(n)
 
     async def sem_task(task):
         async with semaphore:
+            if callable(task):
+                task = task()
             return await task
     return await asyncio.gather(*(sem_task(task) for task in tasks))
 
@@ -28,6 +35,9 @@ async def post_message(url: str, payload: Any):
         logging.info('Notification url was not defined.')
         return None
 
+    # only needed for notifications, not worth its import time on every cold start
+    import requests
+
     headers = {
         'Content-Type': 'application/json'
     }
@@ -57,10 +67,11 @@ def extract_string(full_string: str, start_string:str, end_string: Optional[str]
     return name
 
 
+@lru_cache(maxsize=2**17)
 def get_resource_value(resource_uri: str, resource_name: str):
     """Gets the resource name based on resource type
     Function that returns the name of a resource from resource id/uri based on
-    resource type name.
+    resource type name. Results are cached, each ID is parsed once per process.
     Args:
         resource_uri (string): resource id/uri
         resource_name (string): Name of the resource type, e.g. capacityPools
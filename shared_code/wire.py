@@ -0,0 +1,100 @@
+import base64
+import json
+import logging
+import os
+import sys
+import zlib
+from typing import Optional, Sequence, Union
+
+WIRE_VERSION = 1
+# account fields used after the inventory: metric requests, batching and exposition labels
+ACCOUNT_FIELDS = ("id", "location", "subscriptionId", "Customerid", "Storageaccountname")
+
+
+class PayloadTooLargeError(ValueError):
+    """Raised when an encoded payload exceeds the 'WireMaxBytes' guard"""
+
+
+def encode_rows(rows: list[dict], fields: Sequence[str] = ACCOUNT_FIELDS) -> dict:
+    """Encodes rows in the compact wire schema used between the orchestrator and activities
+
+    Only the given fields are kept. Rows become columns of indices into a table of the
+    distinct values, so repeated values (subscription, region, customer) are sent once.
+    When the JSON form is larger than 'WireCompressMinBytes' (default 32 KiB) and
+    'WireCompression' is on, it is sent zlib-compressed and base64-encoded instead.
+    Raises PayloadTooLargeError beyond 'WireMaxBytes' (default 8 MiB).
+    """
+    return encode_columns({field: [row.get(field) for row in rows] for field in fields}, len(rows))
+
+
+def encode_columns(values: dict[str, list], n: int) -> dict:
+    """encode_rows for data already held by column, e.g. an AccountTable"""
+    strings = []
+    index = {}
+    columns = {}
+    for field, column_values in values.items():
+        column = []
+        for value in column_values:
+            position = index.get(value)
+            if position is None:
+                position = index[value] = len(strings)
+                strings.append(value)
+            column.append(position)
+        columns[field] = column
+
+    payload = {"v": WIRE_VERSION, "n": n, "strings": strings, "columns": columns}
+    text = json.dumps(payload, separators=(",", ":"))
+
+    compress = os.getenv("WireCompression", "true").strip().lower() == "true"
+    if compress and len(text) > int(os.getenv("WireCompressMinBytes", str(32 * 2**10))):
+        compressed = base64.b64encode(zlib.compress(text.encode(), 6)).decode()
+        payload = {"v": WIRE_VERSION, "z": compressed}
+        size = len(compressed)
+    else:
+        size = len(text)
+
+    max_bytes = int(os.getenv("WireMaxBytes", str(8 * 2**20)))
+    if size > max_bytes:
+        raise PayloadTooLargeError(
+            f"Payload of {n} rows is {size} bytes, more than the {max_bytes} allowed; "
+            f"lower the batch size"
+        )
+    return payload
+
+
+def decode_rows(payload: Optional[Union[dict, list]]) -> list[dict]:
+    """Decodes a payload of encode_rows, plain lists of rows are returned as they are"""
+    if payload is None:
+        return []
+    if isinstance(payload, list):
+        return payload
+    n, columns = decode_columns(payload)
+    rows = [{} for _ in range(n)]
+    for field, column in columns.items():
+        for row, value in zip(rows, column):
+            row[field] = value
+    return rows
+
+
+def decode_columns(payload: dict) -> tuple[int, dict[str, list]]:
+    """Decodes a payload of encode_rows into (number of rows, values of each field)
+
+    The distinct strings are interned once, so equal values of every row share one object.
+    """
+    if payload.get("v") != WIRE_VERSION:
+        raise ValueError(f"Unsupported wire payload version {payload.get('v')}")
+    if "z" in payload:
+        payload = json.loads(zlib.decompress(base64.b64decode(payload["z"])))
+
+    strings = [sys.intern(value) if isinstance(value, str) else value for value in payload["strings"]]
+    columns = {field: [strings[position] for position in column] for field, column in payload["columns"].items()}
+    return payload["n"], columns
+
+
+def encoded_size(payload) -> int:
+    """Size in bytes of a payload once serialized, for logging"""
+    try:
+        return len(json.dumps(payload, separators=(",", ":")))
+    except (TypeError, ValueError) as ex:
+        logging.warning(f"Could not measure payload size: {ex}")
+        return 0
@@ -0,0 +1,94 @@
+import asyncio
+import threading
+
+import pytest
+from aiohttp import web
+from azure.core.credentials import AccessToken
+from msrestazure.azure_cloud import Cloud, CloudEndpoints
+
+from benchmarks.fake_azure import FakeAzure
+from shared_code.circuit_breaker import CircuitBreaker
+from shared_code.latency import LatencyTracker
+from shared_code.scheduler import RequestScheduler
+from shared_code.telemetry import Telemetry
+
+
+class StaticTokenCredential:
+    """Credential that hands out a fixed token, the stand-in does not check it"""
+
+    async def get_token(self, *scopes, **kwargs) -> AccessToken:
+        return AccessToken("test-token", 2**31 - 1)
+
+    async def close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class _Server(threading.Thread):
+    """Serves an aiohttp app on a free local port from its own event loop"""
+
+    def __init__(self, app: web.Application) -> None:
+        super().__init__(daemon=True)
+        self.app = app
+        self.ready = threading.Event()
+        self.port = None
+        self.loop = None
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        runner = web.AppRunner(self.app)
+        self.loop.run_until_complete(runner.setup())
+        self.loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", 0).start())
+        self.port = runner.addresses[0][1]
+        self.ready.set()
+        self.loop.run_forever()
+        self.loop.run_until_complete(runner.cleanup())
+        self.loop.close()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.join()
+
+
+@pytest.fixture(autouse=True)
+def fresh_defaults(monkeypatch):
+    """Every test starts with new process-wide schedulers, trackers, breakers and telemetry"""
+    for cls in (RequestScheduler, LatencyTracker, CircuitBreaker, Telemetry):
+        monkeypatch.setattr(cls, "_default", None)
+
+
+@pytest.fixture
+def credential() -> StaticTokenCredential:
+    return StaticTokenCredential()
+
+
+@pytest.fixture
+def fake_azure(monkeypatch, tmp_path):
+    """Starts benchmarks.fake_azure with the given options, returns it with a cloud pointing at it
+
+    The metric batch endpoint and the state store are redirected as well, and hedging is off
+    so the request counts are exact.
+    """
+    servers = []
+
+    def serve(**options) -> tuple[FakeAzure, Cloud]:
+        fake = FakeAzure(**{"latency": 0.001, "jitter": 0.0, **options})
+        server = _Server(fake.app())
+        server.start()
+        server.ready.wait(10)
+        servers.append(server)
+        url = f"http://127.0.0.1:{server.port}"
+        monkeypatch.setenv("MetricsBatchEndpoint", url)
+        monkeypatch.setenv("StateStoreBackend", "local")
+        monkeypatch.setenv("StateStorePath", str(tmp_path / "state"))
+        monkeypatch.setenv("HedgeRequests", "false")
+        return fake, Cloud("LocalStandIn", endpoints=CloudEndpoints(resource_manager=url, active_directory=url))
+
+    yield serve
+    for server in servers:
+        server.stop()
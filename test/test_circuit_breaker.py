@@ -0,0 +1,52 @@
+import shared_code.circuit_breaker as circuit_breaker
+from shared_code.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def breaker(monkeypatch) -> tuple[CircuitBreaker, Clock]:
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker, "monotonic", clock)
+    return CircuitBreaker(failure_threshold=5, open_seconds=60.0, max_open_seconds=600.0), clock
+
+
+def test_failures_while_open_do_not_escalate(monkeypatch):
+    scope = "metrics/key/subscription"
+    cb, clock = breaker(monkeypatch)
+    # a burst of concurrent calls that all fail, most of them after the scope opened
+    for _ in range(20):
+        cb.record_failure(scope)
+    assert cb.state(scope) == OPEN
+    assert cb._scopes[scope]["open_for"] == 60.0
+    clock.now += 59.0
+    assert cb.state(scope) == OPEN
+    clock.now += 1.0
+    assert cb.state(scope) == HALF_OPEN
+
+
+def test_failed_probe_doubles_open_period(monkeypatch):
+    scope = "metrics/key/subscription"
+    cb, clock = breaker(monkeypatch)
+    for _ in range(5):
+        cb.record_failure(scope)
+    for expected in (120.0, 240.0, 480.0, 600.0, 600.0):
+        clock.now += cb._scopes[scope]["open_for"]
+        assert cb.allow(scope)
+        cb.record_failure(scope)
+        assert cb.state(scope) == OPEN
+        assert cb._scopes[scope]["open_for"] == expected
+
+    clock.now += 600.0
+    assert cb.allow(scope)
+    cb.record_success(scope)
+    assert cb.state(scope) == CLOSED
+    # once closed, the next opening starts over from the base period
+    for _ in range(5):
+        cb.record_failure(scope)
+    assert cb._scopes[scope]["open_for"] == 60.0
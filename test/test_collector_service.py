@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+from services.collector_service import CollectorService
+
+HOUR = 3600.0
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    for name, value in {
+        "CollectorPointSeconds": "3600",
+        "CollectorIngestionDelaySeconds": "600",
+        "CollectorRetrySeconds": "300",
+        "CollectorChangeAlpha": "0.5",
+        "CollectorMinPeriodSeconds": "3600",
+        "CollectorMaxPeriodSeconds": "21600",
+        "CollectorHeadroom": "1",
+        "CollectorMaxPerTick": "5000"
+    }.items():
+        monkeypatch.setenv(name, value)
+
+
+def fetched(schedule: dict, next_due: list, last_fetch: float = 0.0) -> dict:
+    schedule["next_due"][:] = next_due
+    schedule["last_fetch"][:] = last_fetch
+    return schedule
+
+
+def test_align_keeps_known_accounts_and_adds_new_ones_due():
+    schedule = CollectorService.align(None, ["a", "b"], ["s1/eastus", "s2/eastus"])
+    schedule = fetched(schedule, [100.0, 200.0])
+    schedule["period"][1] = 2 * HOUR
+    aligned = CollectorService.align(schedule, ["b", "c"], ["s2/eastus", "s1/eastus"])
+    assert aligned["keys"] == ["b", "c"]
+    assert aligned["next_due"].tolist() == [200.0, 0.0]
+    assert aligned["period"].tolist() == [2 * HOUR, HOUR]
+    assert aligned["last_fetch"][0] == 0.0 and np.isnan(aligned["last_fetch"][1])
+    # the phase follows the group, not the position
+    assert aligned["phase"][1] == schedule["phase"][0]
+
+
+def test_select_takes_the_most_overdue_within_the_budget():
+    schedule = CollectorService.align(None, [str(i) for i in range(6)], ["g"] * 6)
+    schedule = fetched(schedule, [50.0, 10.0, 500.0, 30.0, 20.0, 40.0])
+    # six accounts refreshed hourly need 6 refreshes per hour, 3 for half an hour
+    due = CollectorService.select(schedule, now=100.0, elapsed=HOUR / 2)
+    assert due.tolist() == [1, 4, 3]
+    assert CollectorService.select(schedule, now=100.0, elapsed=HOUR).tolist() == [1, 4, 3, 5, 0]
+
+
+def test_select_takes_accounts_never_fetched_first(monkeypatch):
+    monkeypatch.setenv("CollectorMaxPerTick", "3")
+    schedule = CollectorService.align(None, [str(i) for i in range(6)], ["g"] * 6)
+    schedule = fetched(schedule, [10.0, 20.0, 30.0, 40.0, 50.0, 60.0])
+    schedule["last_fetch"][[2, 4, 5]] = np.nan
+    due = CollectorService.select(schedule, now=100.0, elapsed=HOUR)
+    # three due accounts fill the tick, the new ones wait
+    assert due.tolist() == [0, 1, 3]
+    due = CollectorService.select(schedule, now=100.0, elapsed=HOUR / 3)
+    assert due.tolist() == [2, 4, 0]
+
+
+def test_reschedule_waits_for_the_next_point():
+    schedule = CollectorService.align(None, ["a", "b"], ["g", "g"])
+    schedule = fetched(schedule, [0.0, 0.0])
+    now = 10 * HOUR
+    indices = np.array([0, 1])
+    CollectorService.reschedule(
+        schedule, indices,
+        times_before=np.array([8 * HOUR, 8 * HOUR]),
+        times_after=np.array([9 * HOUR, 9 * HOUR]),
+        changed=np.array([True, False]),
+        now=now
+    )
+    phase = schedule["phase"][0] * HOUR
+    # a changing account stays hourly, an unchanged one halves its change rate
+    assert schedule["change_rate"].tolist() == [1.0, 0.5]
+    assert schedule["period"].tolist() == [HOUR, 2 * HOUR]
+    assert schedule["next_due"].tolist() == [10 * HOUR + 600 + phase, 11 * HOUR + 600 + phase]
+    assert schedule["last_fetch"].tolist() == [now, now]
+
+
+def test_reschedule_retries_failed_and_late_accounts():
+    schedule = CollectorService.align(None, ["a", "b", "c"], ["g", "g", "g"])
+    schedule = fetched(schedule, [0.0, 0.0, 0.0])
+    now = 10 * HOUR
+    CollectorService.reschedule(
+        schedule, np.array([0, 1, 2]),
+        times_before=np.array([8 * HOUR, 8 * HOUR, np.nan]),
+        # no answer, no new point, a point whose successor is already overdue
+        times_after=np.array([np.nan, 8 * HOUR, 5 * HOUR]),
+        changed=np.array([False, False, True]),
+        now=now
+    )
+    assert schedule["next_due"].tolist() == [now + 300] * 3
+    # only a new point after a known one teaches the change rate
+    assert schedule["change_rate"].tolist() == [1.0, 1.0, 1.0]
+
+
+def test_schedule_round_trips_through_json():
+    schedule = CollectorService.align(None, ["a", "b"], ["g", "h"])
+    schedule["next_due"][0] = 42.0
+    restored = CollectorService.from_json(CollectorService.to_json(schedule))
+    assert restored["keys"] == ["a", "b"]
+    for column in ("phase", "period", "next_due", "change_rate", "last_fetch"):
+        np.testing.assert_array_equal(restored[column], schedule[column])
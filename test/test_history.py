@@ -0,0 +1,63 @@
+import numpy as np
+
+from shared_code.history import MetricHistory
+
+
+def test_append_skips_points_already_stored(tmp_path):
+    history = MetricHistory(str(tmp_path), capacity=100)
+    assert history.append("UsedCapacity", "average", ["a", "a", "b"], [10.0, 20.0, 10.0], [1.0, 2.0, 5.0]) == 3
+    # the next scrape overlaps the previous window and repeats a point within itself
+    assert history.append("UsedCapacity", "average", ["a", "a", "a", "b"], [20.0, 30.0, 30.0, 5.0], [2.0, 3.0, 3.0, 4.0]) == 1
+    records = history.read("UsedCapacity", "average")
+    assert records["time"].tolist() == [10.0, 10.0, 20.0, 30.0]
+    assert records["value"].tolist() == [1.0, 5.0, 2.0, 3.0]
+
+
+def test_append_skips_missing_values(tmp_path):
+    history = MetricHistory(str(tmp_path), capacity=100)
+    assert history.append("UsedCapacity", "average", ["a", "b"], [10.0, float("nan")], [float("nan"), 1.0]) == 0
+
+
+def test_dedup_sees_the_appends_of_another_instance(tmp_path):
+    first = MetricHistory(str(tmp_path), capacity=100)
+    second = MetricHistory(str(tmp_path), capacity=100)
+    first.append("UsedCapacity", "average", ["a"], [10.0], [1.0])
+    assert second.append("UsedCapacity", "average", ["a", "a"], [10.0, 20.0], [1.0, 2.0]) == 1
+    assert first.read("UsedCapacity", "average")["time"].tolist() == [10.0, 20.0]
+
+
+def test_ring_wraps_around_keeping_the_newest_points(tmp_path):
+    history = MetricHistory(str(tmp_path), capacity=8)
+    for scrape in range(5):
+        times = [scrape * 10.0 + offset for offset in range(3)]
+        history.append("UsedCapacity", "average", ["a"] * 3, times, times)
+    records = history.read("UsedCapacity", "average")
+    assert records["time"].tolist() == [21.0, 22.0, 30.0, 31.0, 32.0, 40.0, 41.0, 42.0]
+    assert history.stats()["series"]["UsedCapacity/average"] == {"points": 8, "written": 15}
+    # the window straddles the end of the file
+    assert history.read("UsedCapacity", "average", start=22.0, end=40.0)["time"].tolist() == [22.0, 30.0, 31.0, 32.0, 40.0]
+
+
+def test_read_filters_by_account(tmp_path):
+    history = MetricHistory(str(tmp_path), capacity=100)
+    history.append("UsedCapacity", "average", ["a", "b", "c"], [10.0, 10.0, 10.0], [1.0, 2.0, 3.0])
+    records = history.read("UsedCapacity", "average", keys=["c", "a", "unknown"])
+    assert records["value"].tolist() == [1.0, 3.0]
+    assert len(history.read("UsedCapacity", "average", keys=["unknown"])) == 0
+    assert len(history.read("Transactions", "total")) == 0
+
+
+def test_matrix_rows_are_right_aligned(tmp_path):
+    history = MetricHistory(str(tmp_path), capacity=100)
+    history.append("UsedCapacity", "average", ["a", "a", "a", "b"], [10.0, 20.0, 30.0, 20.0], [1.0, 2.0, 3.0, 7.0])
+    history.append("UsedCapacity", "average", ["b", "c"], [40.0, 5.0], [8.0, 9.0])
+    times, values = history.matrix("UsedCapacity", "average", ["b", "unknown", "a"], start=10.0)
+    nan = np.nan
+    np.testing.assert_array_equal(times, [[nan, 20.0, 40.0], [nan, nan, nan], [10.0, 20.0, 30.0]])
+    np.testing.assert_array_equal(values, [[nan, 7.0, 8.0], [nan, nan, nan], [1.0, 2.0, 3.0]])
+
+
+def test_matrix_of_an_empty_history(tmp_path):
+    history = MetricHistory(str(tmp_path), capacity=100)
+    times, values = history.matrix("UsedCapacity", "average", ["a", "b"])
+    assert times.shape == values.shape == (2, 0)
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from services.monitor_service import BATCH_MAX_RESOURCES, MonitorService
+from shared_code.client_pool import ClientPool
+
+
+def fetch(credential, cloud, rows, **options) -> list[dict]:
+    async def run():
+        try:
+            return await MonitorService.get_metrics_for_data(
+                credential=credential,
+                data=rows,
+                metricnames="UsedCapacity",
+                timeout=10.0,
+                cloud=cloud,
+                use_batch=True,
+                credential_key="test",
+                latest_only=True,
+                incremental=False,
+                analytics=False,
+                breaker=False,
+                history=False,
+                **options
+            )
+        finally:
+            await ClientPool.close()
+
+    return asyncio.run(run())
+
+
+def test_batches_are_chunked(fake_azure, credential):
+    fake, cloud = fake_azure(accounts=2 * BATCH_MAX_RESOURCES + 20, subscriptions=1, regions=1)
+    output = fetch(credential, cloud, fake.rows)
+    assert sorted(fake.batch_sizes) == [20, BATCH_MAX_RESOURCES, BATCH_MAX_RESOURCES]
+    assert fake.counts["metrics"] == 0
+    assert all(row["metrics"]["UsedCapacity"]["average"] is not None for row in output)
+
+
+def test_batches_are_split_by_subscription_and_region(fake_azure, credential):
+    fake, cloud = fake_azure(accounts=60, subscriptions=2, regions=3)
+    fetch(credential, cloud, fake.rows)
+    # the stand-in deals the accounts round-robin, 6 groups of 10
+    assert fake.batch_sizes == [10] * 6
+
+
+@pytest.mark.parametrize("status", [400, 404])
+def test_rejected_batches_fall_back_to_single_requests(fake_azure, credential, status):
+    fake, cloud = fake_azure(accounts=60, subscriptions=1, regions=1)
+    fake.batch_status = status
+    output = fetch(credential, cloud, fake.rows)
+    assert fake.counts["metrics_batch"] == 2
+    assert fake.counts["metrics"] == 60
+    assert all(row["metrics"]["UsedCapacity"]["average"] is not None for row in output)
+
+
+@pytest.mark.parametrize("status", [403, 500])
+def test_failed_batches_do_not_fall_back(fake_azure, credential, monkeypatch, status):
+    monkeypatch.setenv("RequestRetries", "0")
+    fake, cloud = fake_azure(accounts=60, subscriptions=1, regions=1)
+    fake.batch_status = status
+    output = fetch(credential, cloud, fake.rows)
+    assert fake.counts["metrics_batch"] == 2
+    assert fake.counts["metrics"] == 0
+    assert all(row["metrics"] is None for row in output)
+
+
+def test_resources_without_region_use_single_requests(fake_azure, credential):
+    fake, cloud = fake_azure(accounts=5, subscriptions=1, regions=1)
+    rows = [{**row, "location": None} for row in fake.rows]
+    output = fetch(credential, cloud, rows)
+    assert fake.counts["metrics_batch"] == 0
+    assert fake.counts["metrics"] == 5
+    assert all(row["metrics"]["UsedCapacity"]["average"] is not None for row in output)
@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta
+
+import pytest
+from azure.durable_functions.models.Task import TaskState
+
+from shared_code.orchestration import child_deadline, fan_out, merge_summaries
+
+
+class Task:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.state = TaskState.RUNNING
+        self.result = None
+        self.cancelled = False
+
+    @property
+    def is_completed(self) -> bool:
+        return self.state is not TaskState.RUNNING
+
+    def finish(self, result=None, failed: bool = False):
+        self.state = TaskState.FAILED if failed else TaskState.SUCCEEDED
+        self.result = result
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Context:
+    """Orchestration context that records the tasks created, the test completes them"""
+
+    def __init__(self) -> None:
+        self.tasks = {}
+        self.timer = None
+
+    def call(self, name: str):
+        def create():
+            self.tasks[name] = Task(name)
+            return self.tasks[name]
+
+        return create
+
+    def create_timer(self, deadline):
+        self.timer = Task("timer")
+        return self.timer
+
+    def task_any(self, tasks):
+        return list(tasks)
+
+
+def outcome(steps, winner):
+    """Sends the last completed task, fan_out must return"""
+    with pytest.raises(StopIteration) as stop:
+        steps.send(winner)
+    return stop.value.value
+
+
+def test_fan_out_keeps_width_tasks_pending():
+    context = Context()
+    steps = fan_out(context, [context.call(str(i)) for i in range(5)], 2)
+    waiting = next(steps)
+    assert [task.name for task in waiting] == ["0", "1"]
+    context.tasks["1"].finish("one")
+    waiting = steps.send(context.tasks["1"])
+    assert [task.name for task in waiting] == ["0", "2"]
+    for name in ("0", "2"):
+        context.tasks[name].finish(name)
+    waiting = steps.send(context.tasks["0"])
+    assert [task.name for task in waiting] == ["3", "4"]
+    context.tasks["3"].finish(failed=True)
+    context.tasks["4"].finish(None)
+    results, failed, timed_out = outcome(steps, context.tasks["3"])
+    assert results == ["0", "one", "2", None, None]
+    assert (failed, timed_out) == (2, 0)
+
+
+def test_fan_out_returns_partial_results_at_the_deadline():
+    context = Context()
+    steps = fan_out(context, [context.call(str(i)) for i in range(5)], 2, datetime(2030, 1, 1))
+    waiting = next(steps)
+    assert waiting[-1] is context.timer
+    context.tasks["0"].finish("zero")
+    waiting = steps.send(context.tasks["0"])
+    assert [task.name for task in waiting] == ["1", "2", "timer"]
+    context.timer.finish()
+    results, failed, timed_out = outcome(steps, context.timer)
+    assert results == ["zero", None, None, None, None]
+    # 2 pending when the timer fired, 2 never started
+    assert (failed, timed_out) == (0, 4)
+    assert not context.timer.cancelled
+
+
+def test_fan_out_cancels_the_timer_when_done_first():
+    context = Context()
+    steps = fan_out(context, [context.call("0")], 1, datetime(2030, 1, 1))
+    next(steps)
+    context.tasks["0"].finish("zero")
+    assert outcome(steps, context.tasks["0"]) == (["zero"], 0, 0)
+    assert context.timer.cancelled
+
+
+def test_child_deadline_reports_before_the_parent():
+    deadline = datetime(2030, 1, 1, 12)
+    assert child_deadline(deadline.isoformat(), 30) == deadline - timedelta(seconds=30)
+    assert child_deadline(None, 30) is None
+
+
+def test_merge_summaries_skips_missing_shards():
+    merged = merge_summaries([
+        {"parts": ["a"], "accounts": 3, "failed": 1, "timed_out": 0},
+        None,
+        {"parts": ["b", "c"], "accounts": 5, "failed": 0, "timed_out": 2}
+    ])
+    assert merged == {"parts": ["a", "b", "c"], "accounts": 8, "failed": 1, "timed_out": 2}
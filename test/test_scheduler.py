@@ -0,0 +1,156 @@
+import asyncio
+from time import monotonic
+
+import aiohttp
+import pytest
+
+import shared_code.scheduler as scheduler
+from shared_code.scheduler import RequestScheduler
+
+SPARE = {"x-ms-ratelimit-remaining-subscription-reads": "11999"}
+LOW = {"x-ms-ratelimit-remaining-subscription-reads": "10"}
+
+
+def respond(headers: dict):
+    async def call(slot):
+        slot.observe(200, headers)
+        return "ok"
+
+    return call
+
+
+def throttled(retry_after: str) -> aiohttp.ClientResponseError:
+    return aiohttp.ClientResponseError(None, (), status=429, headers={"Retry-After": retry_after})
+
+
+def test_spare_quota_increases_the_limit_additively():
+    rs = RequestScheduler(initial_concurrency=4, max_concurrency=6)
+
+    async def run():
+        for _ in range(4):
+            await rs.run("subscription", respond(SPARE))
+
+    asyncio.run(run())
+    # roughly one slot per full window of successful calls
+    assert 4.9 < rs.limit < 5.0
+
+
+def test_the_limit_stays_within_its_bounds():
+    rs = RequestScheduler(min_concurrency=2, initial_concurrency=4, max_concurrency=5)
+
+    async def run():
+        for _ in range(50):
+            await rs.run("subscription", respond(SPARE))
+
+    asyncio.run(run())
+    assert rs.limit == 5
+    rs._decrease()
+    rs._last_decrease = 0.0
+    rs._decrease()
+    assert rs.limit == 2
+
+
+def test_low_quota_decreases_the_limit_once_per_second(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(scheduler, "monotonic", lambda: now[0])
+    rs = RequestScheduler(initial_concurrency=8)
+
+    async def run():
+        await rs.run("subscription", respond(LOW))
+        await rs.run("subscription", respond(LOW))
+        assert rs.limit == 4
+        now[0] += 1.0
+        await rs.run("subscription", respond(LOW))
+        assert rs.limit == 2
+
+    asyncio.run(run())
+
+
+def test_throttled_calls_are_retried_after_retry_after():
+    rs = RequestScheduler(initial_concurrency=8)
+    attempts = []
+
+    async def call(slot):
+        attempts.append(monotonic())
+        if len(attempts) == 1:
+            raise throttled("0.2")
+        return "ok"
+
+    assert asyncio.run(rs.run("subscription", call)) == "ok"
+    assert attempts[1] - attempts[0] >= 0.2
+    assert rs.stats()["throttled"] == 1
+    assert rs.stats()["retries"] == 1
+    # halved by the 429, then the successful retry adds a fraction of a slot
+    assert 4 < rs.limit < 5
+    assert rs.in_flight == 0
+
+
+def test_throttling_gives_up_after_max_retries():
+    rs = RequestScheduler(max_retries=2)
+    attempts = []
+
+    async def call(slot):
+        attempts.append(slot)
+        raise throttled("0")
+
+    with pytest.raises(aiohttp.ClientResponseError):
+        asyncio.run(rs.run("subscription", call))
+    assert len(attempts) == 3
+    assert rs.in_flight == 0
+
+
+def test_other_errors_are_not_retried():
+    rs = RequestScheduler()
+    attempts = []
+
+    async def call(slot):
+        attempts.append(slot)
+        raise aiohttp.ClientResponseError(None, (), status=403)
+
+    with pytest.raises(aiohttp.ClientResponseError):
+        asyncio.run(rs.run("subscription", call))
+    assert len(attempts) == 1
+    assert rs.stats()["throttled"] == 0
+
+
+def test_concurrency_never_exceeds_the_limit():
+    rs = RequestScheduler(initial_concurrency=3, max_concurrency=3)
+    running = [0, 0]
+
+    async def call(slot):
+        running[0] += 1
+        running[1] = max(running[1], running[0])
+        await asyncio.sleep(0.01)
+        running[0] -= 1
+
+    async def run():
+        await asyncio.gather(*(rs.run("subscription", call) for _ in range(12)))
+
+    asyncio.run(run())
+    assert running[1] == 3
+
+
+def test_throttled_calls_against_the_stand_in(fake_azure):
+    fake, cloud = fake_azure(throttle_rate=1.0, retry_after=0.1)
+    rs = RequestScheduler(max_retries=1)
+    url = f"{cloud.endpoints.resource_manager}/subscriptions"
+
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            async def call(slot):
+                if fake.counts["subscriptions"] == 1:
+                    # the retry goes through
+                    fake.throttle_rate = 0.0
+                async with session.get(url) as response:
+                    slot.observe(response.status, response.headers)
+                    response.raise_for_status()
+                    return await response.json()
+
+            return await rs.run("tenant", call)
+
+    t0 = monotonic()
+    body = asyncio.run(run())
+    assert len(body["value"]) == len(fake.subscriptions)
+    assert fake.counts["subscriptions"] == 2
+    assert fake.throttled == 1
+    assert monotonic() - t0 >= 0.1
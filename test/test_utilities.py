@@ -0,0 +1,41 @@
+import asyncio
+
+from shared_code.utilities import gather_with_concurrency, list_to_chunks
+
+
+def test_gather_with_concurrency_starts_calls_lazily():
+    started = []
+    running = [0, 0]
+
+    def job(i: int):
+        async def run():
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+            await asyncio.sleep(0.01)
+            running[0] -= 1
+            return i
+
+        def start():
+            # the coroutine only exists once the job holds the semaphore
+            started.append((i, running[0]))
+            return run()
+
+        return start
+
+    results = asyncio.run(gather_with_concurrency(2, *(job(i) for i in range(7))))
+    assert results == list(range(7))
+    assert running[1] == 2
+    assert [i for i, _ in started] == list(range(7))
+    assert all(before < 2 for _, before in started)
+
+
+def test_gather_with_concurrency_accepts_coroutines():
+    async def double(i: int):
+        await asyncio.sleep(0)
+        return 2 * i
+
+    assert asyncio.run(gather_with_concurrency(3, *(double(i) for i in range(5)))) == [0, 2, 4, 6, 8]
+
+
+def test_list_to_chunks():
+    assert list(list_to_chunks(list(range(7)), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
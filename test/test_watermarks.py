@@ -0,0 +1,114 @@
+import asyncio
+
+from services.monitor_service import MonitorService
+from shared_code.client_pool import ClientPool
+from shared_code.state_store import LocalStateStore
+
+METRIC_SET = {"UsedCapacity": ["average"], "Transactions": ["total"]}
+TIMESTAMP = "2030-01-01T12:00:00"
+ACCOUNT = "/subscriptions/s1/resourceGroups/rg/providers/Microsoft.Storage/storageAccounts/a"
+
+
+def metric(**latest) -> dict:
+    """Fetched metrics with the given newest point per metric name, as (time stamp, value)"""
+    return {
+        name: {"resource": [{"latest": {"time_stamp": time_stamp, next(iter(METRIC_SET[name])): value}}]}
+        for name, (time_stamp, value) in latest.items()
+    }
+
+
+def apply(store, watermarks: dict, metrics: list):
+    return asyncio.run(MonitorService._apply_watermarks(
+        store, "key", [ACCOUNT] * len(metrics), metrics, watermarks, METRIC_SET, {"hours": 1}, TIMESTAMP
+    ))
+
+
+def stored(time_stamp: str, value: float) -> dict:
+    return {"time_stamp": time_stamp, "values": {"average": value}}
+
+
+def test_new_points_advance_the_watermarks(tmp_path):
+    store = LocalStateStore("watermarks", str(tmp_path))
+    values, stale, times = apply(store, {}, [metric(UsedCapacity=("2030-01-01T11:55:00Z", 10.0))])
+    assert values == [{"UsedCapacity": {"average": 10.0}}]
+    assert stale == [False]
+    saved = asyncio.run(store.get_all("key:s1"))
+    assert list(saved.values()) == [{"UsedCapacity": {"time_stamp": "2030-01-01T11:55:00Z", "values": {"average": 10.0}}}]
+
+
+def test_metrics_without_a_new_point_keep_their_value_inside_the_range(tmp_path):
+    store = LocalStateStore("watermarks", str(tmp_path))
+    key = "/subscriptions/s1/resourcegroups/rg/providers/microsoft.storage/storageaccounts/a"
+    watermarks = {key: {
+        "UsedCapacity": stored("2030-01-01T11:10:00", 7.0),
+        # older than the range, a full request would not have returned it either
+        "Transactions": stored("2030-01-01T10:30:00", 3.0)
+    }}
+    values, stale, _ = apply(store, watermarks, [metric(UsedCapacity=("2030-01-01T11:55:00Z", 8.0))])
+    assert values == [{"UsedCapacity": {"average": 8.0}}]
+    values, stale, _ = apply(store, watermarks, [metric()])
+    assert values == [{"UsedCapacity": {"average": 7.0}}]
+    assert stale == [False]
+
+
+def test_failed_fetches_serve_the_stored_values_as_stale(tmp_path, monkeypatch):
+    monkeypatch.setenv("StaleValueMaxSeconds", "7200")
+    store = LocalStateStore("watermarks", str(tmp_path))
+    key = "/subscriptions/s1/resourcegroups/rg/providers/microsoft.storage/storageaccounts/a"
+    watermarks = {key: {
+        # outside the range but within the stale period
+        "UsedCapacity": stored("2030-01-01T10:30:00", 7.0),
+        "Transactions": stored("2030-01-01T09:30:00", 3.0)
+    }}
+    values, stale, times = apply(store, watermarks, [None])
+    assert values == [{"UsedCapacity": {"average": 7.0}}]
+    assert stale == [True]
+
+
+def test_the_window_starts_at_the_oldest_watermark(monkeypatch):
+    monkeypatch.setenv("MetricsWatermarkOverlapMinutes", "5")
+    watermark = {
+        "UsedCapacity": {"time_stamp": "2030-01-01T11:50:00"},
+        "Transactions": {"time_stamp": "2030-01-01T11:40:00"}
+    }
+    assert MonitorService._watermark_range(watermark, METRIC_SET, {"hours": 1}, TIMESTAMP) == {"seconds": 25 * 60.0}
+    # a metric without a watermark needs the whole range
+    assert MonitorService._watermark_range({"UsedCapacity": watermark["UsedCapacity"]}, METRIC_SET, {"hours": 1}, TIMESTAMP) == {"seconds": 3600.0}
+
+
+def test_incremental_fetches_only_request_the_new_points(fake_azure, credential):
+    fake, cloud = fake_azure(accounts=20, subscriptions=2, regions=1, points=60)
+
+    def fetch():
+        async def run():
+            try:
+                return await MonitorService.get_metrics_for_data(
+                    credential=credential,
+                    data=fake.rows,
+                    metricnames="UsedCapacity",
+                    timeout=10.0,
+                    cloud=cloud,
+                    credential_key="test",
+                    incremental=True,
+                    breaker=False,
+                    analytics=False,
+                    history=False
+                )
+            finally:
+                await ClientPool.close()
+
+        fake.reset()
+        return asyncio.run(run())
+
+    first = fetch()
+    full = fake.bytes_sent
+    second = fetch()
+    # the overlap and the response envelope remain
+    assert fake.bytes_sent < full / 2
+    assert [row["metrics"] for row in second] == [row["metrics"] for row in first]
+
+    # the accounts of a subscription that fails keep their last values, marked stale
+    fake.broken = {fake.subscriptions[0]}
+    third = fetch()
+    assert [row["metrics"] for row in third] == [row["metrics"] for row in first]
+    assert [row.get("stale", False) for row in third] == [row["subscriptionId"] == fake.subscriptions[0] for row in fake.rows]